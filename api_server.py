@@ -6,17 +6,31 @@ FastAPIを使用してOpenSMILE感情分析機能をREST APIとして提供す
 ダッシュボードやWebアプリケーションから呼び出し可能。
 """
 
-from fastapi import FastAPI, BackgroundTasks, HTTPException
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Awaitable, TYPE_CHECKING
 import uuid
+import asyncio
 import json
 import os
+import threading
+import time
 from datetime import datetime
 import logging
 
-from opensmile_aggregator import OpenSMILEAggregator
+from resilience import StorageUnavailableError
+from state_store import derived_state_enabled
+from storage_backend import StorageBackend, create_storage_service, load_environment
+from task_store import TERMINAL_STATUSES, TaskStore, create_task_store, default_worker_id
+from stale_scheduler import StaleDayScheduler
+
+# 集計処理のモジュール（yaml・supabase・multiprocessingを読み込む）は起動を速くするため初回利用時に読み込む
+if TYPE_CHECKING:
+    from opensmile_aggregator import OpenSMILEAggregator
+    from ingest_accumulator import IngestAccumulator
+    from parallel_executor import ParallelAggregationExecutor
 
 # FastAPIアプリ設定
 app = FastAPI(
@@ -38,8 +52,59 @@ app.add_middleware(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# タスク状況管理
-task_status: Dict[str, Dict[str, Any]] = {}
+# タスク状況管理（TASK_STOREで共有ストアを選ぶと複数ワーカー・複数レプリカで共有される）
+# .envを読み込んでから生成するため、起動時（startup）に初期化する
+task_store: Optional[TaskStore] = None
+
+# このプロセスのワーカーID（タスクの実行権の取得に使う）
+WORKER_ID = default_worker_id()
+
+# タスク実行権のリース（秒）。期限を過ぎた実行前・実行中のタスクは他のワーカーが引き継ぐ
+# 起動時に環境変数TASK_LEASE_SECONDSで上書きする
+TASK_LEASE_SECONDS = 600.0
+
+# リース切れタスクの引き継ぎ確認間隔（秒）
+ORPHAN_SWEEP_INTERVAL_SECONDS = 60
+
+# 共有ストア使用時に他プロセスでの変化を確認する間隔（秒）
+TASK_STORE_POLL_SECONDS = 0.5
+
+# タスク状況の変化通知（変化のたびにsetして差し替える）
+# 長ポーリング・SSEの待機者がいるタスクだけ保持し、最後の待機者が離れたら解放する
+task_events: Dict[str, asyncio.Event] = {}
+task_waiters: Dict[str, int] = {}
+
+# 長ポーリング・SSEで変化とみなすフィールド（リース延長などの内部フィールドの更新では応答しない）
+TASK_VISIBLE_FIELDS = ("status", "message", "progress", "result", "error")
+
+# 長ポーリングの最大待機秒数（Nginxのタイムアウト180秒より短くする）
+MAX_STATUS_WAIT_SECONDS = 60
+
+# SSEのキープアライブ間隔（秒）
+SSE_KEEPALIVE_SECONDS = 15
+
+# 同期エンドポイントの待ち時間（秒）。超えた場合はタスクIDを返してバックグラウンドで継続する
+# 起動時に環境変数SYNC_TIMEOUT_SECONDSで上書きする
+SYNC_TIMEOUT_SECONDS = 10.0
+MAX_SYNC_TIMEOUT_SECONDS = 30.0
+
+# 未集計デバイス日のスケジューラー（起動時に初期化、STALE_SWEEP_INTERVAL_SECONDS > 0 で定期スイープ）
+stale_scheduler: Optional[StaleDayScheduler] = None
+
+# 集計処理で共有するオブジェクト（ウォームアップまたは初回利用時に生成）
+_shared_lock = threading.Lock()
+_storage_service: Optional[StorageBackend] = None
+_aggregator: Optional["OpenSMILEAggregator"] = None
+_ingest_accumulator: Optional["IngestAccumulator"] = None
+_parallel_executor: Optional["ParallelAggregationExecutor"] = None
+
+# ウォームアップ（モジュール読み込み・クライアント生成）の状況。完了するまで /ready は503を返す
+warmup_state: Dict[str, Any] = {"ready": False, "error": None, "seconds": None}
+
+ingest_flush_task: Optional[asyncio.Task] = None
+orphan_sweep_task: Optional[asyncio.Task] = None
+stale_scheduler_task: Optional[asyncio.Task] = None
+warmup_task: Optional[asyncio.Task] = None
 
 
 class AnalysisRequest(BaseModel):
@@ -48,6 +113,34 @@ class AnalysisRequest(BaseModel):
     date: str  # YYYY-MM-DD形式
 
 
+class SyncAnalysisRequest(AnalysisRequest):
+    """同期分析リクエストモデル"""
+    persist: bool = True  # Falseの場合はaudio_aggregatorに保存せず結果だけ返す
+    timeout_seconds: Optional[float] = None  # 未指定時はSYNC_TIMEOUT_SECONDS（上限MAX_SYNC_TIMEOUT_SECONDS）
+
+
+class BatchAnalysisRequest(BaseModel):
+    """期間一括分析リクエストモデル"""
+    start_date: str  # YYYY-MM-DD形式
+    end_date: str  # YYYY-MM-DD形式
+    device_id: Optional[str] = None  # 未指定時は全デバイス
+
+
+class IngestRequest(BaseModel):
+    """チャンク感情インジェストリクエストモデル"""
+    device_id: str
+    date: str  # YYYY-MM-DD形式
+    time_block: str  # HH-MM形式
+    emotion_extractor_result: List[Dict[str, Any]]  # audio_features.emotion_extractor_resultと同じ形式
+    seal: bool = False  # Trueの場合はその日を即時に書き出す
+
+
+class SealRequest(BaseModel):
+    """インジェスト確定リクエストモデル"""
+    device_id: str
+    date: str  # YYYY-MM-DD形式
+
+
 class TaskStatus(BaseModel):
     """タスク状況モデル"""
     task_id: str
@@ -58,6 +151,178 @@ class TaskStatus(BaseModel):
     error: Optional[str] = None
 
 
+def get_storage_service() -> StorageBackend:
+    """共有ストレージクライアント（初回呼び出し時に生成）"""
+    global _storage_service
+    with _shared_lock:
+        if _storage_service is None:
+            _storage_service = create_storage_service()
+        return _storage_service
+
+
+def get_aggregator() -> "OpenSMILEAggregator":
+    """共有の集計インスタンス（初回呼び出し時にモジュールを読み込んで生成）"""
+    global _aggregator
+    storage_service = get_storage_service()
+    with _shared_lock:
+        if _aggregator is None:
+            from opensmile_aggregator import OpenSMILEAggregator
+            _aggregator = OpenSMILEAggregator(storage_service)
+        return _aggregator
+
+
+def get_ingest_accumulator() -> "IngestAccumulator":
+    """プッシュ型インジェストのアキュムレーター（定期的にaudio_aggregatorへ書き出す）"""
+    global _ingest_accumulator
+    with _shared_lock:
+        if _ingest_accumulator is None:
+            from ingest_accumulator import IngestAccumulator
+            _ingest_accumulator = IngestAccumulator(get_storage_service)
+        return _ingest_accumulator
+
+
+def start_ingest_flush() -> "IngestAccumulator":
+    """
+    インジェストの定期書き出しを開始（開始済みの場合は何もしない）
+
+    ウォームアップに失敗しても未書き出しのブロックがメモリに溜まり続けないよう、
+    ウォームアップ完了時だけでなくインジェストの受け付け時にも呼ぶ
+    """
+    global ingest_flush_task
+    ingest_accumulator = get_ingest_accumulator()
+    if ingest_flush_task is None or ingest_flush_task.done():
+        ingest_flush_task = asyncio.create_task(ingest_accumulator.run_periodic_flush())
+    return ingest_accumulator
+
+
+def get_parallel_executor() -> "ParallelAggregationExecutor":
+    """バッチ集計用のプロセスプール（初回のバッチ実行時に起動）"""
+    global _parallel_executor
+    with _shared_lock:
+        if _parallel_executor is None:
+            from parallel_executor import ParallelAggregationExecutor
+            _parallel_executor = ParallelAggregationExecutor()
+        return _parallel_executor
+
+
+def notify_task_change(task_id: str):
+    """このプロセス内の長ポーリング・SSEの待機者に変化を通知"""
+    event = task_events.pop(task_id, None)
+    if event is not None:
+        event.set()
+
+
+def visible_task_state(task: Dict[str, Any]) -> tuple:
+    """タスクのうち利用者に見えるフィールドだけを取り出す（変化の判定用）"""
+    return tuple(task.get(field) for field in TASK_VISIBLE_FIELDS)
+
+
+def register_task_waiter(task_id: str):
+    """タスクの待機者を登録（存在する未完了のタスクに対してのみ呼ぶ）"""
+    task_waiters[task_id] = task_waiters.get(task_id, 0) + 1
+
+
+def unregister_task_waiter(task_id: str):
+    """タスクの待機者の登録を解除し、待機者がいなくなったらイベントを解放"""
+    remaining = task_waiters.get(task_id, 0) - 1
+    if remaining > 0:
+        task_waiters[task_id] = remaining
+    else:
+        task_waiters.pop(task_id, None)
+        task_events.pop(task_id, None)
+
+
+async def update_task_status(task_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    実行中のタスク状況をストア上でアトミックに更新し、待機者に通知
+
+    このワーカーが実行権を持つ場合のみ更新する（リース切れで引き継がれた後に、古い実行の進捗・結果で上書きしない）
+
+    Returns:
+        Dict: 更新後のタスク（実行権を失っている場合はNone）
+    """
+    task = await task_store.update(task_id, fields, expected_statuses=("running",), expected_worker_id=WORKER_ID)
+    if task is None:
+        logger.warning(f"⚠️ 実行権がないためタスク状況を記録しません: task_id={task_id}, worker={WORKER_ID}")
+        return None
+    notify_task_change(task_id)
+    return task
+
+
+async def claim_task(task_id: str) -> Optional[Dict[str, Any]]:
+    """タスクの実行権を取得（他のワーカーが実行中の場合はNone）"""
+    task = await task_store.claim(task_id, WORKER_ID, TASK_LEASE_SECONDS)
+    if task is not None:
+        notify_task_change(task_id)
+    return task
+
+
+class TaskLeaseLost(Exception):
+    """タスクのリースを延長できなかった（削除・完了済み、または他のワーカーに引き継がれた）"""
+
+
+async def keep_task_lease(task_id: str):
+    """
+    実行中のタスクのリースを定期的に延長（長時間のタスクが他のワーカーに引き継がれないように）
+
+    延長できなかった場合は戻る（実行を続けると引き継いだワーカーと二重に集計・保存するため）
+    """
+    while True:
+        await asyncio.sleep(TASK_LEASE_SECONDS / 3)
+        task = await task_store.update(
+            task_id,
+            {"lease_expires_at": time.time() + TASK_LEASE_SECONDS},
+            expected_statuses=("running",),
+            expected_worker_id=WORKER_ID
+        )
+        if task is None:
+            logger.warning(f"⚠️ タスクのリースを延長できませんでした: task_id={task_id}, worker={WORKER_ID}")
+            return
+
+
+async def run_with_task_lease(task_id: str, work: Awaitable[Any]) -> Any:
+    """
+    リースを延長しながら work を実行
+
+    Raises:
+        TaskLeaseLost: リースを失った場合（work はキャンセルする）
+    """
+    work_task = asyncio.ensure_future(work)
+    lease_task = asyncio.create_task(keep_task_lease(task_id))
+    try:
+        await asyncio.wait({work_task, lease_task}, return_when=asyncio.FIRST_COMPLETED)
+        if not work_task.done():
+            raise TaskLeaseLost(f"リースを失ったため実行を中断しました: task_id={task_id}")
+        return work_task.result()
+    finally:
+        lease_task.cancel()
+        if not work_task.done():
+            work_task.cancel()
+
+
+async def wait_for_task_change(event: asyncio.Event, timeout: float) -> bool:
+    """
+    タスク状況の変化を待機
+
+    共有ストアの場合は他プロセスでの更新を通知できないため、TASK_STORE_POLL_SECONDSごとに戻って
+    呼び出し側でストアを読み直す。
+
+    Args:
+        event: 状況を読む前に task_events から取得したイベント
+        timeout: 最大待機秒数
+
+    Returns:
+        bool: このプロセス内で変化が通知されればTrue
+    """
+    if task_store.shared:
+        timeout = min(timeout, TASK_STORE_POLL_SECONDS)
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
 @app.get("/", tags=["Health"])
 async def root():
     """ヘルスチェック"""
@@ -70,10 +335,25 @@ async def root():
 
 @app.get("/health", tags=["Health"])
 async def health_check():
-    """ヘルスチェックエンドポイント"""
+    """ヘルスチェックエンドポイント（プロセスの生存確認）"""
     return {"status": "healthy"}
 
 
+@app.get("/ready", tags=["Health"])
+async def readiness_check():
+    """
+    レディネスチェック（ウォームアップが完了してリクエストを処理できる状態か）
+
+    ウォームアップ中・失敗時は503を返す
+    """
+    if not warmup_state["ready"]:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "starting" if warmup_state["error"] is None else "error", "error": warmup_state["error"]}
+        )
+    return {"status": "ready", "warmup_seconds": warmup_state["seconds"]}
+
+
 @app.post("/analyze/opensmile-aggregator", response_model=Dict[str, str], tags=["Analysis"])
 async def start_emotion_analysis(request: AnalysisRequest, background_tasks: BackgroundTasks):
     """
@@ -89,15 +369,17 @@ async def start_emotion_analysis(request: AnalysisRequest, background_tasks: Bac
     task_id = str(uuid.uuid4())
     
     # タスク状況初期化
-    task_status[task_id] = {
+    await task_store.create({
         "task_id": task_id,
+        "kind": "day",
         "status": "started",
         "message": "感情分析タスクを開始しました",
         "progress": 0,
         "device_id": request.device_id,
         "date": request.date,
-        "created_at": datetime.now().isoformat()
-    }
+        "created_at": datetime.now().isoformat(),
+        "lease_expires_at": time.time() + TASK_LEASE_SECONDS
+    })
     
     # バックグラウンドタスク追加
     background_tasks.add_task(execute_emotion_analysis, task_id, request.device_id, request.date)
@@ -111,15 +393,203 @@ async def start_emotion_analysis(request: AnalysisRequest, background_tasks: Bac
     }
 
 
+@app.post("/analyze/opensmile-aggregator/sync", tags=["Analysis"])
+async def run_emotion_analysis_sync(request: SyncAnalysisRequest, background_tasks: BackgroundTasks):
+    """
+    OpenSMILE感情分析を同期実行し、emotion_graphをレスポンスで返す（1デバイス日向けの高速パス）
+
+    タスク登録・状況確認のポーリング・結果の再取得が不要。
+    timeout_seconds を超えた場合は処理を中断せず、202とタスクIDを返してバックグラウンドで継続する
+    """
+    # 日付形式検証
+    try:
+        datetime.strptime(request.date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
+    timeout = SYNC_TIMEOUT_SECONDS if request.timeout_seconds is None else request.timeout_seconds
+    timeout = min(timeout, MAX_SYNC_TIMEOUT_SECONDS)
+    if timeout <= 0:
+        raise HTTPException(status_code=400, detail="timeout_secondsは正の値を指定してください")
+    
+    analysis = asyncio.create_task(get_aggregator().run(request.device_id, request.date, persist=request.persist))
+    try:
+        # タイムアウトしても集計自体はキャンセルしない
+        result = await asyncio.wait_for(asyncio.shield(analysis), timeout)
+    except asyncio.TimeoutError:
+        task_id = str(uuid.uuid4())
+        await task_store.create({
+            "task_id": task_id,
+            "kind": "day",
+            "trigger": "sync",
+            "persist": request.persist,
+            "status": "running",
+            "worker_id": WORKER_ID,
+            "message": f"同期実行の待ち時間（{timeout}秒）を超えたため、バックグラウンドで継続中...",
+            "progress": 50,
+            "device_id": request.device_id,
+            "date": request.date,
+            "created_at": datetime.now().isoformat(),
+            "lease_expires_at": time.time() + TASK_LEASE_SECONDS
+        })
+        background_tasks.add_task(finish_emotion_analysis, task_id, analysis, request.persist)
+        
+        logger.info(f"⏳ 同期感情分析がタイムアウト、タスクに切り替え: task_id={task_id}, device_id={request.device_id}, date={request.date}")
+        
+        return JSONResponse(status_code=202, content={
+            "task_id": task_id,
+            "status": "running",
+            "message": f"{request.device_id}/{request.date} の感情分析を継続中です（タスクIDで状況を確認してください）"
+        })
+    except StorageUnavailableError as e:
+        # 一時的な障害・サーキットブレーカー作動中は再試行可能であることを503で伝える
+        logger.error(f"❌ 同期感情分析エラー（ストレージ利用不可）: device_id={request.device_id}, date={request.date}, error={e}")
+        raise HTTPException(status_code=503, detail=f"ストレージに一時的に接続できません: {e}")
+    except Exception as e:
+        logger.error(f"❌ 同期感情分析エラー: device_id={request.device_id}, date={request.date}, error={e}")
+        raise HTTPException(status_code=500, detail=f"感情分析中にエラーが発生しました: {e}")
+    
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail="データ処理またはSupabase保存に失敗しました")
+    
+    return {
+        "status": "completed",
+        "device_id": request.device_id,
+        "date": request.date,
+        "message": result["message"],
+        "has_data": result["has_data"],
+        "persisted": request.persist and result["has_data"],
+        "processed_slots": result["processed_slots"],
+        "emotion_graph": result["emotion_graph"],
+        "baseline": await score_with_baseline(request.device_id, request.date, result["emotion_graph"])
+    }
+
+
+@app.post("/analyze/opensmile-aggregator/batch", response_model=Dict[str, str], tags=["Analysis"])
+async def start_batch_emotion_analysis(request: BatchAnalysisRequest, background_tasks: BackgroundTasks):
+    """
+    期間内の全デバイス日の感情分析をマルチプロセスで一括実行（バックフィル用）
+    """
+    # 日付形式検証
+    try:
+        start = datetime.strptime(request.start_date, "%Y-%m-%d")
+        end = datetime.strptime(request.end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
+    if start > end:
+        raise HTTPException(status_code=400, detail="start_dateはend_date以前の日付を指定してください")
+    
+    # タスクID生成
+    task_id = str(uuid.uuid4())
+    
+    # タスク状況初期化
+    await task_store.create({
+        "task_id": task_id,
+        "kind": "batch",
+        "status": "started",
+        "message": "一括感情分析タスクを開始しました",
+        "progress": 0,
+        "device_id": request.device_id,
+        "start_date": request.start_date,
+        "end_date": request.end_date,
+        "created_at": datetime.now().isoformat(),
+        "lease_expires_at": time.time() + TASK_LEASE_SECONDS
+    })
+    
+    background_tasks.add_task(
+        execute_batch_emotion_analysis, task_id, request.start_date, request.end_date, request.device_id
+    )
+    
+    logger.info(f"一括感情分析開始: task_id={task_id}, period={request.start_date}〜{request.end_date}, device_id={request.device_id}")
+    
+    return {
+        "task_id": task_id,
+        "status": "started",
+        "message": f"{request.start_date}〜{request.end_date} の一括感情分析を開始しました"
+    }
+
+
 @app.get("/analyze/opensmile-aggregator/{task_id}", response_model=TaskStatus, tags=["Analysis"])
-async def get_analysis_status(task_id: str):
+async def get_analysis_status(
+    task_id: str,
+    wait: float = Query(0, ge=0, le=MAX_STATUS_WAIT_SECONDS, description="状況が変化するまで最大この秒数だけ待機（長ポーリング）")
+):
     """
     分析タスクの状況を取得
+
+    wait を指定すると、タスクが完了・失敗済みでない限り、状況が変化するかタイムアウトするまで応答を保留する
+    """
+    task = await task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="タスクが見つかりません")
+    if wait <= 0 or task["status"] in TERMINAL_STATUSES:
+        return task
+    
+    initial = visible_task_state(task)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    register_task_waiter(task_id)
+    try:
+        while True:
+            # 状況を読む前にイベントを取得し、読み取り後の変化を取りこぼさない
+            event = task_events.setdefault(task_id, asyncio.Event())
+            task = await task_store.get(task_id)
+            if task is None:
+                raise HTTPException(status_code=404, detail="タスクが見つかりません")
+            remaining = deadline - loop.time()
+            if task["status"] in TERMINAL_STATUSES or visible_task_state(task) != initial or remaining <= 0:
+                return task
+            await wait_for_task_change(event, remaining)
+    finally:
+        unregister_task_waiter(task_id)
+
+
+@app.get("/analyze/opensmile-aggregator/{task_id}/events", tags=["Analysis"])
+async def stream_analysis_status(task_id: str):
     """
-    if task_id not in task_status:
+    分析タスクの状況をServer-Sent Eventsで配信
+
+    状況が変化するたびに `event: status` を送信し、完了・失敗時に最終結果を送って終了する
+    """
+    if await task_store.get(task_id) is None:
         raise HTTPException(status_code=404, detail="タスクが見つかりません")
     
-    return task_status[task_id]
+    async def event_stream():
+        loop = asyncio.get_running_loop()
+        last_sent = None
+        last_yield_at = loop.time()
+        # クライアントの切断時もfinallyで登録を解除する
+        register_task_waiter(task_id)
+        try:
+            while True:
+                # 状況を読む前にイベントを取得し、読み取り後の変化を取りこぼさない
+                event = task_events.setdefault(task_id, asyncio.Event())
+                current = await task_store.get(task_id)
+                if current is None:
+                    yield "event: error\ndata: {\"detail\": \"タスクが見つかりません\"}\n\n"
+                    return
+                
+                if visible_task_state(current) != last_sent:
+                    last_sent = visible_task_state(current)
+                    last_yield_at = loop.time()
+                    yield f"event: status\ndata: {json.dumps(current, ensure_ascii=False)}\n\n"
+                
+                if current["status"] in TERMINAL_STATUSES:
+                    return
+                
+                if loop.time() - last_yield_at >= SSE_KEEPALIVE_SECONDS:
+                    last_yield_at = loop.time()
+                    yield ": keepalive\n\n"
+                
+                await wait_for_task_change(event, SSE_KEEPALIVE_SECONDS)
+        finally:
+            unregister_task_waiter(task_id)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Nginxのバッファリングを無効化して即時に配信する
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/analyze/opensmile-aggregator", tags=["Analysis"])
@@ -127,9 +597,10 @@ async def list_analysis_tasks():
     """
     全分析タスクの一覧を取得
     """
+    tasks = await task_store.list()
     return {
-        "tasks": list(task_status.values()),
-        "total": len(task_status)
+        "tasks": tasks,
+        "total": len(tasks)
     }
 
 
@@ -138,87 +609,419 @@ async def delete_analysis_task(task_id: str):
     """
     完了・失敗したタスクを削除
     """
-    if task_id not in task_status:
+    # 状態確認と削除をストア上でアトミックに行う
+    deleted = await task_store.delete(task_id, TERMINAL_STATUSES)
+    if deleted is None:
         raise HTTPException(status_code=404, detail="タスクが見つかりません")
-    
-    task = task_status[task_id]
-    if task["status"] in ["running", "started"]:
+    if not deleted:
         raise HTTPException(status_code=400, detail="実行中のタスクは削除できません")
     
-    del task_status[task_id]
+    notify_task_change(task_id)
     return {"message": f"タスク {task_id} を削除しました"}
 
 
+@app.post("/ingest/emotion-chunks", tags=["Ingest"])
+async def ingest_emotion_chunks(request: IngestRequest):
+    """
+    1ブロック分のチャンク感情を直接受け付けてスロット集計を更新（audio_featuresの再読み込みなし）
+
+    集計結果は定期的（INGEST_FLUSH_INTERVAL_SECONDS）またはseal時にaudio_aggregatorへ書き出す
+    """
+    # 日付形式検証
+    try:
+        datetime.strptime(request.date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
+    ingest_accumulator = start_ingest_flush()
+    if request.time_block not in ingest_accumulator.time_slots:
+        raise HTTPException(status_code=400, detail="time_blockはHH-MM形式（00-00〜23-30の30分単位）で指定してください")
+    
+    scores = ingest_accumulator.ingest_block(
+        request.device_id, request.date, request.time_block, request.emotion_extractor_result
+    )
+    
+    flushed = None
+    if request.seal:
+        flushed = await ingest_accumulator.seal(request.device_id, request.date)
+        if not flushed:
+            raise HTTPException(status_code=503, detail="audio_aggregatorへの書き出しに失敗しました（次回の定期書き出しで再試行します）")
+    
+    return {
+        "status": "accepted",
+        "device_id": request.device_id,
+        "date": request.date,
+        "time_block": request.time_block,
+        "emotion_scores": scores,
+        "flushed": flushed
+    }
+
+
+@app.post("/ingest/emotion-chunks/seal", tags=["Ingest"])
+async def seal_ingested_day(request: SealRequest):
+    """
+    指定デバイス日のインジェスト結果を即時にaudio_aggregatorへ書き出す
+    """
+    if not await get_ingest_accumulator().seal(request.device_id, request.date):
+        raise HTTPException(status_code=503, detail="audio_aggregatorへの書き出しに失敗しました（次回の定期書き出しで再試行します）")
+    
+    return {"message": f"{request.device_id}/{request.date} のインジェスト結果を書き出しました"}
+
+
+@app.post("/scheduler/sweep", tags=["Scheduler"])
+async def trigger_stale_sweep():
+    """
+    未集計デバイス日のスイープを即時に実行してキューに積む
+    """
+    enqueued = await stale_scheduler.sweep()
+    return {"enqueued": enqueued, **stale_scheduler.status()}
+
+
+@app.get("/scheduler/status", tags=["Scheduler"])
+async def get_scheduler_status():
+    """
+    未集計デバイス日スケジューラーの状況を取得
+    """
+    return stale_scheduler.status()
+
+
+@app.get("/rollups/{scope}", tags=["Rollups"])
+async def get_fleet_rollup(
+    scope: str,
+    date: Optional[str] = Query(None, description="1日分を取得する日付（YYYY-MM-DD形式）"),
+    start_date: Optional[str] = Query(None, description="期間の開始日（dateの代わりに指定）"),
+    end_date: Optional[str] = Query(None, description="期間の終了日（未指定時はstart_date）")
+):
+    """
+    フリート全体（scope=fleet）またはデバイスグループの感情ロールアップを取得
+
+    保存時に更新済みの集計を読むだけのため、デバイス数によらず一定時間で返る。
+    時間ごとのデバイス数・スパイク数・スパイク割合・平均・ヒストグラムと、max_ever_observed を返す。
+    max_ever_observed は再保存で置き換えた寄与を含む、これまでに観測した最大値（現在の寄与の最大値ではない）。
+    """
+    if not derived_state_enabled("FLEET_ROLLUPS_ENABLED"):
+        raise HTTPException(status_code=404, detail="ロールアップは無効です（FLEET_ROLLUPS_ENABLED）")
+
+    from fleet_rollup import get_fleet_rollups
+    rollups = get_fleet_rollups()
+    if not rollups.has_scope(scope):
+        raise HTTPException(status_code=404, detail=f"スコープが見つかりません: {scope}")
+
+    if date is not None:
+        try:
+            datetime.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
+        rollup = await rollups.get(scope, date)
+        if rollup is None:
+            raise HTTPException(status_code=404, detail=f"{scope}/{date} のロールアップはまだありません")
+        return rollup
+
+    if start_date is None:
+        raise HTTPException(status_code=400, detail="date または start_date を指定してください")
+    try:
+        return await rollups.get_range(scope, start_date, end_date or start_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def score_with_baseline(device_id: str, date: str, emotion_graph: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    感情グラフをデバイスのベースラインでzスコア・正規化値に変換
+    （無効時・失敗時、その日がベースラインの再計算期間より前の場合はNone）
+    """
+    if not derived_state_enabled("DEVICE_BASELINES_ENABLED") or not emotion_graph:
+        return None
+    from device_baseline import get_device_baselines
+    try:
+        return await get_device_baselines().score(device_id, date, emotion_graph)
+    except ValueError:
+        return None
+    except Exception as e:
+        logger.warning(f"⚠️ ベースラインの取得に失敗しました: device_id={device_id}, error={e}")
+        return None
+
+
+@app.get("/baselines/{device_id}", tags=["Baselines"])
+async def get_device_baseline_scores(
+    device_id: str,
+    date: str = Query(..., description="対象日付（YYYY-MM-DD形式）")
+):
+    """
+    保存済みの感情グラフと、デバイスのベースラインに対するzスコア・正規化値を取得
+
+    ベースラインは保存のたびに更新済みのため、過去の集計結果は読み直さない。
+    zスコアはその日より前の日だけのベースラインに対して計算する（過去の日付でもその日以降のデータを含めない）。
+    その日より前の状態を保持しているのは直近 BASELINE_REPLAY_DAYS 日分のみのため、それより前の日付は400を返す。
+    """
+    if not derived_state_enabled("DEVICE_BASELINES_ENABLED"):
+        raise HTTPException(status_code=404, detail="ベースラインは無効です（DEVICE_BASELINES_ENABLED）")
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="日付はYYYY-MM-DD形式で指定してください")
+
+    try:
+        emotion_graph = await get_storage_service().fetch_emotion_summary(device_id, date)
+    except StorageUnavailableError as e:
+        raise HTTPException(status_code=503, detail=f"ストレージに一時的に接続できません: {e}")
+    if emotion_graph is None:
+        raise HTTPException(status_code=404, detail=f"{device_id}/{date} の集計結果はまだありません")
+
+    from device_baseline import get_device_baselines
+    try:
+        scores = await get_device_baselines().score(device_id, date, emotion_graph)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "device_id": device_id,
+        "date": date,
+        "emotion_graph": emotion_graph,
+        **scores
+    }
+
+
+async def run_scheduled_day(device_id: str, date: str):
+    """
+    スケジューラーが検出したデバイス日を再集計（失敗時は例外）
+
+    1分あたり数十件実行されるため、タスクストアには登録しない（状況は /scheduler/status で確認する）。
+    失敗した日は次回のスイープで再検出されるため、リースによる引き継ぎも不要
+    """
+    result = await get_aggregator().run(device_id, date)
+    if not result["success"]:
+        raise RuntimeError(result.get("message") or "再集計に失敗しました")
+
+
 async def execute_emotion_analysis(task_id: str, device_id: str, date: str):
     """
     OpenSMILE感情分析の実行（バックグラウンドタスク）
     """
+    if await claim_task(task_id) is None:
+        logger.info(f"⏭️ 他のワーカーが実行中のためスキップ: task_id={task_id}")
+        return
+    await run_emotion_analysis(task_id, device_id, date)
+
+
+async def run_emotion_analysis(task_id: str, device_id: str, date: str, persist: bool = True):
+    """
+    実行権を取得済みのOpenSMILE感情分析タスクを実行
+    """
     try:
-        logger.info(f"🚀 バックグラウンドタスク開始: task_id={task_id}, device_id={device_id}, date={date}")
+        logger.info(f"🚀 バックグラウンドタスク開始: task_id={task_id}, device_id={device_id}, date={date}, worker={WORKER_ID}")
         
         # OpenSMILEデータ収集・感情スコア計算・Supabase保存
-        task_status[task_id].update({
-            "status": "running",
+        await update_task_status(task_id, {
             "message": "OpenSMILEデータ収集・感情分析中...",
             "progress": 50
         })
         
-        logger.info(f"📊 OpenSMILEAggregator インスタンス作成中...")
-        aggregator = OpenSMILEAggregator()
+        aggregator = get_aggregator()
         logger.info(f"🎭 感情分析開始（Supabaseからデータ取得）...")
-        result = await aggregator.run(device_id, date)
-        logger.info(f"📄 感情分析結果: {result}")
-        
-        if not result["success"]:
-            logger.error(f"❌ 感情分析失敗")
-            task_status[task_id].update({
-                "status": "failed",
-                "message": "感情分析処理に失敗しました",
-                "error": "データ処理またはSupabase保存に失敗しました",
-                "progress": 100
-            })
-            return
+        result = await run_with_task_lease(task_id, aggregator.run(device_id, date, persist=persist))
+        await record_emotion_analysis_result(task_id, result, persist)
         
-        logger.info(f"✅ 感情分析成功（Supabaseに保存済み）")
+    except TaskLeaseLost as e:
+        # 引き継いだワーカーが状況を更新するため、ここでは記録しない
+        logger.warning(f"⚠️ {e}")
+    except Exception as e:
+        await record_emotion_analysis_error(task_id, e)
+
+
+async def finish_emotion_analysis(task_id: str, analysis: asyncio.Task, persist: bool):
+    """
+    同期エンドポイントでタイムアウトした集計の完了を待ち、結果をタスクに記録（バックグラウンドタスク）
+    """
+    try:
+        await record_emotion_analysis_result(task_id, await run_with_task_lease(task_id, analysis), persist)
+    except TaskLeaseLost as e:
+        logger.warning(f"⚠️ {e}")
+    except Exception as e:
+        await record_emotion_analysis_error(task_id, e)
+
+
+async def record_emotion_analysis_result(task_id: str, result: Dict[str, Any], persist: bool):
+    """
+    OpenSMILEAggregator.run の結果をタスク状況に記録
+    """
+    logger.info(f"📄 感情分析結果: success={result['success']}, has_data={result['has_data']}, processed_slots={result['processed_slots']}")
+    
+    if not result["success"]:
+        logger.error(f"❌ 感情分析失敗")
+        await update_task_status(task_id, {
+            "status": "failed",
+            "message": "感情分析処理に失敗しました",
+            "error": "データ処理またはSupabase保存に失敗しました",
+            "progress": 100
+        })
+        return
+    
+    logger.info(f"✅ 感情分析成功（Supabaseに保存済み）" if persist else f"✅ 感情分析成功（保存なし）")
+    
+    # 成功メッセージをデータの有無に応じて調整
+    message = result["message"]
+    if not result["has_data"]:
+        logger.info(f"📭 データなし: {message}")
+    else:
+        logger.info(f"🎉 感情分析完了: {result['processed_slots']}スロット処理")
+    
+    task_result = {
+        "storage": {
+            "location": "Supabase emotion_opensmile_summary table" if persist else None,
+            "success": True
+        },
+        "has_data": result["has_data"],
+        "processed_slots": result["processed_slots"],
+        "total_emotion_points": result["total_emotion_points"],
+        "emotion_graph_length": 48  # 48スロット固定
+    }
+    if not persist:
+        # 保存しない場合はタスク結果からグラフを取得できるようにする
+        task_result["emotion_graph"] = result["emotion_graph"]
+    
+    # 成功（引き継がれていた場合は記録しない）
+    if await update_task_status(task_id, {
+        "status": "completed",
+        "message": message,
+        "progress": 100,
+        "result": task_result
+    }) is None:
+        return
+    
+    logger.info(f"✅ OpenSMILE感情分析完了: task_id={task_id}")
+
+
+async def record_emotion_analysis_error(task_id: str, e: Exception):
+    """
+    OpenSMILE感情分析の例外をタスク状況に記録
+    """
+    logger.error(f"💥 OpenSMILE感情分析エラー: task_id={task_id}, error={e}")
+    logger.error(f"💥 エラー詳細: {type(e).__name__}: {str(e)}")
+    import traceback
+    logger.error(f"💥 スタックトレース: {traceback.format_exc()}")
+    await update_task_status(task_id, {
+        "status": "failed",
+        "message": "感情分析中にエラーが発生しました",
+        "error": str(e),
+        "progress": 100
+    })
+    logger.error(f"❌ OpenSMILE感情分析エラー: task_id={task_id}, error={e}")
+
+
+async def execute_batch_emotion_analysis(task_id: str, start_date: str, end_date: str, device_id: Optional[str]):
+    """
+    期間一括感情分析の実行（バックグラウンドタスク）
+    """
+    if await claim_task(task_id) is None:
+        logger.info(f"⏭️ 他のワーカーが実行中のためスキップ: task_id={task_id}")
+        return
+    await run_batch_emotion_analysis(task_id, start_date, end_date, device_id)
+
+
+async def run_batch_emotion_analysis(task_id: str, start_date: str, end_date: str, device_id: Optional[str]):
+    """
+    実行権を取得済みの期間一括感情分析タスクを実行
+    """
+    try:
+        await update_task_status(task_id, {
+            "message": f"マルチプロセスで一括集計中（ワーカー数: {get_parallel_executor().workers}）...",
+            "progress": 50
+        })
         
-        # 成功メッセージをデータの有無に応じて調整
-        message = result["message"]
-        if not result["has_data"]:
-            logger.info(f"📭 データなし: {message}")
-        else:
-            logger.info(f"🎉 感情分析完了: {result['processed_slots']}スロット処理")
+        stats = await run_with_task_lease(
+            task_id, get_parallel_executor().run_range(get_storage_service(), start_date, end_date, device_id)
+        )
         
-        # 成功
-        task_status[task_id].update({
+        await update_task_status(task_id, {
             "status": "completed",
-            "message": message,
+            "message": f"一括感情分析が完了しました（{stats['device_days']}デバイス日）",
             "progress": 100,
-            "result": {
-                "storage": {
-                    "location": "Supabase emotion_opensmile_summary table",
-                    "success": True
-                },
-                "has_data": result["has_data"],
-                "processed_slots": result["processed_slots"],
-                "total_emotion_points": result["total_emotion_points"],
-                "emotion_graph_length": 48  # 48スロット固定
-            }
+            "result": stats
         })
+        logger.info(f"✅ 一括感情分析完了: task_id={task_id}, stats={stats}")
         
-        logger.info(f"✅ OpenSMILE感情分析完了: task_id={task_id}")
-        
+    except TaskLeaseLost as e:
+        logger.warning(f"⚠️ {e}")
     except Exception as e:
-        logger.error(f"💥 OpenSMILE感情分析エラー: task_id={task_id}, error={e}")
-        logger.error(f"💥 エラー詳細: {type(e).__name__}: {str(e)}")
-        import traceback
-        logger.error(f"💥 スタックトレース: {traceback.format_exc()}")
-        task_status[task_id].update({
+        logger.error(f"💥 一括感情分析エラー: task_id={task_id}, error={e}")
+        await update_task_status(task_id, {
             "status": "failed",
-            "message": "感情分析中にエラーが発生しました",
+            "message": "一括感情分析中にエラーが発生しました",
             "error": str(e),
             "progress": 100
         })
-        logger.error(f"❌ OpenSMILE感情分析エラー: task_id={task_id}, error={e}")
+
+
+async def resume_orphaned_tasks():
+    """
+    リースが切れたタスク（実行していたワーカー・レプリカが停止したもの）を引き継いで再実行するループ
+    """
+    while True:
+        await asyncio.sleep(ORPHAN_SWEEP_INTERVAL_SECONDS)
+        try:
+            for task in await task_store.claim_orphaned(WORKER_ID, TASK_LEASE_SECONDS):
+                logger.info(f"♻️ リース切れタスクを引き継ぎ: task_id={task['task_id']}, worker={WORKER_ID}")
+                notify_task_change(task["task_id"])
+                if task.get("kind") == "batch":
+                    asyncio.create_task(run_batch_emotion_analysis(
+                        task["task_id"], task["start_date"], task["end_date"], task.get("device_id")
+                    ))
+                else:
+                    asyncio.create_task(run_emotion_analysis(
+                        task["task_id"], task["device_id"], task["date"], task.get("persist", True)
+                    ))
+        except Exception as e:
+            logger.error(f"❌ リース切れタスクの確認エラー: {e}")
+
+
+def _warm_up_sync():
+    """集計モジュールの読み込みとクライアント生成（スレッドで実行）"""
+    get_aggregator()
+    get_ingest_accumulator()
+
+
+async def warm_up():
+    """
+    重い読み込み・クライアント生成をイベントループの外で行い、完了したらレディにする
+
+    ウォームアップ中も /health と受け付け済みのリクエストは処理できる
+    """
+    started_at = time.perf_counter()
+    try:
+        await asyncio.to_thread(_warm_up_sync)
+        start_ingest_flush()
+        warmup_state.update({"ready": True, "seconds": round(time.perf_counter() - started_at, 3)})
+        logger.info(f"✅ ウォームアップ完了: {warmup_state['seconds']}秒")
+    except Exception as e:
+        warmup_state["error"] = str(e)
+        logger.error(f"❌ ウォームアップ失敗: {e}")
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    """設定を読み込み、ウォームアップ・リース切れタスクの引き継ぎ・未集計デバイス日のスケジューラーを開始"""
+    global task_store, stale_scheduler, TASK_LEASE_SECONDS, SYNC_TIMEOUT_SECONDS
+    global orphan_sweep_task, stale_scheduler_task, warmup_task
+    load_environment()
+    TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", "600"))
+    SYNC_TIMEOUT_SECONDS = float(os.getenv("SYNC_TIMEOUT_SECONDS", "10"))
+    task_store = create_task_store()
+    stale_scheduler = StaleDayScheduler(get_storage_service, run_scheduled_day)
+    
+    warmup_task = asyncio.create_task(warm_up())
+    orphan_sweep_task = asyncio.create_task(resume_orphaned_tasks())
+    stale_scheduler_task = asyncio.create_task(stale_scheduler.run())
+
+
+@app.on_event("shutdown")
+async def shutdown_background_workers():
+    """インジェスト結果を書き出し、バッチ集計用プロセスプールを停止"""
+    for task in (warmup_task, ingest_flush_task, orphan_sweep_task, stale_scheduler_task):
+        if task is not None:
+            task.cancel()
+    if _ingest_accumulator is not None:
+        await _ingest_accumulator.flush_all()
+    if _parallel_executor is not None:
+        _parallel_executor.shutdown()
 
 
 if __name__ == "__main__":
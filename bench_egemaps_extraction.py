@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+eGeMAPS特徴量抽出のベンチマーク
+
+フルレゾリューションのOpenSMILE特徴量（LLDのフレーム列）を模したJSONに対して、
+従来の再帰走査（キーごとに11パターンの部分文字列検索・未使用のprefix文字列の生成）と
+EmotionScorer.extract_feature_array（再帰なしの走査・正規表現とキー分類表）の処理時間を比較する。
+あわせてフレームごとのスコアリング（process_opensmile_frames）のスループットを計測する。
+
+従来の走査はベンチマーク内で再現している。
+
+使い方:
+    python bench_egemaps_extraction.py
+    python bench_egemaps_extraction.py --frames 50000 --repeat 5
+"""
+
+import argparse
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+from emotion_scoring import EmotionScorer
+
+
+# eGeMAPS v02 のLLD（25種類）
+LLD_NAMES = [
+    "Loudness_sma3", "alphaRatio_sma3", "hammarbergIndex_sma3", "slope0-500_sma3", "slope500-1500_sma3",
+    "spectralFlux_sma3", "mfcc1_sma3", "mfcc2_sma3", "mfcc3_sma3", "mfcc4_sma3",
+    "F0semitoneFrom27.5Hz_sma3nz", "jitterLocal_sma3nz", "shimmerLocaldB_sma3nz", "HNRdBACF_sma3nz",
+    "logRelF0-H1-H2_sma3nz", "logRelF0-H1-A3_sma3nz", "F1frequency_sma3nz", "F1bandwidth_sma3nz",
+    "F1amplitudeLogRelF0_sma3nz", "F2frequency_sma3nz", "F2bandwidth_sma3nz", "F2amplitudeLogRelF0_sma3nz",
+    "F3frequency_sma3nz", "F3bandwidth_sma3nz", "F3amplitudeLogRelF0_sma3nz"
+]
+
+LEGACY_PATTERNS = [
+    "Loudness_sma3", "shimmerLocaldB_sma3nz", "HNRdBACF_sma3nz",
+    "jitterLocal_sma3nz", "F0semitoneFrom27.5Hz_sma3nz",
+    "spectralFlux_sma3", "mfcc", "alphaRatio_sma3",
+    "HammarbergIndex_sma3", "logRelF0", "slope500-1500_sma3"
+]
+
+
+def generate_dump(frames: int, seed: int) -> Dict[str, Any]:
+    """OpenSMILEのLLD出力（フレーム列）を模したJSON"""
+    rng = random.Random(seed)
+    return {
+        "metadata": {"file": "sample.wav", "config": "eGeMAPSv02", "sample_rate": 16000},
+        "features": [
+            {"frameTime": round(i * 0.01, 2), **{name: rng.uniform(-15, 15) for name in LLD_NAMES}}
+            for i in range(frames)
+        ]
+    }
+
+
+def legacy_extract(opensmile_data: Dict[str, Any]) -> Dict[str, float]:
+    """従来の再帰走査"""
+    features = {}
+
+    def extract_features(obj, prefix=""):
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if isinstance(value, (int, float)):
+                    if any(pattern in key for pattern in LEGACY_PATTERNS):
+                        features[key] = float(value)
+                elif isinstance(value, (dict, list)):
+                    extract_features(value, f"{prefix}{key}_")
+        elif isinstance(obj, list):
+            for i, item in enumerate(obj):
+                extract_features(item, f"{prefix}{i}_")
+
+    extract_features(opensmile_data)
+    return features
+
+
+def best_time(func: Callable[[], Any], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="eGeMAPS特徴量抽出のベンチマーク")
+    parser.add_argument("--frames", type=int, default=20000, help="フレーム数（10ms間隔、20000で約200秒の音声）")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最小値を採用）")
+    parser.add_argument("--seed", type=int, default=42, help="乱数シード")
+    args = parser.parse_args()
+
+    scorer = EmotionScorer()
+    dump = generate_dump(args.frames, args.seed)
+    values_count = args.frames * (len(LLD_NAMES) + 1)
+    print(f"📊 {args.frames}フレーム × {len(LLD_NAMES)}特徴量（数値 {values_count:,}個）\n")
+
+    # 結果の一致を確認
+    assert scorer.score_features(legacy_extract(dump)) == scorer.process_opensmile_data(dump), "スコアが一致しません"
+
+    legacy_seconds = best_time(lambda: scorer.score_features(legacy_extract(dump)), args.repeat)
+    fast_seconds = best_time(lambda: scorer.process_opensmile_data(dump), args.repeat)
+    frames_seconds = best_time(lambda: scorer.process_opensmile_frames(dump["features"]), args.repeat)
+
+    print(f"従来（再帰・部分文字列検索）   {legacy_seconds * 1000:8.1f}ms")
+    print(f"extract_feature_array          {fast_seconds * 1000:8.1f}ms  ({legacy_seconds / fast_seconds:.1f}倍速)")
+    print(f"process_opensmile_frames       {frames_seconds * 1000:8.1f}ms  "
+          f"({args.frames / frames_seconds:,.0f}フレーム/秒、フレームごとのスコア)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+APIサーバーのimport時間ベンチマーク
+
+`python -X importtime -c "import api_server"` を別プロセスで実行し、
+import時間の合計と重いモジュールを表示する。
+起動時に読み込まれてはいけないモジュール（yaml・supabase・dotenv・集計処理・multiprocessing）が
+読み込まれた場合、またはimport時間が予算を超えた場合は終了コード1を返す（CIでのリグレッション検知用）。
+
+使い方:
+    python bench_import_time.py
+    python bench_import_time.py --budget-ms 500 --top 15 --repeat 5
+"""
+
+import argparse
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+
+# api_serverのimport時に読み込まれてはいけないモジュール（初回利用時・ウォームアップで読み込む）
+FORBIDDEN_MODULES = (
+    "yaml",
+    "supabase",
+    "dotenv",
+    "opensmile_aggregator",
+    "emotion_scoring",
+    "ingest_accumulator",
+    "parallel_executor",
+    "offline_backfill",
+    "multiprocessing",
+)
+
+
+def measure_import(module: str) -> Tuple[Dict[str, int], int]:
+    """
+    新しいインタプリタでモジュールをimportし、-X importtime の出力を集計
+
+    Returns:
+        Tuple: (モジュール名 → self時間[μs], トップレベルモジュールの累積時間[μs])
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{module} のimportに失敗しました:\n{result.stderr}")
+
+    self_times: Dict[str, int] = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        self_times[name.strip()] = int(self_us)
+        if name.strip() == module:
+            total_us = int(cumulative_us)
+    return self_times, total_us
+
+
+def find_forbidden(self_times: Dict[str, int]) -> List[str]:
+    """読み込まれた禁止モジュール（サブモジュールを含む）を抽出"""
+    return sorted(
+        name for name in self_times
+        if any(name == forbidden or name.startswith(forbidden + ".") for forbidden in FORBIDDEN_MODULES)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APIサーバーのimport時間ベンチマーク")
+    parser.add_argument("--module", default="api_server", help="計測するモジュール（デフォルト: api_server）")
+    parser.add_argument("--budget-ms", type=float, default=0, help="import時間の上限（ミリ秒、0で無効）")
+    parser.add_argument("--top", type=int, default=10, help="表示する重いモジュールの数")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最小値を採用）")
+    args = parser.parse_args()
+
+    runs = [measure_import(args.module) for _ in range(max(args.repeat, 1))]
+    self_times, total_us = min(runs, key=lambda run: run[1])
+    total_ms = total_us / 1000
+
+    print(f"⏱️ import {args.module}: {total_ms:.1f}ms（{len(runs)}回中の最小値、{len(self_times)}モジュール）")
+    print(f"\n📊 self時間の大きいモジュール（上位{args.top}件）:")
+    for name, self_us in sorted(self_times.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:8.1f}ms  {name}")
+
+    failed = False
+    forbidden = find_forbidden(self_times)
+    if forbidden:
+        print(f"\n❌ import時に読み込まれてはいけないモジュール: {', '.join(forbidden)}")
+        failed = True
+    if args.budget_ms and total_ms > args.budget_ms:
+        print(f"\n❌ import時間が予算を超えています: {total_ms:.1f}ms > {args.budget_ms:.1f}ms")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+    print("\n✅ import時間チェックOK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+耐障害性レイヤーの検証ベンチマーク
+
+障害注入ストレージ（local_storage.FaultInjectingStorage）に対して ResilientStorageBackend を動かし、
+次のシナリオの結果を表示する。期待どおりに動かなかった場合は終了コード1を返す。
+
+1. 一時的なエラー: リトライで成功率が上がり、追加の呼び出しがリトライ予算の範囲に収まる
+2. 応答なし: 呼び出しごとのタイムアウトでStorageTimeoutErrorになる
+3. 障害発生中: サーキットブレーカーが開いて即座に失敗し、復旧後に閉じる
+4. 取得エラー時の集計: 「データなし」扱いにならず、スロット単位の再取得（48クエリ）も行わない
+5. テールレイテンシ: ヘッジ読み取りでp99が下がる
+
+使い方:
+    python bench_resilience.py
+    python bench_resilience.py --calls 500 --seed 1
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from typing import List
+
+from local_storage import FaultInjectingStorage, LocalStorageService
+from opensmile_aggregator import OpenSMILEAggregator
+from resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientStorageBackend,
+    RetryBudget,
+    StorageError,
+    StorageTimeoutError,
+)
+
+
+DEVICE_ID = "bench-device"
+DATE = "2025-06-26"
+
+
+def create_local_storage() -> LocalStorageService:
+    storage = LocalStorageService(":memory:")
+    storage.upsert_opensmile_data([
+        {
+            "device_id": DEVICE_ID,
+            "date": DATE,
+            "time_block": f"{hour:02d}-00",
+            "emotion_extractor_result": [{"chunk_id": 1, "emotions": [{"label": "joy", "score": 1.5}]}]
+        }
+        for hour in range(24)
+    ])
+    return storage
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+async def count_successes(storage, calls: int) -> int:
+    successes = 0
+    for _ in range(calls):
+        try:
+            await storage.fetch_all_opensmile_data_for_day(DEVICE_ID, DATE)
+            successes += 1
+        except (StorageError, ConnectionError):
+            pass
+    return successes
+
+
+async def scenario_transient_errors(calls: int, seed: int) -> bool:
+    raw = FaultInjectingStorage(create_local_storage(), error_rate=0.2, seed=seed)
+    raw_successes = await count_successes(raw, calls)
+
+    faulty = FaultInjectingStorage(create_local_storage(), error_rate=0.2, seed=seed)
+    resilient = ResilientStorageBackend(
+        faulty, timeout=1.0, attempts=3, hedge_delay=0, base_delay=0.001, max_delay=0.005,
+        breaker=CircuitBreaker(failure_threshold=50), budget=RetryBudget(ratio=0.3)
+    )
+    resilient_successes = await count_successes(resilient, calls)
+    amplification = faulty.calls / calls
+
+    print("\n1️⃣ 一時的なエラー（20%）")
+    print(f"   成功率: リトライなし {raw_successes / calls:.1%} → リトライあり {resilient_successes / calls:.1%}")
+    print(f"   下位ストレージへの呼び出し: {amplification:.2f}倍（リトライ{resilient.stats['retries']}回）")
+    return resilient_successes > raw_successes and amplification <= 1.3 + 0.01
+
+
+async def scenario_hang() -> bool:
+    faulty = FaultInjectingStorage(create_local_storage(), hang_rate=1.0)
+    resilient = ResilientStorageBackend(
+        faulty, timeout=0.05, attempts=2, hedge_delay=0, base_delay=0.001, max_delay=0.005
+    )
+    started_at = time.perf_counter()
+    try:
+        await resilient.fetch_emotion_summary(DEVICE_ID, DATE)
+        raised = None
+    except StorageError as e:
+        raised = e
+    elapsed = time.perf_counter() - started_at
+
+    print("\n2️⃣ 応答なし（タイムアウト0.05秒 × 2回）")
+    print(f"   結果: {type(raised).__name__} ({elapsed:.2f}秒)")
+    return isinstance(raised, StorageTimeoutError) and elapsed < 1.0
+
+
+async def scenario_outage() -> bool:
+    faulty = FaultInjectingStorage(create_local_storage())
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.2)
+    resilient = ResilientStorageBackend(
+        faulty, timeout=1.0, attempts=1, hedge_delay=0, breaker=breaker
+    )
+
+    faulty.down = True
+    for _ in range(3):
+        try:
+            await resilient.fetch_all_opensmile_data_for_day(DEVICE_ID, DATE)
+        except StorageError:
+            pass
+    calls_before = faulty.calls
+    fast_failures = 0
+    for _ in range(20):
+        try:
+            await resilient.fetch_all_opensmile_data_for_day(DEVICE_ID, DATE)
+        except CircuitOpenError:
+            fast_failures += 1
+    opened = breaker.state == "open"
+
+    faulty.down = False
+    await asyncio.sleep(0.25)
+    recovered = await resilient.fetch_all_opensmile_data_for_day(DEVICE_ID, DATE)
+
+    print("\n3️⃣ 障害発生中（3回連続失敗でブレーカーを開く）")
+    print(f"   ブレーカー: {'open' if opened else breaker.state}、即時失敗 {fast_failures}/20回（下位への呼び出し {faulty.calls - calls_before - 1}回）")
+    print(f"   復旧後: {breaker.state}（{len(recovered)}行取得）")
+    return opened and fast_failures == 20 and breaker.state == "closed" and len(recovered) == 24
+
+
+async def scenario_aggregator_error() -> bool:
+    faulty = FaultInjectingStorage(create_local_storage())
+    faulty.down = True
+    aggregator = OpenSMILEAggregator(
+        ResilientStorageBackend(faulty, timeout=1.0, attempts=1, hedge_delay=0),
+        verbose=False
+    )
+    try:
+        await aggregator.fetch_all_data(DEVICE_ID, DATE)
+        raised = None
+    except StorageError as e:
+        raised = e
+
+    print("\n4️⃣ 取得エラー時の集計")
+    print(f"   結果: {type(raised).__name__}、下位への呼び出し {faulty.calls}回")
+    return raised is not None and faulty.calls == 1
+
+
+async def scenario_hedging(calls: int, seed: int) -> bool:
+    results = {}
+    for label, hedge_delay in (("ヘッジなし", 0.0), ("ヘッジあり", 0.02)):
+        faulty = FaultInjectingStorage(create_local_storage(), slow_rate=0.05, slow_latency=0.2, seed=seed)
+        resilient = ResilientStorageBackend(
+            faulty, timeout=1.0, hedge_delay=hedge_delay, budget=RetryBudget(ratio=0.2)
+        )
+        latencies = []
+        for _ in range(calls):
+            started_at = time.perf_counter()
+            await resilient.fetch_all_opensmile_data_for_day(DEVICE_ID, DATE)
+            latencies.append((time.perf_counter() - started_at) * 1000)
+        results[label] = latencies
+        print(f"   {label}: p50 {statistics.median(latencies):.1f}ms, p99 {percentile(latencies, 0.99):.1f}ms"
+              f"（ヘッジ {resilient.stats['hedges']}回）")
+    return percentile(results["ヘッジあり"], 0.99) < percentile(results["ヘッジなし"], 0.99)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="耐障害性レイヤーの検証ベンチマーク")
+    parser.add_argument("--calls", type=int, default=200, help="シナリオごとの呼び出し回数")
+    parser.add_argument("--seed", type=int, default=42, help="障害注入の乱数シード")
+    args = parser.parse_args()
+
+    checks = {
+        "一時的なエラー": await scenario_transient_errors(args.calls, args.seed),
+        "応答なし": await scenario_hang(),
+        "障害発生中": await scenario_outage(),
+        "取得エラー時の集計": await scenario_aggregator_error(),
+    }
+    print("\n5️⃣ テールレイテンシ（5%の呼び出しが200ms遅延、ヘッジ待ち20ms）")
+    checks["ヘッジ読み取り"] = await scenario_hedging(args.calls, args.seed)
+
+    failed = [name for name, ok in checks.items() if not ok]
+    if failed:
+        print(f"\n❌ 期待どおりに動作しなかったシナリオ: {', '.join(failed)}")
+        sys.exit(1)
+    print("\n✅ 全シナリオOK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
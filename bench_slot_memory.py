@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+スロットレコードのメモリ割り当てベンチマーク（tracemalloc）
+
+大量のデバイス日について、audio_features行を中間表現に変換して保持したときの
+メモリ使用量（保持量・ピーク）と処理時間を、従来のスロットごとの辞書表現と
+DaySlotScores（配列 + 日単位のメタデータ）で比較する。
+
+従来表現はベンチマーク内で再現している:
+  スロットごとに ラベル別リストの辞書 → スコア辞書 + メタデータ辞書のコピー → ラベルを付け替えたスコア辞書
+
+使い方:
+    python bench_slot_memory.py
+    python bench_slot_memory.py --days 5000 --chunks 20
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from emotion_scoring import EmotionScorer, TIME_SLOTS
+from opensmile_aggregator import OpenSMILEAggregator
+
+
+LABELS = ("neutral", "joy", "anger", "sadness")
+
+
+def generate_days(days: int, chunks: int, seed: int) -> List[List[Dict[str, Any]]]:
+    """1デバイス日ごとのaudio_features行（全48スロット）を生成"""
+    rng = random.Random(seed)
+    return [
+        [
+            {
+                "device_id": f"device-{day % 100}",
+                "date": f"2025-06-{day % 28 + 1:02d}",
+                "time_block": time_block,
+                "emotion_extractor_result": [
+                    {
+                        "chunk_id": chunk_id,
+                        "emotions": [{"label": label, "score": rng.uniform(-4, 4)} for label in LABELS]
+                    }
+                    for chunk_id in range(chunks)
+                ]
+            }
+            for time_block in TIME_SLOTS
+        ]
+        for day in range(days)
+    ]
+
+
+def legacy_convert(rows: List[Dict[str, Any]], scorer: EmotionScorer) -> Dict[str, Dict[str, float]]:
+    """従来の中間表現（スロットごとの辞書・メタデータのコピー・ラベルの付け替え）"""
+    label_mapping = {"anger": "ang", "sadness": "sad", "neutral": "neu", "joy": "hap"}
+    slot_data = {}
+    for data in rows:
+        emotion_scores_list = {"ang": [], "sad": [], "neu": [], "hap": []}
+        for chunk_data in data["emotion_extractor_result"]:
+            for emotion in chunk_data["emotions"]:
+                mapped_label = label_mapping.get(emotion["label"], emotion["label"])
+                if mapped_label in emotion_scores_list:
+                    emotion_scores_list[mapped_label].append(emotion.get("score", 0.0))
+        emotion_max_scores = {}
+        for label, scores in emotion_scores_list.items():
+            positive_scores = [s for s in scores if s > 0]
+            emotion_max_scores[label] = max(positive_scores) if positive_scores else 0.0
+        slot_data[data["time_block"]] = {
+            "emotion_scores": emotion_max_scores,
+            "metadata": {
+                "device_id": data.get("device_id"),
+                "date": data.get("date"),
+                "time_block": data.get("time_block"),
+                "duration_seconds": data.get("duration_seconds", 0),
+                "filename": data.get("filename", "")
+            }
+        }
+    return {slot: scorer.process_kushinada_v2_data(emotion_data) for slot, emotion_data in slot_data.items()}
+
+
+def measure(label: str, convert: Callable[[List[Dict[str, Any]]], Any], days: List[List[Dict[str, Any]]]) -> Dict[str, float]:
+    """全デバイス日を変換して保持したときの保持量・ピーク・処理時間を計測"""
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    converted = [convert(rows) for rows in days]
+    elapsed = time.perf_counter() - started_at
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "retained_mb": retained / 1024 / 1024,
+        "peak_mb": peak / 1024 / 1024,
+        "seconds": elapsed,
+        "bytes_per_slot": retained / (len(converted) * len(TIME_SLOTS))
+    }
+    print(
+        f"{label:<16} 保持 {result['retained_mb']:8.2f}MB  ピーク {result['peak_mb']:8.2f}MB  "
+        f"{result['bytes_per_slot']:7.1f}B/スロット  {result['seconds']:.2f}秒"
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スロットレコードのメモリ割り当てベンチマーク（tracemalloc）")
+    parser.add_argument("--days", type=int, default=2000, help="デバイス日数")
+    parser.add_argument("--chunks", type=int, default=10, help="1スロットあたりのチャンク数")
+    parser.add_argument("--seed", type=int, default=42, help="乱数シード")
+    args = parser.parse_args()
+
+    days = generate_days(args.days, args.chunks, args.seed)
+    aggregator = OpenSMILEAggregator(verbose=False)
+    scorer = aggregator.emotion_scorer
+    print(f"📊 {args.days}デバイス日 × {len(TIME_SLOTS)}スロット × {args.chunks}チャンク\n")
+
+    legacy = measure("従来（辞書）", lambda rows: legacy_convert(rows, scorer), days)
+    compact = measure("DaySlotScores", aggregator.convert_rows, days)
+
+    # 同じ感情グラフになることを確認
+    for rows in days[:50]:
+        expected = scorer.generate_full_day_data(legacy_convert(rows, scorer), "")["emotion_graph"]
+        assert aggregator.aggregate_rows(rows, "")["emotion_graph"] == expected, "感情グラフが一致しません"
+
+    print(
+        f"\n✅ 保持量 {legacy['retained_mb'] / compact['retained_mb']:.1f}分の1、"
+        f"ピーク {legacy['peak_mb'] / compact['peak_mb']:.1f}分の1、"
+        f"処理時間 {legacy['seconds'] / compact['seconds']:.1f}倍速（感情グラフは一致）"
+    )
+
+
+if __name__ == "__main__":
+    main()
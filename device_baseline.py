@@ -0,0 +1,284 @@
+"""
+デバイスごとの感情ベースライン
+デバイス × スロット × 感情ごとに指数加重移動平均（EWMA）の平均・分散を保持し、
+感情グラフが保存されるたびに更新する。
+「その人にとって珍しい」スパイクを、過去の audio_aggregator を読み直さずにzスコアで判定できる。
+
+- 直近 BASELINE_REPLAY_DAYS 日分は日ごとのスロット値（と集計結果のウォーターマーク）を保持し、
+  それより前の日は状態（anchor）に畳み込む。ベースラインは anchor から保持中の日を日付順に再計算する
+- 保持期間内であれば、同じ日の再保存・前の日付の保存（順序が前後した保存）も日付順に反映し直す。
+  同じ日の再保存が逆順に届いた場合は、ウォーターマークがより古い集計結果を反映しない
+- 保持期間より前（anchor に畳み込み済み）の日付の保存は反映できないため、再構築待ち（baseline-reseed）に登録する。
+  seed_derived_state.py --reseed-baselines で保存済みの感情グラフからデバイスのベースラインを作り直す
+- 観測日数が 1/α に達するまでは重み 1/n の累積平均・分散（Welford）で更新し、初期値0による分散の過小評価
+  （zスコアの過大評価）を避ける。1/α 日以降は重み α のEWMA
+- zスコアはその日より前の日だけで再計算したベースラインに対して計算する（その日以降のデータを含めない）
+"""
+
+import math
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from emotion_scoring import EMOTIONS, SLOT_INDEX, TIME_SLOTS, DaySlotScores
+from state_store import StateStore, get_state_store
+from storage_backend import is_older_watermark
+
+
+# デバイス × スロット × 感情のセル数（DaySlotScoresと同じ並び）
+CELLS = len(TIME_SLOTS) * len(EMOTIONS)
+
+# 分散が0に近いセルはzスコアを出さない
+_MIN_VARIANCE = 1e-6
+
+# 保持期間より前の日付の保存があったデバイス（{device_id: 最も古い日付}）
+RESEED_KEY = "baseline-reseed"
+
+
+def _empty_state() -> Dict[str, List[float]]:
+    return {"mean": [0.0] * CELLS, "var": [0.0] * CELLS, "count": [0] * CELLS}
+
+
+def _day_slots(day: DaySlotScores) -> Dict[str, List[float]]:
+    """データがあるスロットの4感情の値（EMOTIONSの順）"""
+    return {time_block: list(day.slot_scores(time_block).values()) for time_block in day.time_blocks()}
+
+
+def _update_state(state: Dict[str, List[float]], slots: Dict[str, List[float]], alpha: float):
+    """
+    1日分のスロット値で平均・分散を更新（データがないスロットは更新しない）
+
+    n日目の重みは max(α, 1/n)。1/n の間は累積平均・分散（Welford）と同じ値になり、
+    初期値0から始めるEWMAの分散の偏りが出ない
+    """
+    mean, var, count = state["mean"], state["var"], state["count"]
+    for time_block, values in slots.items():
+        offset = SLOT_INDEX[time_block] * len(EMOTIONS)
+        for label_index, value in enumerate(values):
+            cell = offset + label_index
+            count[cell] += 1
+            weight = max(alpha, 1.0 / count[cell])
+            diff = value - mean[cell]
+            increment = weight * diff
+            mean[cell] += increment
+            var[cell] = (1 - weight) * (var[cell] + diff * increment)
+
+
+def _replay(anchor: Dict[str, List[float]], days: List[Dict[str, Any]], alpha: float) -> Dict[str, List[float]]:
+    """anchor に保持中の日を日付順に反映した状態（anchorは変更しない）"""
+    state = {name: list(values) for name, values in anchor.items()}
+    for day in days:
+        _update_state(state, day["slots"], alpha)
+    return state
+
+
+def _new_baseline(device_id: str) -> Dict[str, Any]:
+    return {"device_id": device_id, "anchor": _empty_state(), "anchor_date": None, "days": [], "last_date": None}
+
+
+def _normalize(baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """日ごとの値を持たない以前の形式（before / current）は、current を anchor として引き継ぐ"""
+    if "anchor" not in baseline:
+        baseline = {
+            "device_id": baseline["device_id"],
+            "anchor": baseline["current"],
+            "anchor_date": baseline["last_date"],
+            "days": [],
+            "last_date": baseline["last_date"]
+        }
+    return baseline
+
+
+class DeviceBaselineMaintainer:
+    """デバイスごとのベースラインを保存のたびに更新し、感情グラフのzスコアを求める"""
+
+    def __init__(
+        self,
+        store: Optional[StateStore] = None,
+        alpha: Optional[float] = None,
+        min_days: Optional[int] = None,
+        replay_days: Optional[int] = None
+    ):
+        """
+        Args:
+            store: 派生状態ストア（未指定時は state_store.get_state_store()）
+            alpha: EWMAの平滑化係数（未指定時は環境変数BASELINE_EWMA_ALPHA、デフォルト0.05 ≒ 直近1か月程度）
+            min_days: zスコアを出すのに必要な観測日数（未指定時は環境変数BASELINE_MIN_DAYS、デフォルト7）
+            replay_days: 日ごとの値を保持して再計算できる日数（未指定時は環境変数BASELINE_REPLAY_DAYS、デフォルト14）
+        """
+        self.store = store or get_state_store()
+        self.alpha = alpha or float(os.getenv("BASELINE_EWMA_ALPHA", "0.05"))
+        self.min_days = min_days or int(os.getenv("BASELINE_MIN_DAYS", "7"))
+        self.replay_days = replay_days or int(os.getenv("BASELINE_REPLAY_DAYS", "14"))
+        if not 0 < self.alpha < 1:
+            raise ValueError("BASELINE_EWMA_ALPHA は0より大きく1未満の値を指定してください")
+        if self.replay_days < 1:
+            raise ValueError("BASELINE_REPLAY_DAYS は1以上を指定してください")
+
+    def _add_day(self, baseline: Dict[str, Any], date: str, slots: Dict[str, List[float]], watermark: Optional[str]) -> bool:
+        """
+        保持中の日に追加（同じ日は置き換え）し、保持期間を過ぎた日を anchor に畳み込んで再計算
+
+        Returns:
+            bool: 反映した場合True（記録済みの集計結果よりウォーターマークが古い場合False）
+        """
+        days = baseline["days"]
+        index = next((i for i, day in enumerate(days) if day["date"] >= date), len(days))
+        if index < len(days) and days[index]["date"] == date:
+            if is_older_watermark(watermark, days[index].get("watermark")):
+                # 後から届いた古い集計結果（新しい結果を反映済み）
+                return False
+            if watermark is None:
+                # マージはaudio_featuresを読まないため、集計結果のウォーターマークを引き継ぐ
+                watermark = days[index].get("watermark")
+            days[index] = {"date": date, "slots": slots, "watermark": watermark}
+        else:
+            days.insert(index, {"date": date, "slots": slots, "watermark": watermark})
+
+        cutoff = (datetime.strptime(days[-1]["date"], "%Y-%m-%d") - timedelta(days=self.replay_days)).strftime("%Y-%m-%d")
+        while days and days[0]["date"] <= cutoff:
+            folded = days.pop(0)
+            _update_state(baseline["anchor"], folded["slots"], self.alpha)
+            baseline["anchor_date"] = folded["date"]
+        baseline["last_date"] = days[-1]["date"] if days else baseline["anchor_date"]
+        return True
+
+    async def record_many(self, summaries: List[Dict[str, Any]]):
+        """
+        保存したデバイス日の感情グラフをベースラインに反映（全件を1トランザクションで更新）
+
+        Args:
+            summaries: {"device_id", "date", "emotion_graph", "watermark"} を持つ辞書のリスト
+        """
+        # 日付順に反映する（同じデバイス日が複数ある場合は後のものを採用）
+        days = sorted(
+            (
+                (
+                    summary["device_id"],
+                    summary["date"],
+                    _day_slots(DaySlotScores.from_emotion_graph(summary["emotion_graph"], summary["device_id"], summary["date"])),
+                    summary.get("watermark")
+                )
+                for summary in summaries
+            ),
+            key=lambda day: (day[0], day[1])
+        )
+        updated_at = datetime.now().isoformat()
+
+        def apply(load):
+            updates: Dict[str, Dict[str, Any]] = {}
+            queued = []
+            for device_id, date, slots, watermark in days:
+                key = f"baseline:{device_id}"
+                baseline = updates.get(key) or _normalize(load(key) or _new_baseline(device_id))
+                if baseline["anchor_date"] is not None and date <= baseline["anchor_date"]:
+                    # 畳み込み済みの日は再計算できないため、再構築待ちに登録する
+                    reseed = updates.get(RESEED_KEY) or load(RESEED_KEY) or {"devices": {}}
+                    earliest = reseed["devices"].get(device_id)
+                    reseed["devices"][device_id] = min(earliest, date) if earliest else date
+                    updates[RESEED_KEY] = reseed
+                    queued.append((device_id, date, baseline["anchor_date"]))
+                    continue
+                if not self._add_day(baseline, date, slots, watermark):
+                    continue
+                baseline.update({
+                    "current": _replay(baseline["anchor"], baseline["days"], self.alpha),
+                    "alpha": self.alpha,
+                    "updated_at": updated_at
+                })
+                updates[key] = baseline
+            return updates, queued
+
+        # Redisでは競合時にapplyが再実行されるため、警告は確定した結果に対して出す
+        for device_id, date, anchor_date in await self.store.transact(apply):
+            print(
+                f"⚠️ ベースラインの再計算期間（{anchor_date} より後）より前の日付のため、再構築待ちに登録しました: "
+                f"{device_id}/{date}（seed_derived_state.py --reseed-baselines）"
+            )
+
+    async def get(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """デバイスのベースライン（未作成の場合はNone）"""
+        baseline = (await self.store.get_many([f"baseline:{device_id}"]))[0]
+        return _normalize(baseline) if baseline is not None else None
+
+    async def pending_reseeds(self) -> Dict[str, str]:
+        """再構築待ちのデバイス（{device_id: 反映できなかった最も古い日付}）"""
+        reseed = (await self.store.get_many([RESEED_KEY]))[0]
+        return dict(reseed["devices"]) if reseed is not None else {}
+
+    async def reset(self, device_ids: List[str]):
+        """デバイスのベースラインを空にして再構築待ちから外す（保存済みの感情グラフから作り直す前に呼ぶ）"""
+        def apply(load):
+            reseed = load(RESEED_KEY) or {"devices": {}}
+            for device_id in device_ids:
+                reseed["devices"].pop(device_id, None)
+            updates = {f"baseline:{device_id}": _new_baseline(device_id) for device_id in device_ids}
+            updates[RESEED_KEY] = reseed
+            return updates, None
+
+        await self.store.transact(apply)
+
+    async def score(self, device_id: str, date: str, emotion_graph: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        感情グラフをデバイスのベースラインでzスコア・正規化値に変換（ベースライン1件の読み出しのみ）
+
+        ベースラインはその日より前の日だけで再計算する（過去の日付でも、その日以降のデータを含めない）。
+        正規化値はzスコアの標準正規分布の累積確率（0〜1、1に近いほどその人にとって珍しく高い）。
+        観測日数が min_days に満たないセル・分散が0に近いセルはNone。
+
+        Returns:
+            Dict: {"baseline_date", "emotion_graph_zscore", "emotion_graph_normalized"}
+                （baseline_date はベースラインに含まれる最後の日）
+
+        Raises:
+            ValueError: その日が再計算期間より前（その日より前の状態を保持していない）の場合
+        """
+        baseline = await self.get(device_id)
+        state = None
+        baseline_date = None
+        if baseline is not None:
+            if baseline["anchor_date"] is not None and date <= baseline["anchor_date"]:
+                raise ValueError(
+                    f"{date} はベースラインの再計算期間（{baseline['anchor_date']} より後）より前のため、"
+                    "その日時点のベースラインがありません"
+                )
+            previous_days = [day for day in baseline["days"] if day["date"] < date]
+            state = _replay(baseline["anchor"], previous_days, self.alpha)
+            baseline_date = previous_days[-1]["date"] if previous_days else baseline["anchor_date"]
+
+        zscores, normalized = [], []
+        for slot in emotion_graph:
+            time_block = slot.get("time", "").replace(":", "-")
+            index = SLOT_INDEX.get(time_block)
+            if index is None:
+                continue
+            z_slot, normalized_slot = {"time": slot["time"]}, {"time": slot["time"]}
+            for label_index, emotion in enumerate(EMOTIONS):
+                z = None
+                cell = index * len(EMOTIONS) + label_index
+                if state is not None and state["count"][cell] >= self.min_days and state["var"][cell] > _MIN_VARIANCE:
+                    z = (float(slot.get(emotion, 0.0)) - state["mean"][cell]) / math.sqrt(state["var"][cell])
+                z_slot[emotion] = round(z, 4) if z is not None else None
+                normalized_slot[emotion] = round(0.5 * (1 + math.erf(z / math.sqrt(2))), 4) if z is not None else None
+            zscores.append(z_slot)
+            normalized.append(normalized_slot)
+
+        return {
+            "baseline_date": baseline_date,
+            "emotion_graph_zscore": zscores,
+            "emotion_graph_normalized": normalized
+        }
+
+
+_maintainer: Optional[DeviceBaselineMaintainer] = None
+_maintainer_lock = threading.Lock()
+
+
+def get_device_baselines() -> DeviceBaselineMaintainer:
+    """プロセス内で共有するベースラインの更新・取得インスタンス（初回呼び出し時に生成）"""
+    global _maintainer
+    with _maintainer_lock:
+        if _maintainer is None:
+            _maintainer = DeviceBaselineMaintainer()
+        return _maintainer
@@ -5,13 +5,173 @@
 Kushinada v2の感情分類結果（4感情: neutral, joy, anger, sadness）をそのまま出力。
 """
 
-import yaml
 import json
+import re
+from array import array
+from itertools import repeat
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, Iterator, List, Optional, Any, Tuple, Union
 from datetime import datetime
 
 
+# Kushinada v2の4感情（スコア配列・感情グラフの並び順）
+EMOTIONS = ("neutral", "joy", "anger", "sadness")
+
+# emotion_extractor_resultのラベル → EMOTIONSのインデックス（v2ラベルと旧ラベルの両方を受け付ける）
+LABEL_INDEX = {
+    "neutral": 0, "neu": 0,
+    "joy": 1, "hap": 1,
+    "anger": 2, "ang": 2,
+    "sadness": 3, "sad": 3
+}
+
+# 30分スロット（00-00 〜 23-30）と、スロット → インデックス
+TIME_SLOTS = tuple(f"{hour:02d}-{minute:02d}" for hour in range(24) for minute in (0, 30))
+SLOT_INDEX = {slot: index for index, slot in enumerate(TIME_SLOTS)}
+
+
+# eGeMAPS特徴量名に含まれるパターン（いずれかを含む数値キーを特徴量として扱う）
+EGEMAPS_PATTERNS = (
+    "Loudness_sma3", "shimmerLocaldB_sma3nz", "HNRdBACF_sma3nz",
+    "jitterLocal_sma3nz", "F0semitoneFrom27.5Hz_sma3nz",
+    "spectralFlux_sma3", "mfcc", "alphaRatio_sma3",
+    "HammarbergIndex_sma3", "logRelF0", "slope500-1500_sma3"
+)
+_EGEMAPS_KEY_PATTERN = re.compile("|".join(re.escape(pattern) for pattern in EGEMAPS_PATTERNS))
+
+# キー分類の結果（0以上はルールで使う特徴量のインデックス）
+_NOT_EGEMAPS = -2
+_UNUSED_EGEMAPS = -1
+# キー分類のキャッシュの上限（任意のJSONキーでメモリが増え続けないように）
+_KEY_TABLE_LIMIT = 4096
+
+# 特徴量配列（EmotionScorer.feature_names の順、値がない特徴量はNone）
+FeatureArray = List[Optional[float]]
+
+
+class DaySlotScores:
+    """
+    1デバイス日分のスロット感情スコア（集計処理の内部表現）
+
+    48スロット × 4感情を1本の配列に EMOTIONS の順で保持し、device_id・dateは日単位で1回だけ持つ。
+    スロットごとの辞書・メタデータのコピー・ラベルの付け替えを行わない。
+    """
+
+    __slots__ = ("device_id", "date", "_values", "_present")
+
+    def __init__(self, device_id: Optional[str] = None, date: Optional[str] = None):
+        self.device_id = device_id
+        self.date = date
+        self._values = array("d", bytes(8 * len(TIME_SLOTS) * len(EMOTIONS)))
+        self._present = bytearray(len(TIME_SLOTS))
+
+    def __len__(self) -> int:
+        """データがあるスロット数"""
+        return sum(self._present)
+
+    def __contains__(self, time_block: str) -> bool:
+        index = SLOT_INDEX.get(time_block)
+        return index is not None and bool(self._present[index])
+
+    def time_blocks(self) -> Iterator[str]:
+        """データがあるスロットをtime_block順に返す"""
+        return (slot for slot, present in zip(TIME_SLOTS, self._present) if present)
+
+    def add_chunks(self, time_block: str, emotion_extractor_result: Optional[List[Dict[str, Any]]]) -> bool:
+        """
+        1ブロック分のチャンク感情からスロットのスコアを設定（同じスロットは置き換え）
+
+        設計思想: 感情のスパイクを見逃さない
+        - 各30分ブロック内の全チャンクから正の値（> 0）のみ抽出
+        - 最大値を採用してスパイクを保持
+        - 正の値がない場合は0.0（検出されなかった）
+
+        Returns:
+            bool: スロットを設定した場合True（チャンクが空・不正なtime_blockの場合はFalse）
+        """
+        index = SLOT_INDEX.get(time_block)
+        if index is None or not emotion_extractor_result:
+            return False
+
+        maxima = [0.0, 0.0, 0.0, 0.0]
+        for chunk_data in emotion_extractor_result:
+            for emotion in chunk_data.get("emotions") or ():
+                label_index = LABEL_INDEX.get(emotion.get("label"))
+                if label_index is not None:
+                    score = emotion.get("score", 0.0)
+                    if score > maxima[label_index]:
+                        maxima[label_index] = score
+
+        offset = index * len(EMOTIONS)
+        self._values[offset:offset + len(EMOTIONS)] = array("d", maxima)
+        self._present[index] = 1
+        return True
+
+    def set_slot(self, time_block: str, scores: Dict[str, float]):
+        """4感情スコアの辞書でスロットを設定（保存済みグラフの読み込み用）"""
+        index = SLOT_INDEX[time_block]
+        offset = index * len(EMOTIONS)
+        for label_index, emotion in enumerate(EMOTIONS):
+            self._values[offset + label_index] = float(scores.get(emotion, 0.0))
+        self._present[index] = 1
+
+    def slot_scores(self, time_block: str) -> Optional[Dict[str, float]]:
+        """スロットの4感情スコア（データがない場合はNone）"""
+        index = SLOT_INDEX.get(time_block)
+        if index is None or not self._present[index]:
+            return None
+        offset = index * len(EMOTIONS)
+        return dict(zip(EMOTIONS, self._values[offset:offset + len(EMOTIONS)]))
+
+    def update(self, other: "DaySlotScores", overwrite: bool = True):
+        """
+        他の日のスロットを取り込む
+
+        Args:
+            other: 取り込むスロットスコア
+            overwrite: Falseの場合はデータがないスロットだけを取り込む
+        """
+        width = len(EMOTIONS)
+        for index, present in enumerate(other._present):
+            if present and (overwrite or not self._present[index]):
+                offset = index * width
+                self._values[offset:offset + width] = other._values[offset:offset + width]
+                self._present[index] = 1
+
+    @classmethod
+    def from_emotion_graph(
+        cls,
+        emotion_graph: Optional[List[Dict[str, Any]]],
+        device_id: Optional[str] = None,
+        date: Optional[str] = None
+    ) -> "DaySlotScores":
+        """保存済みの感情グラフ（emotion_aggregator_result）から生成"""
+        day = cls(device_id, date)
+        for slot in emotion_graph or []:
+            time_block = slot.get("time", "").replace(":", "-")
+            if time_block in SLOT_INDEX:
+                day.set_slot(time_block, slot)
+        return day
+
+    def to_emotion_graph(self) -> List[Dict[str, Any]]:
+        """データがあるスロットだけの感情グラフ（[{"time": "HH:MM", "neutral": ..., ...}]）"""
+        values = self._values
+        width = len(EMOTIONS)
+        graph = []
+        for index, present in enumerate(self._present):
+            if present:
+                offset = index * width
+                slot = TIME_SLOTS[index]
+                graph.append({
+                    "time": f"{slot[:2]}:{slot[3:]}",
+                    "neutral": values[offset],
+                    "joy": values[offset + 1],
+                    "anger": values[offset + 2],
+                    "sadness": values[offset + 3]
+                })
+        return graph
+
+
 class EmotionScorer:
     """感情スコアリングクラス"""
 
@@ -19,10 +179,13 @@ class EmotionScorer:
         self.rules_path = rules_path
         self.rules = self._load_rules()
         # Kushinada v2の4感情
-        self.emotions = ["neutral", "joy", "anger", "sadness"]
+        self.emotions = list(EMOTIONS)
+        self._compile_rules()
     
     def _load_rules(self) -> Dict[str, Any]:
         """YAMLルールファイルを読み込み"""
+        # yamlはルール読み込み時のみ必要なため、import時には読み込まない
+        import yaml
         try:
             with open(self.rules_path, 'r', encoding='utf-8') as f:
                 return yaml.safe_load(f)
@@ -33,6 +196,42 @@ class EmotionScorer:
             print(f"⚠️ YAMLパースエラー: {e}")
             return {"emotions": {}}
     
+    def _compile_rules(self):
+        """
+        ルールを特徴量インデックスの配列で評価できる形に変換
+
+        - feature_names: ルールで使う特徴量（特徴量配列の並び順）
+        - _compiled_rules: (感情インデックス, 特徴量インデックス, op, th, op2, th2) のリスト
+        """
+        self.feature_names: List[str] = []
+        self._feature_index: Dict[str, int] = {}
+        self._compiled_rules: List[Tuple[int, int, str, Any, Optional[str], Any]] = []
+        self._key_table: Dict[str, int] = {}
+        rules = self.rules or {}
+        self._points = rules.get("meta", {}).get("max_points_per_rule", 1)
+
+        for emotion_index, emotion in enumerate(self.emotions):
+            for rule in rules.get("emotions", {}).get(emotion, []):
+                feature_name = rule.get('feature')
+                op = rule.get('op')
+                th = rule.get('th')
+                if not feature_name or op is None or th is None:
+                    # 必ず不成立になるルール
+                    continue
+                if feature_name not in self._feature_index:
+                    self._feature_index[feature_name] = len(self.feature_names)
+                    self.feature_names.append(feature_name)
+                op2 = rule.get('op2')
+                th2 = rule.get('th2')
+                self._compiled_rules.append((
+                    emotion_index,
+                    self._feature_index[feature_name],
+                    op,
+                    th,
+                    op2 if op2 and th2 is not None else None,
+                    th2
+                ))
+
     def _evaluate_rule(self, features: Dict[str, float], rule: Dict[str, Any]) -> bool:
         """単一ルールの評価"""
         feature_name = rule.get('feature')
@@ -69,50 +268,163 @@ class EmotionScorer:
     
     def score_features(self, features: Dict[str, float]) -> Dict[str, int]:
         """特徴量から感情スコアを計算"""
-        scores = {emotion: 0 for emotion in self.emotions}
-        
-        for emotion in self.emotions:
-            emotion_rules = self.rules.get("emotions", {}).get(emotion, [])
-            
-            for rule in emotion_rules:
-                if self._evaluate_rule(features, rule):
-                    scores[emotion] += self.rules.get("meta", {}).get("max_points_per_rule", 1)
-        
-        return scores
-    
+        return self.score_feature_array([features.get(name) for name in self.feature_names])
+
+    def score_feature_array(self, values: FeatureArray) -> Dict[str, int]:
+        """
+        特徴量配列（feature_namesの順）から感情スコアを計算
+
+        Args:
+            values: 特徴量の値（値がない特徴量はNone）
+
+        Returns:
+            Dict[str, int]: 感情ごとの成立ルール数 × max_points_per_rule
+        """
+        scores = [0] * len(self.emotions)
+        for emotion_index, feature_index, op, th, op2, th2 in self._compiled_rules:
+            value = values[feature_index]
+            if value is None:
+                continue
+            # 基本比較・範囲チェック（op2, th2がある場合）
+            if (op == ">" and value <= th) or (op == "<" and value >= th) or (op == "==" and value != th):
+                continue
+            if op2 is not None and (
+                (op2 == ">" and value <= th2) or (op2 == "<" and value >= th2) or (op2 == "==" and value != th2)
+            ):
+                continue
+            scores[emotion_index] += self._points
+        return dict(zip(self.emotions, scores))
+
+    def _classify_key(self, key: str) -> int:
+        """キーを分類（ルールで使う特徴量のインデックス / _UNUSED_EGEMAPS / _NOT_EGEMAPS）"""
+        slot = self._key_table.get(key)
+        if slot is None:
+            if _EGEMAPS_KEY_PATTERN.search(key) is None:
+                slot = _NOT_EGEMAPS
+            else:
+                slot = self._feature_index.get(key, _UNUSED_EGEMAPS)
+            if len(self._key_table) < _KEY_TABLE_LIMIT:
+                self._key_table[key] = slot
+        return slot
+
+    def extract_feature_array(self, opensmile_data: Any) -> Tuple[FeatureArray, bool]:
+        """
+        OpenSMILEのJSONデータからeGeMAPS特徴量を特徴量配列に抽出
+
+        任意の深さの辞書・リストを再帰なしで深さ優先に走査し、eGeMAPS特徴量名を含む数値キーを取り出す。
+        同じ特徴量が複数回現れた場合は、走査順で後のものを採用する。
+
+        Returns:
+            Tuple: (特徴量配列, eGeMAPS特徴量が1つでも見つかったか)
+        """
+        values: FeatureArray = [None] * len(self.feature_names)
+        found = False
+        classify = self._classify_key
+
+        if isinstance(opensmile_data, dict):
+            stack = [iter(opensmile_data.items())]
+        elif isinstance(opensmile_data, list):
+            stack = [zip(repeat(None), opensmile_data)]
+        else:
+            return values, found
+
+        while stack:
+            for key, value in stack[-1]:
+                if isinstance(value, (int, float)):
+                    # リストの要素（キーなし）の数値は特徴量として扱わない
+                    if isinstance(key, str):
+                        slot = classify(key)
+                        if slot != _NOT_EGEMAPS:
+                            found = True
+                            if slot >= 0:
+                                values[slot] = float(value)
+                elif isinstance(value, dict):
+                    stack.append(iter(value.items()))
+                    break
+                elif isinstance(value, list):
+                    stack.append(zip(repeat(None), value))
+                    break
+            else:
+                stack.pop()
+
+        return values, found
+
     def process_opensmile_data(self, opensmile_data: Dict[str, Any]) -> Dict[str, int]:
         """OpenSMILEのJSONデータから感情スコアを抽出（後方互換性用）"""
         # OpenSMILEのJSON構造に応じて特徴量を抽出
         # 通常は "features" や "data" キーの下にある
-        features = {}
-        
-        # データ構造を探索してeGeMAPS特徴量を抽出
-        def extract_features(obj, prefix=""):
-            if isinstance(obj, dict):
-                for key, value in obj.items():
-                    if isinstance(value, (int, float)):
-                        # eGeMAPS特徴量名にマッチする場合
-                        if any(pattern in key for pattern in [
-                            "Loudness_sma3", "shimmerLocaldB_sma3nz", "HNRdBACF_sma3nz",
-                            "jitterLocal_sma3nz", "F0semitoneFrom27.5Hz_sma3nz", 
-                            "spectralFlux_sma3", "mfcc", "alphaRatio_sma3",
-                            "HammarbergIndex_sma3", "logRelF0", "slope500-1500_sma3"
-                        ]):
-                            features[key] = float(value)
-                    elif isinstance(value, (dict, list)):
-                        extract_features(value, f"{prefix}{key}_")
-            elif isinstance(obj, list):
-                for i, item in enumerate(obj):
-                    extract_features(item, f"{prefix}{i}_")
-        
-        extract_features(opensmile_data)
+        values, found = self.extract_feature_array(opensmile_data)
         
         # 特徴量が見つからない場合の処理
-        if not features:
+        if not found:
             print(f"⚠️ eGeMAPS特徴量が見つかりません。利用可能なキー: {list(opensmile_data.keys())}")
             return {emotion: 0 for emotion in self.emotions}
         
-        return self.score_features(features)
+        return self.score_feature_array(values)
+
+    def _is_frame(self, value: Any) -> bool:
+        """eGeMAPS特徴量名の数値キーを直下に持つ辞書（1フレーム分の特徴量）か"""
+        return isinstance(value, dict) and any(
+            isinstance(key, str) and isinstance(item, (int, float)) and self._classify_key(key) != _NOT_EGEMAPS
+            for key, item in value.items()
+        )
+
+    def extract_feature_frames(self, opensmile_data: Any) -> List[FeatureArray]:
+        """
+        フレームごとの特徴量配列を抽出（フルレゾリューションの特徴量ファイル用）
+
+        次の2形式に対応:
+        - フレームのリスト: [{"Loudness_sma3": 0.1, ...}, ...]（各フレームを extract_feature_array で抽出）。
+          {"features": [{...}, ...]} のように任意の深さにあってもよい（複数ある場合は走査順に連結）
+        - 特徴量ごとの時系列: {"Loudness_sma3": [0.1, 0.2, ...], ...}（任意の深さ、同じ特徴量は後のものを採用）
+
+        両方の形式が含まれる場合はフレームのリストを採用する。
+
+        Returns:
+            List[FeatureArray]: フレームごとの特徴量配列
+        """
+        if isinstance(opensmile_data, list):
+            return [self.extract_feature_array(frame)[0] for frame in opensmile_data]
+
+        frame_lists: List[FeatureArray] = []
+        series: Dict[int, List[Any]] = {}
+        stack: List[Iterator] = [iter(opensmile_data.items())] if isinstance(opensmile_data, dict) else []
+        while stack:
+            for key, value in stack[-1]:
+                if isinstance(value, list) and isinstance(key, str) and self._classify_key(key) >= 0:
+                    series[self._classify_key(key)] = value
+                elif isinstance(value, list) and value and all(isinstance(item, dict) for item in value) \
+                        and any(self._is_frame(item) for item in value):
+                    # 辞書のリストで特徴量キーを持つものはフレームのリストとして扱う
+                    frame_lists.extend(self.extract_feature_array(frame)[0] for frame in value)
+                elif isinstance(value, dict):
+                    stack.append(iter(value.items()))
+                    break
+                elif isinstance(value, list):
+                    stack.append(zip(repeat(None), value))
+                    break
+            else:
+                stack.pop()
+
+        if frame_lists:
+            return frame_lists
+
+        frame_count = max((len(values) for values in series.values()), default=0)
+        frames: List[FeatureArray] = [[None] * len(self.feature_names) for _ in range(frame_count)]
+        for feature_index, values in series.items():
+            for frame, value in zip(frames, values):
+                if isinstance(value, (int, float)):
+                    frame[feature_index] = float(value)
+        return frames
+
+    def process_opensmile_frames(self, opensmile_data: Any) -> List[Dict[str, int]]:
+        """
+        フレームごとの感情スコアを計算（extract_feature_frames の2形式に対応）
+
+        Returns:
+            List[Dict[str, int]]: フレームごとの感情スコア
+        """
+        return [self.score_feature_array(values) for values in self.extract_feature_frames(opensmile_data)]
     
     def process_kushinada_v2_data(self, emotion_data: Dict[str, Any]) -> Dict[str, float]:
         """Kushinada v2の感情分類結果（4感情）をそのまま返す"""
@@ -149,15 +461,20 @@ class EmotionScorer:
             **emotion_scores
         }
 
-    def generate_full_day_data(self, slot_scores: Dict[str, Dict[str, float]], date: str) -> Dict[str, Any]:
+    def generate_full_day_data(
+        self,
+        slot_scores: Union[DaySlotScores, Dict[str, Dict[str, float]]],
+        date: str
+    ) -> Dict[str, Any]:
         """1日分の感情グラフデータを生成（実際にデータがあるスロットのみ、4感情）"""
-        time_slots = []
-        for hour in range(24):
-            for minute in [0, 30]:
-                time_slots.append(f"{hour:02d}-{minute:02d}")
+        if isinstance(slot_scores, DaySlotScores):
+            return {
+                "date": date,
+                "emotion_graph": slot_scores.to_emotion_graph()
+            }
 
         emotion_graph = []
-        for slot in time_slots:
+        for slot in TIME_SLOTS:
             if slot in slot_scores:
                 # データがある場合のみ追加
                 emotion_data = self.create_time_slot_data(slot, slot_scores[slot])
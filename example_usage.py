@@ -31,38 +31,96 @@ class OpenSMILEAnalysisClient:
                     error = await response.text()
                     raise Exception(f"感情分析開始エラー: {error}")
     
-    async def get_status(self, task_id: str) -> dict:
-        """タスク状況を取得"""
+    async def analyze_sync(self, device_id: str, date: str, persist: bool = True) -> dict:
+        """
+        感情分析を同期実行してemotion_graphを取得
+
+        サーバー側の待ち時間を超えた場合は202でタスクIDが返るため、状況確認で完了を待つ
+        """
+        url = f"{self.base_url}/analyze/opensmile-aggregator/sync"
+        data = {"device_id": device_id, "date": date, "persist": persist}
+        
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=data) as response:
+                if response.status == 200:
+                    return await response.json()
+                elif response.status == 202:
+                    result = await response.json()
+                    return await self.wait_for_completion(result["task_id"])
+                else:
+                    error = await response.text()
+                    raise Exception(f"同期感情分析エラー: {error}")
+    
+    async def get_status(self, task_id: str, wait: float = 0) -> dict:
+        """タスク状況を取得（waitを指定すると状況が変化するまで最大wait秒待機する長ポーリング）"""
         url = f"{self.base_url}/analyze/opensmile-aggregator/{task_id}"
+        params = {"wait": wait} if wait > 0 else None
         
         async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
+            async with session.get(url, params=params) as response:
                 if response.status == 200:
                     return await response.json()
                 else:
                     error = await response.text()
                     raise Exception(f"状況取得エラー: {error}")
     
+    async def stream_status(self, task_id: str):
+        """Server-Sent Eventsでタスク状況の変化を順に受け取る（完了・失敗で終了）"""
+        url = f"{self.base_url}/analyze/opensmile-aggregator/{task_id}/events"
+        
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=None, sock_read=60)) as response:
+                if response.status != 200:
+                    error = await response.text()
+                    raise Exception(f"状況ストリーム取得エラー: {error}")
+                
+                event_name = None
+                async for raw_line in response.content:
+                    line = raw_line.decode("utf-8").rstrip("\r\n")
+                    if line.startswith("event:"):
+                        event_name = line[len("event:"):].strip()
+                    elif line.startswith("data:") and event_name == "status":
+                        yield json.loads(line[len("data:"):].strip())
+    
     async def wait_for_completion(self, task_id: str, max_wait: int = 600) -> dict:
-        """感情分析完了まで待機"""
+        """感情分析完了まで待機（SSEで状況の変化を受信し、使えない場合は長ポーリング）"""
         print(f"⏳ 感情分析完了を待機中... (最大{max_wait}秒)")
         
-        for i in range(max_wait):
-            status = await self.get_status(task_id)
-            
-            print(f"🎭 進捗: {status['progress']}% - {status['message']}")
+        try:
+            return await asyncio.wait_for(self._wait_with_stream(task_id), max_wait)
+        except asyncio.TimeoutError:
+            raise Exception("タイムアウト: 感情分析が時間内に完了しませんでした")
+        except Exception as e:
+            print(f"⚠️ SSEが利用できないため長ポーリングに切り替えます: {e}")
+        
+        deadline = asyncio.get_running_loop().time() + max_wait
+        while True:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                raise Exception("タイムアウト: 感情分析が時間内に完了しませんでした")
             
-            if status['status'] == 'completed':
-                print("✅ 感情分析完了!")
+            status = await self.get_status(task_id, wait=min(30, remaining))
+            if self._report(status):
                 return status
-            elif status['status'] == 'failed':
-                print(f"❌ 感情分析失敗: {status.get('error', '不明なエラー')}")
+    
+    async def _wait_with_stream(self, task_id: str) -> dict:
+        async for status in self.stream_status(task_id):
+            if self._report(status):
                 return status
-            
-            await asyncio.sleep(1)
+        raise Exception("完了前に状況ストリームが終了しました")
+    
+    @staticmethod
+    def _report(status: dict) -> bool:
+        """進捗を表示し、完了・失敗ならTrueを返す"""
+        print(f"🎭 進捗: {status['progress']}% - {status['message']}")
         
-        raise Exception("タイムアウト: 感情分析が時間内に完了しませんでした")
-
+        if status['status'] == 'completed':
+            print("✅ 感情分析完了!")
+            return True
+        elif status['status'] == 'failed':
+            print(f"❌ 感情分析失敗: {status.get('error', '不明なエラー')}")
+            return True
+        return False
 
 async def example_api_usage():
     """API使用例の実行"""
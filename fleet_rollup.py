@@ -0,0 +1,307 @@
+"""
+フリート・グループ単位の感情ロールアップ
+デバイス日の感情グラフが保存されるたびに、フリート全体とデバイスグループごとの
+1日単位の集計（時間ごとのデバイス数・スパイク数・合計・最大値・ヒストグラム）をインクリメンタルに更新する。
+管理画面は全デバイスの emotion_aggregator_result を読まずに、デバイス数によらず1キーの読み出しで取得できる。
+
+- デバイスの1時間の値は、その時間の2スロット（HH:00・HH:30）の最大値
+- デバイス日ごとの寄与（スコープ・時間ごとの値・集計結果のウォーターマーク）を保存しておき、
+  同じデバイス日の再保存時は古い寄与を引いてから足す
+- ロールアップの更新は保存とは別のトランザクションのため、同じデバイス日の再保存が逆順に届くことがある。
+  記録済みの寄与よりウォーターマークが古い集計結果は反映しない（インジェストのマージはウォーターマークを持たないため到着順）
+- 最大値は引けないため、レスポンスでは max_ever_observed（置き換え前の寄与を含む、これまでに観測した最大値）として返す
+- スパイクの閾値・ヒストグラムの境界はロールアップ（スコープ × 日）ごとに作成時の設定を保持する
+"""
+
+import json
+import os
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+from emotion_scoring import EMOTIONS
+from state_store import StateStore, get_state_store
+from storage_backend import is_older_watermark
+
+
+# 全デバイスを対象にするスコープ名（グループ名には使えない）
+FLEET_SCOPE = "fleet"
+
+HOURS = 24
+
+# ヒストグラムの境界（デフォルト）。bin i は edges[i-1] <= 値 < edges[i]
+DEFAULT_HISTOGRAM_EDGES = (0.5, 1.0, 2.0, 4.0, 8.0)
+
+# 期間指定で取得できる最大日数
+MAX_ROLLUP_RANGE_DAYS = 31
+
+
+def _parse_edges(raw: str) -> List[float]:
+    edges = sorted(float(value) for value in raw.split(",") if value.strip())
+    if not edges:
+        raise ValueError("ROLLUP_HISTOGRAM_EDGES には1つ以上の境界値を指定してください")
+    return edges
+
+
+def device_hourly_values(emotion_graph: Optional[List[Dict[str, Any]]]) -> Dict[str, List[Optional[float]]]:
+    """
+    感情グラフから感情ごとの時間別の値（2スロットの最大値、データがない時間はNone）を求める
+
+    Returns:
+        Dict[str, List[Optional[float]]]: {感情: 24時間分の値}
+    """
+    hourly: Dict[str, List[Optional[float]]] = {emotion: [None] * HOURS for emotion in EMOTIONS}
+    for slot in emotion_graph or []:
+        try:
+            hour = int(slot.get("time", "")[:2])
+        except ValueError:
+            continue
+        if not 0 <= hour < HOURS:
+            continue
+        for emotion in EMOTIONS:
+            value = slot.get(emotion)
+            if value is None:
+                continue
+            current = hourly[emotion][hour]
+            if current is None or value > current:
+                hourly[emotion][hour] = float(value)
+    return hourly
+
+
+def _empty_rollup(scope: str, date: str, edges: Sequence[float], spike_threshold: float) -> Dict[str, Any]:
+    bins = len(edges) + 1
+    return {
+        "scope": scope,
+        "date": date,
+        "device_days": 0,
+        "spike_threshold": spike_threshold,
+        "histogram_edges": list(edges),
+        "emotions": {
+            emotion: {
+                "count": [0] * HOURS,
+                "spikes": [0] * HOURS,
+                "sum": [0.0] * HOURS,
+                "max": [None] * HOURS,
+                "histogram": [[0] * bins for _ in range(HOURS)]
+            }
+            for emotion in EMOTIONS
+        },
+        "updated_at": None
+    }
+
+
+def _apply_contribution(rollup: Dict[str, Any], hourly: Dict[str, List[Optional[float]]], sign: int):
+    """デバイス日1件分の寄与をロールアップに足す（sign=1）または引く（sign=-1）"""
+    edges = rollup["histogram_edges"]
+    threshold = rollup["spike_threshold"]
+    rollup["device_days"] += sign
+    for emotion, values in hourly.items():
+        stats = rollup["emotions"][emotion]
+        for hour, value in enumerate(values):
+            if value is None:
+                continue
+            stats["count"][hour] += sign
+            stats["sum"][hour] += sign * value
+            stats["histogram"][hour][bisect_right(edges, value)] += sign
+            if value >= threshold:
+                stats["spikes"][hour] += sign
+            if sign > 0 and (stats["max"][hour] is None or value > stats["max"][hour]):
+                stats["max"][hour] = value
+
+
+def summarize_rollup(rollup: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    ロールアップに時間ごとのスパイク割合・平均を付け加えたレスポンス用の辞書
+
+    最大値は再保存で置き換えた寄与から引けないため、max_ever_observed（これまでに観測した最大値）として返す
+    """
+    summary = {key: value for key, value in rollup.items() if key != "emotions"}
+    summary["emotions"] = {}
+    for emotion, stats in rollup["emotions"].items():
+        summary["emotions"][emotion] = {
+            "count": stats["count"],
+            "spikes": stats["spikes"],
+            "spike_share": [
+                round(spikes / count, 4) if count else None
+                for spikes, count in zip(stats["spikes"], stats["count"])
+            ],
+            "mean": [
+                round(total / count, 4) if count else None
+                for total, count in zip(stats["sum"], stats["count"])
+            ],
+            "max_ever_observed": stats["max"],
+            "histogram": stats["histogram"]
+        }
+    return summary
+
+
+def merge_rollups(rollups: List[Dict[str, Any]], scope: str, start_date: str, end_date: str) -> Dict[str, Any]:
+    """
+    複数日のロールアップを合算（時間ごとの値を日をまたいで足し合わせる）
+
+    Raises:
+        ValueError: スパイクの閾値・ヒストグラムの境界が異なる日が含まれる場合
+    """
+    if not rollups:
+        return {"scope": scope, "start_date": start_date, "end_date": end_date, "days": 0, "device_days": 0}
+
+    first = rollups[0]
+    merged = _empty_rollup(scope, start_date, first["histogram_edges"], first["spike_threshold"])
+    for rollup in rollups:
+        if rollup["histogram_edges"] != first["histogram_edges"] or rollup["spike_threshold"] != first["spike_threshold"]:
+            raise ValueError(f"{rollup['date']} のロールアップは閾値・ヒストグラムの境界が異なるため合算できません")
+        merged["device_days"] += rollup["device_days"]
+        for emotion, stats in rollup["emotions"].items():
+            target = merged["emotions"][emotion]
+            for hour in range(HOURS):
+                target["count"][hour] += stats["count"][hour]
+                target["spikes"][hour] += stats["spikes"][hour]
+                target["sum"][hour] += stats["sum"][hour]
+                if stats["max"][hour] is not None and (target["max"][hour] is None or stats["max"][hour] > target["max"][hour]):
+                    target["max"][hour] = stats["max"][hour]
+                target["histogram"][hour] = [a + b for a, b in zip(target["histogram"][hour], stats["histogram"][hour])]
+
+    summary = summarize_rollup(merged)
+    del summary["date"]
+    summary.update({
+        "start_date": start_date,
+        "end_date": end_date,
+        "days": len(rollups),
+        "updated_at": max((rollup["updated_at"] or "") for rollup in rollups) or None
+    })
+    return summary
+
+
+class FleetRollupMaintainer:
+    """フリート・グループ単位のロールアップを保存のたびに更新・取得する"""
+
+    def __init__(
+        self,
+        store: Optional[StateStore] = None,
+        groups: Optional[Dict[str, List[str]]] = None,
+        spike_threshold: Optional[float] = None,
+        histogram_edges: Optional[Sequence[float]] = None
+    ):
+        """
+        Args:
+            store: 派生状態ストア（未指定時は state_store.get_state_store()）
+            groups: {グループ名: [device_id, ...]}（未指定時は環境変数ROLLUP_GROUPS_PATHのJSONファイル）
+            spike_threshold: スパイクとみなす値（未指定時は環境変数ROLLUP_SPIKE_THRESHOLD、デフォルト2.0）
+            histogram_edges: ヒストグラムの境界（未指定時は環境変数ROLLUP_HISTOGRAM_EDGES、カンマ区切り）
+        """
+        self.store = store or get_state_store()
+        self.spike_threshold = spike_threshold if spike_threshold is not None else float(os.getenv("ROLLUP_SPIKE_THRESHOLD", "2.0"))
+        if histogram_edges is not None:
+            self.histogram_edges = sorted(float(edge) for edge in histogram_edges)
+        elif os.getenv("ROLLUP_HISTOGRAM_EDGES"):
+            self.histogram_edges = _parse_edges(os.getenv("ROLLUP_HISTOGRAM_EDGES"))
+        else:
+            self.histogram_edges = list(DEFAULT_HISTOGRAM_EDGES)
+
+        if groups is None:
+            groups = self._load_groups(os.getenv("ROLLUP_GROUPS_PATH"))
+        if FLEET_SCOPE in groups:
+            raise ValueError(f"グループ名 {FLEET_SCOPE} はフリート全体のスコープとして予約されています")
+        self.groups = sorted(groups)
+        self._device_groups: Dict[str, List[str]] = {}
+        for group, device_ids in sorted(groups.items()):
+            for device_id in device_ids:
+                self._device_groups.setdefault(device_id, []).append(group)
+
+    @staticmethod
+    def _load_groups(path: Optional[str]) -> Dict[str, List[str]]:
+        if not path:
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def scopes_for(self, device_id: str) -> List[str]:
+        """デバイスが集計されるスコープ（フリート全体 + 所属グループ）"""
+        return [FLEET_SCOPE] + self._device_groups.get(device_id, [])
+
+    def has_scope(self, scope: str) -> bool:
+        """フリート全体または設定済みのグループならTrue"""
+        return scope == FLEET_SCOPE or scope in self.groups
+
+    async def record_many(self, summaries: List[Dict[str, Any]]):
+        """
+        保存したデバイス日の感情グラフをロールアップに反映（全件を1トランザクションで更新）
+
+        Args:
+            summaries: {"device_id", "date", "emotion_graph", "watermark"} を持つ辞書のリスト
+                （記録済みの寄与よりwatermarkが古いものは反映しない）
+        """
+        contributions = [
+            (summary["device_id"], summary["date"], self.scopes_for(summary["device_id"]),
+             device_hourly_values(summary["emotion_graph"]), summary.get("watermark"))
+            for summary in summaries
+        ]
+        updated_at = datetime.now().isoformat()
+
+        def apply(load):
+            updates: Dict[str, Dict[str, Any]] = {}
+
+            def rollup_for(scope: str, date: str) -> Dict[str, Any]:
+                key = f"rollup:{scope}:{date}"
+                if key not in updates:
+                    updates[key] = load(key) or _empty_rollup(scope, date, self.histogram_edges, self.spike_threshold)
+                return updates[key]
+
+            for device_id, date, scopes, hourly, watermark in contributions:
+                contribution_key = f"rollup-contribution:{device_id}:{date}"
+                previous = updates[contribution_key] if contribution_key in updates else load(contribution_key)
+                if previous is not None:
+                    if is_older_watermark(watermark, previous.get("watermark")):
+                        # 後から届いた古い集計結果（新しい結果を反映済み）
+                        continue
+                    for scope in previous["scopes"]:
+                        _apply_contribution(rollup_for(scope, date), previous["hourly"], -1)
+                    if watermark is None:
+                        # マージはaudio_featuresを読まないため、集計結果のウォーターマークを引き継ぐ
+                        watermark = previous.get("watermark")
+                for scope in scopes:
+                    rollup = rollup_for(scope, date)
+                    _apply_contribution(rollup, hourly, 1)
+                    rollup["updated_at"] = updated_at
+                updates[contribution_key] = {"scopes": scopes, "hourly": hourly, "watermark": watermark}
+            return updates, len(contributions)
+
+        await self.store.transact(apply)
+
+    async def get(self, scope: str, date: str) -> Optional[Dict[str, Any]]:
+        """1日分のロールアップ（未集計の場合はNone）"""
+        rollup = (await self.store.get_many([f"rollup:{scope}:{date}"]))[0]
+        return summarize_rollup(rollup) if rollup is not None else None
+
+    async def get_range(self, scope: str, start_date: str, end_date: str) -> Dict[str, Any]:
+        """
+        期間（両端を含む）のロールアップを合算して取得
+
+        Raises:
+            ValueError: 期間が不正、MAX_ROLLUP_RANGE_DAYSを超える、または合算できない日が含まれる場合
+        """
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.strptime(end_date, "%Y-%m-%d")
+        days = (end - start).days + 1
+        if days < 1:
+            raise ValueError("end_date は start_date 以降の日付を指定してください")
+        if days > MAX_ROLLUP_RANGE_DAYS:
+            raise ValueError(f"期間は{MAX_ROLLUP_RANGE_DAYS}日以内で指定してください")
+
+        dates = [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+        rollups = await self.store.get_many([f"rollup:{scope}:{date}" for date in dates])
+        return merge_rollups([rollup for rollup in rollups if rollup is not None], scope, start_date, end_date)
+
+
+_maintainer: Optional[FleetRollupMaintainer] = None
+_maintainer_lock = threading.Lock()
+
+
+def get_fleet_rollups() -> FleetRollupMaintainer:
+    """プロセス内で共有するロールアップの更新・取得インスタンス（初回呼び出し時に生成）"""
+    global _maintainer
+    with _maintainer_lock:
+        if _maintainer is None:
+            _maintainer = FleetRollupMaintainer()
+        return _maintainer
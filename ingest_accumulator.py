@@ -0,0 +1,140 @@
+"""
+プッシュ型インジェスト用の集計アキュムレーター
+
+Emotion Feature Extractor がブロック（30分スロット）ごとのチャンク感情を直接POSTし、
+デバイス日ごとのインメモリアキュムレーターでスロットの集計値を更新する。
+audio_features からの再読み込みを行わず、定期的またはその日の確定（seal）時に
+audio_aggregator へまとめて書き出す。
+
+- スロットの集計ロジックはプル型（OpenSMILEAggregator）と同じ DaySlotScores.add_chunks（正の値の最大値）
+- 同じブロックが再送された場合はそのブロックの値で置き換える（プル型の再実行と同じ）
+- 書き出しは StorageBackend.merge_emotion_summary で未書き出しのブロックだけをアトミックに上書きマージするため、
+  複数ワーカー・複数レプリカに分散してPOSTされ、同時に書き出されても他のブロックを消さない
+- インジェストしたブロックは audio_features には書き込まない。プル型（POST・/sync・バッチ・バックフィル・
+  スケジューラー）の集計は audio_features から1日分を作り直して置き換えるため、audio_features にないブロックは消える。
+  Feature Extractor は従来どおり audio_features にも書き込み、インジェストは反映を早めるための経路として使う
+"""
+
+import asyncio
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from emotion_scoring import DaySlotScores, TIME_SLOTS
+from storage_backend import StorageBackend
+
+
+class IngestAccumulator:
+    """デバイス日ごとの未書き出しブロックを保持し、audio_aggregatorへ書き出すアキュムレーター"""
+
+    def __init__(
+        self,
+        storage_factory: Callable[[], StorageBackend],
+        flush_interval: Optional[float] = None
+    ):
+        """
+        Args:
+            storage_factory: 書き出しに使うストレージを生成する関数（初回書き出し時に1回だけ呼ぶ）
+            flush_interval: 定期書き出しの間隔（秒）。未指定時は環境変数INGEST_FLUSH_INTERVAL_SECONDS（デフォルト30）
+        """
+        self._storage_factory = storage_factory
+        self._storage: Optional[StorageBackend] = None
+        self.flush_interval = flush_interval or float(os.getenv("INGEST_FLUSH_INTERVAL_SECONDS", "30"))
+        # (device_id, date) → 未書き出しブロックのスロットスコア
+        self._pending: Dict[Tuple[str, str], DaySlotScores] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+    @property
+    def storage(self) -> StorageBackend:
+        if self._storage is None:
+            self._storage = self._storage_factory()
+        return self._storage
+
+    @property
+    def time_slots(self) -> List[str]:
+        """受け付け可能なtime_block（00-00〜23-30）"""
+        return list(TIME_SLOTS)
+
+    def pending_days(self) -> List[Tuple[str, str]]:
+        """未書き出しのブロックを持つ(device_id, date)の一覧"""
+        return list(self._pending.keys())
+
+    def ingest_block(
+        self,
+        device_id: str,
+        date: str,
+        time_block: str,
+        emotion_extractor_result: List[Dict[str, Any]]
+    ) -> Optional[Dict[str, float]]:
+        """
+        1ブロック分のチャンク感情を受け付けてスロットの集計値を更新
+
+        Args:
+            device_id: デバイスID
+            date: 日付 (YYYY-MM-DD形式)
+            time_block: 時間ブロック (HH-MM形式)
+            emotion_extractor_result: audio_features.emotion_extractor_result と同じ形式のチャンクリスト
+
+        Returns:
+            Dict[str, float]: スロットの4感情スコア（チャンクが空の場合はNone）
+        """
+        key = (device_id, date)
+        day = self._pending.get(key) or DaySlotScores(device_id, date)
+        if not day.add_chunks(time_block, emotion_extractor_result):
+            return None
+
+        self._pending[key] = day
+        return day.slot_scores(time_block)
+
+    async def flush_day(self, device_id: str, date: str) -> bool:
+        """
+        指定デバイス日の未書き出しブロックをaudio_aggregatorへ書き出す
+
+        Returns:
+            bool: 書き出し成功時（書き出すものがない場合も）True
+        """
+        key = (device_id, date)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            pending = self._pending.pop(key, None)
+            if not pending:
+                return True
+
+            try:
+                await self.storage.merge_emotion_summary(device_id, date, pending.to_emotion_graph())
+            except Exception as e:
+                print(f"❌ インジェスト書き出しエラー: {device_id}/{date}: {e}")
+                # 書き出し中に届いた新しいブロックを優先して未書き出しに戻す
+                restored = self._pending.setdefault(key, DaySlotScores(device_id, date))
+                restored.update(pending, overwrite=False)
+                return False
+
+            print(f"✅ インジェスト書き出し: {device_id}/{date} ({len(pending)}ブロック)")
+            return True
+
+    async def seal(self, device_id: str, date: str) -> bool:
+        """その日のデータが揃ったとして即時に書き出す"""
+        return await self.flush_day(device_id, date)
+
+    async def flush_all(self) -> int:
+        """
+        全デバイス日の未書き出しブロックを書き出す
+
+        Returns:
+            int: 書き出しに成功したデバイス日数
+        """
+        flushed = 0
+        for device_id, date in self.pending_days():
+            if await self.flush_day(device_id, date):
+                flushed += 1
+
+        # 書き出し済みで使われていないロックを解放
+        for key in [k for k, lock in self._locks.items() if k not in self._pending and not lock.locked()]:
+            del self._locks[key]
+        return flushed
+
+    async def run_periodic_flush(self):
+        """flush_interval ごとに全デバイス日を書き出すループ（アプリ起動時にタスクとして開始）"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._pending:
+                await self.flush_all()
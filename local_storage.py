@@ -0,0 +1,423 @@
+"""
+ローカルストレージサービス
+SupabaseService と同じインターフェースで SQLite（ファイル or インメモリ）にデータを読み書きする
+
+テーブル構成は Supabase と同じ:
+- audio_features:   (device_id, date, time_block) 単位の emotion_extractor_result
+- audio_aggregator: (device_id, date) 単位の emotion_aggregator_result
+"""
+
+import asyncio
+import json
+import random
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from emotion_scoring import DaySlotScores
+from resilience import StorageUnavailableError, to_storage_error
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audio_features (
+    device_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time_block TEXT NOT NULL,
+    emotion_extractor_result TEXT,
+    created_at TEXT NOT NULL,
+    emotion_extractor_updated_at TEXT,
+    PRIMARY KEY (device_id, date, time_block)
+);
+CREATE INDEX IF NOT EXISTS idx_audio_features_date_device
+    ON audio_features (date, device_id, time_block);
+
+CREATE TABLE IF NOT EXISTS audio_aggregator (
+    device_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    emotion_aggregator_result TEXT,
+    emotion_aggregator_processed_at TEXT,
+    PRIMARY KEY (device_id, date)
+);
+"""
+
+# 未集計デバイス日の検出に使うウォーターマーク（emotion_extractor_resultを書き込んだ時刻）
+_WATERMARK_INDEX = """
+DROP INDEX IF EXISTS idx_audio_features_watermark;
+CREATE INDEX IF NOT EXISTS idx_audio_features_emotion_updated_at
+    ON audio_features (date, device_id, emotion_extractor_updated_at);
+"""
+
+_FEATURE_COLUMNS = "device_id,date,time_block,emotion_extractor_result,emotion_extractor_updated_at"
+
+# 一時的な障害として扱うsqlite3.OperationalErrorのメッセージ（ロック待ちのタイムアウト・ディスクI/O）
+_TRANSIENT_SQLITE_ERRORS = ("database is locked", "database table is locked", "disk I/O error")
+
+
+class LocalStorageService:
+    """SQLiteを使ったローカルストレージ（path=":memory:" でインメモリ）"""
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._conn.executescript(_WATERMARK_INDEX)
+        self._conn.commit()
+
+    def _migrate(self):
+        """emotion_extractor_updated_at がない既存のファイルに列を追加（既存行はcreated_atで埋める）"""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(audio_features)")}
+        if "emotion_extractor_updated_at" not in columns:
+            self._conn.execute("ALTER TABLE audio_features ADD COLUMN emotion_extractor_updated_at TEXT")
+            self._conn.execute(
+                "UPDATE audio_features SET emotion_extractor_updated_at = created_at "
+                "WHERE emotion_extractor_result IS NOT NULL"
+            )
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _feature_row(row: sqlite3.Row) -> Dict:
+        """SQLiteの行をSupabaseと同じ形式の辞書に変換"""
+        raw = row["emotion_extractor_result"]
+        return {
+            "device_id": row["device_id"],
+            "date": row["date"],
+            "time_block": row["time_block"],
+            "emotion_extractor_result": json.loads(raw) if raw is not None else None,
+            "emotion_extractor_updated_at": row["emotion_extractor_updated_at"]
+        }
+
+    def _query_sync(self, sql: str, params: Iterable, convert: Optional[Callable[[sqlite3.Row], Any]]) -> List[Any]:
+        with self._lock:
+            rows = self._conn.execute(sql, tuple(params)).fetchall()
+        return [convert(row) for row in rows] if convert is not None else rows
+
+    async def _query(
+        self,
+        operation: str,
+        sql: str,
+        params: Iterable,
+        convert: Optional[Callable[[sqlite3.Row], Any]] = None
+    ) -> List[Any]:
+        """SELECTを実行し、convert で行を変換して返す（JSONのデコードも含めてスレッドで実行）"""
+        return await self._run(operation, self._query_sync, sql, params, convert)
+
+    async def _run(self, operation: str, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        ロック待ち・ディスクI/Oでイベントループを止めないように、sqlite3の呼び出しをスレッドで実行
+
+        Raises:
+            StorageError: SupabaseService と同じく型付きのエラーに変換して送出
+                （ロック待ちのタイムアウト・ディスクI/Oエラーは一時的な障害として StorageUnavailableError）
+        """
+        try:
+            return await asyncio.to_thread(func, *args)
+        except sqlite3.OperationalError as e:
+            if any(marker in str(e) for marker in _TRANSIENT_SQLITE_ERRORS):
+                raise StorageUnavailableError(f"{operation}: {type(e).__name__}: {e}", operation) from e
+            raise to_storage_error(e, operation) from e
+        except Exception as e:
+            raise to_storage_error(e, operation) from e
+
+    async def fetch_all_opensmile_data_for_day(
+        self,
+        device_id: str,
+        date: str
+    ) -> List[Dict]:
+        """指定日の全感情分析データをtime_block順に取得"""
+        return await self._query(
+            "fetch_all_opensmile_data_for_day",
+            f"SELECT {_FEATURE_COLUMNS} FROM audio_features "
+            "WHERE device_id = ? AND date = ? ORDER BY time_block",
+            (device_id, date),
+            self._feature_row
+        )
+
+    async def fetch_opensmile_data_range(
+        self,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        """期間内の感情分析データを(device_id, date, time_block)順に取得"""
+        sql = f"SELECT {_FEATURE_COLUMNS} FROM audio_features WHERE date >= ? AND date <= ?"
+        params: List[str] = [start_date, end_date]
+        if device_id is not None:
+            sql += " AND device_id = ?"
+            params.append(device_id)
+        sql += " ORDER BY device_id, date, time_block"
+        return await self._query("fetch_opensmile_data_range", sql, params, self._feature_row)
+
+    async def fetch_emotion_summary(self, device_id: str, date: str) -> Optional[List[Dict]]:
+        """保存済みの感情グラフを取得（存在しない場合はNone）"""
+        rows = await self._query(
+            "fetch_emotion_summary",
+            "SELECT emotion_aggregator_result FROM audio_aggregator WHERE device_id = ? AND date = ?",
+            (device_id, date)
+        )
+        if not rows or rows[0]["emotion_aggregator_result"] is None:
+            return None
+        return json.loads(rows[0]["emotion_aggregator_result"])
+
+    async def fetch_emotion_summaries_range(
+        self,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        """期間内の保存済み感情グラフ（watermark: emotion_aggregator_processed_at）を(date, device_id)順に取得"""
+        sql = (
+            "SELECT device_id, date, emotion_aggregator_result, emotion_aggregator_processed_at FROM audio_aggregator "
+            "WHERE date >= ? AND date <= ? AND emotion_aggregator_result IS NOT NULL"
+        )
+        params: List[str] = [start_date, end_date]
+        if device_id is not None:
+            sql += " AND device_id = ?"
+            params.append(device_id)
+        sql += " ORDER BY date, device_id"
+        return await self._query(
+            "fetch_emotion_summaries_range",
+            sql,
+            params,
+            lambda row: {
+                "device_id": row["device_id"],
+                "date": row["date"],
+                "emotion_graph": json.loads(row["emotion_aggregator_result"]),
+                "watermark": row["emotion_aggregator_processed_at"]
+            }
+        )
+
+    async def fetch_stale_device_days(self, since_date: str, limit: int = 1000) -> List[Dict]:
+        """集計が古いデバイス日（最新行が保存済みのウォーターマークより新しい）を1回のクエリで取得（新しい日付順）"""
+        return await self._query(
+            "fetch_stale_device_days",
+            "SELECT f.device_id, f.date, MAX(f.emotion_extractor_updated_at) AS latest_feature_at, "
+            "a.emotion_aggregator_processed_at AS processed_at "
+            "FROM audio_features f "
+            "LEFT JOIN audio_aggregator a ON a.device_id = f.device_id AND a.date = f.date "
+            "WHERE f.date >= ? AND f.emotion_extractor_result IS NOT NULL "
+            "GROUP BY f.device_id, f.date "
+            "HAVING processed_at IS NULL OR MAX(f.emotion_extractor_updated_at) > processed_at "
+            "ORDER BY f.date DESC LIMIT ?",
+            (since_date, limit),
+            dict
+        )
+
+    async def save_emotion_summary(
+        self,
+        device_id: str,
+        date: str,
+        emotion_graph: List[Dict],
+        watermark: Optional[str] = None
+    ) -> bool:
+        """感情グラフをaudio_aggregatorにUPSERT（watermark を emotion_aggregator_processed_at に記録）"""
+        return await self.bulk_save_emotion_summaries([
+            {"device_id": device_id, "date": date, "emotion_graph": emotion_graph, "watermark": watermark}
+        ])
+
+    async def bulk_save_emotion_summaries(self, summaries: List[Dict]) -> bool:
+        """複数日の感情グラフを1トランザクションでUPSERT"""
+        return await self._run("bulk_save_emotion_summaries", self._bulk_save_sync, summaries)
+
+    def _bulk_save_sync(self, summaries: List[Dict]) -> bool:
+        records = [
+            (s["device_id"], s["date"], json.dumps(s["emotion_graph"], ensure_ascii=False), s.get("watermark"))
+            for s in summaries
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO audio_aggregator "
+                "(device_id, date, emotion_aggregator_result, emotion_aggregator_processed_at) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (device_id, date) DO UPDATE SET "
+                "emotion_aggregator_result = excluded.emotion_aggregator_result, "
+                "emotion_aggregator_processed_at = excluded.emotion_aggregator_processed_at",
+                records
+            )
+        return True
+
+    async def merge_emotion_summary(
+        self,
+        device_id: str,
+        date: str,
+        emotion_graph: List[Dict]
+    ) -> List[Dict]:
+        """保存済みの感情グラフに指定スロットを上書きマージ（BEGIN IMMEDIATEで読み書きをアトミックに行う）"""
+        return await self._run("merge_emotion_summary", self._merge_sync, device_id, date, emotion_graph)
+
+    def _merge_sync(self, device_id: str, date: str, emotion_graph: List[Dict]) -> List[Dict]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT emotion_aggregator_result FROM audio_aggregator WHERE device_id = ? AND date = ?",
+                    (device_id, date)
+                ).fetchone()
+                stored = json.loads(row[0]) if row and row[0] is not None else None
+                merged = DaySlotScores.from_emotion_graph(stored, device_id, date)
+                merged.update(DaySlotScores.from_emotion_graph(emotion_graph, device_id, date))
+                merged_graph = merged.to_emotion_graph()
+                # audio_featuresを読まないため、ウォーターマーク（emotion_aggregator_processed_at）は変更しない
+                self._conn.execute(
+                    "INSERT INTO audio_aggregator (device_id, date, emotion_aggregator_result) "
+                    "VALUES (?, ?, ?) "
+                    "ON CONFLICT (device_id, date) DO UPDATE SET "
+                    "emotion_aggregator_result = excluded.emotion_aggregator_result",
+                    (device_id, date, json.dumps(merged_graph, ensure_ascii=False))
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return merged_graph
+
+    def upsert_opensmile_data(self, rows: List[Dict]) -> int:
+        """
+        audio_featuresに感情分析データを投入（テスト・ベンチマーク・オフライン再計算用）
+
+        既存の行を更新した場合、created_at はそのままで emotion_extractor_updated_at だけを更新する
+        （Supabaseでは sql/find_stale_emotion_days.sql のトリガーが同じ列を更新する）
+
+        Args:
+            rows: device_id, date, time_block, emotion_extractor_result を持つ辞書のリスト
+                （created_at・emotion_extractor_updated_at を指定した場合はその値を使う）
+
+        Returns:
+            int: 投入件数
+        """
+        now = datetime.utcnow().isoformat()
+        records = [
+            (
+                row["device_id"],
+                row["date"],
+                row["time_block"],
+                json.dumps(row.get("emotion_extractor_result"), ensure_ascii=False),
+                row.get("created_at", now),
+                row.get("emotion_extractor_updated_at", now)
+            )
+            for row in rows
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO audio_features "
+                "(device_id, date, time_block, emotion_extractor_result, created_at, emotion_extractor_updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (device_id, date, time_block) DO UPDATE SET "
+                "emotion_extractor_result = excluded.emotion_extractor_result, "
+                "emotion_extractor_updated_at = excluded.emotion_extractor_updated_at",
+                records
+            )
+        return len(records)
+
+
+class FaultInjectingStorage:
+    """
+    障害を注入するストレージラッパー（resilience.ResilientStorageBackend の検証用）
+
+    呼び出しごとに、遅延・接続エラー・応答なし（ハング）を指定した確率で発生させる。
+    down=True の間は全ての呼び出しが接続エラーになる（障害発生中の再現）。
+    """
+
+    def __init__(
+        self,
+        inner: Any,
+        error_rate: float = 0.0,
+        hang_rate: float = 0.0,
+        latency: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_latency: float = 1.0,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            inner: 実際のストレージ（LocalStorageServiceなど）
+            error_rate: 接続エラー（ConnectionError）にする確率
+            hang_rate: 応答を返さない（呼び出し側のタイムアウトまで待たせる）確率
+            latency: 全呼び出しに加える遅延（秒）
+            slow_rate: slow_latency の遅延を加える確率（テールレイテンシの再現）
+            slow_latency: 遅い呼び出しの遅延（秒）
+            seed: 乱数シード
+        """
+        self._inner = inner
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.down = False
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "_inner":
+            raise AttributeError(name)
+        return getattr(self._inner, name)
+
+    async def _inject(self, operation: str):
+        self.calls += 1
+        roll = self._random.random()
+        delay = self.slow_latency if self._random.random() < self.slow_rate else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+        if self.down or roll < self.error_rate:
+            raise ConnectionError(f"注入した接続エラー: {operation}")
+        if roll < self.error_rate + self.hang_rate:
+            await asyncio.sleep(3600)
+
+    async def fetch_all_opensmile_data_for_day(self, device_id: str, date: str) -> List[Dict]:
+        await self._inject("fetch_all_opensmile_data_for_day")
+        return await self._inner.fetch_all_opensmile_data_for_day(device_id, date)
+
+    async def fetch_opensmile_data_range(
+        self,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        await self._inject("fetch_opensmile_data_range")
+        return await self._inner.fetch_opensmile_data_range(start_date, end_date, device_id)
+
+    async def fetch_emotion_summary(self, device_id: str, date: str) -> Optional[List[Dict]]:
+        await self._inject("fetch_emotion_summary")
+        return await self._inner.fetch_emotion_summary(device_id, date)
+
+    async def fetch_emotion_summaries_range(
+        self,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        await self._inject("fetch_emotion_summaries_range")
+        return await self._inner.fetch_emotion_summaries_range(start_date, end_date, device_id)
+
+    async def fetch_stale_device_days(self, since_date: str, limit: int = 1000) -> List[Dict]:
+        await self._inject("fetch_stale_device_days")
+        return await self._inner.fetch_stale_device_days(since_date, limit)
+
+    async def save_emotion_summary(
+        self,
+        device_id: str,
+        date: str,
+        emotion_graph: List[Dict],
+        watermark: Optional[str] = None
+    ) -> bool:
+        await self._inject("save_emotion_summary")
+        return await self._inner.save_emotion_summary(device_id, date, emotion_graph, watermark)
+
+    async def bulk_save_emotion_summaries(self, summaries: List[Dict]) -> bool:
+        await self._inject("bulk_save_emotion_summaries")
+        return await self._inner.bulk_save_emotion_summaries(summaries)
+
+    async def merge_emotion_summary(self, device_id: str, date: str, emotion_graph: List[Dict]) -> List[Dict]:
+        await self._inject("merge_emotion_summary")
+        return await self._inner.merge_emotion_summary(device_id, date, emotion_graph)
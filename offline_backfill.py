@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+オフライン再集計パイプライン（過去データのバックフィル用）
+
+集計ロジックを変更したとき（例: 2025-10-26の正の値の最大値方式への移行）に、
+APIを日数×デバイス数だけ呼び直す代わりにローカルのCPU処理として再集計する。
+
+1. export:    audio_features.emotion_extractor_result を日付パーティションのParquetへ1回だけダンプ
+2. recompute: Parquetから日次サマリーをマルチプロセスで再計算し、サマリーParquetに出力
+3. load:      サマリーParquetを audio_aggregator へ一括UPSERT
+
+ディレクトリ構成（Hiveパーティション形式）:
+    <dir>/features/date=YYYY-MM-DD/part-0.parquet   (device_id, date, time_block, emotion_extractor_result, emotion_extractor_updated_at)
+    <dir>/summaries/date=YYYY-MM-DD/part-0.parquet  (device_id, date, emotion_aggregator_result, emotion_aggregator_processed_at)
+
+emotion_aggregator_processed_at にはエクスポートした行のウォーターマークを保存する（APIの集計と同じ）。
+エクスポート後に書き込まれた行は、ロード後もスイープで未集計として検出される。
+
+※ pyarrow が必要です（pip install pyarrow）
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from storage_backend import STORAGE_BACKENDS, consumed_watermark, create_storage_service
+
+
+FEATURES_DIR = "features"
+SUMMARIES_DIR = "summaries"
+PART_FILE = "part-0.parquet"
+
+
+def _import_pyarrow():
+    """pyarrowを遅延インポート（API本体の依存に含めないため）"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("オフライン再集計には pyarrow が必要です: pip install pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+
+def iter_dates(start_date: str, end_date: str) -> Iterator[str]:
+    """開始日から終了日まで（両端を含む）の日付文字列を順に返す"""
+    current = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    while current <= end:
+        yield current.strftime("%Y-%m-%d")
+        current += timedelta(days=1)
+
+
+def _partition_path(base_dir: Path, kind: str, date: str) -> Path:
+    return base_dir / kind / f"date={date}" / PART_FILE
+
+
+def _list_partitions(base_dir: Path, kind: str, start_date: str, end_date: str) -> List[Tuple[str, Path]]:
+    """期間内に存在するパーティションファイルを日付順に列挙"""
+    partitions = []
+    for date in iter_dates(start_date, end_date):
+        path = _partition_path(base_dir, kind, date)
+        if path.exists():
+            partitions.append((date, path))
+    return partitions
+
+
+async def export_features(
+    base_dir: Path,
+    start_date: str,
+    end_date: str,
+    device_id: Optional[str] = None,
+    storage_backend: Optional[str] = None
+) -> int:
+    """
+    audio_featuresを日付パーティションのParquetに出力
+
+    Returns:
+        int: 出力した行数
+    """
+    pa, pq = _import_pyarrow()
+    storage = create_storage_service(storage_backend)
+
+    total = 0
+    for date in iter_dates(start_date, end_date):
+        # 1日ずつ取得してメモリ使用量を抑える
+        rows = await storage.fetch_opensmile_data_range(date, date, device_id)
+        if not rows:
+            continue
+
+        table = pa.table({
+            "device_id": [row["device_id"] for row in rows],
+            "date": [row["date"] for row in rows],
+            "time_block": [row["time_block"] for row in rows],
+            # ネストしたJSONはスキーマが不定のため文字列のまま保存
+            "emotion_extractor_result": [
+                json.dumps(row.get("emotion_extractor_result"), ensure_ascii=False) for row in rows
+            ],
+            "emotion_extractor_updated_at": [row.get("emotion_extractor_updated_at") for row in rows],
+        })
+        path = _partition_path(base_dir, FEATURES_DIR, date)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, path, compression="zstd")
+
+        total += len(rows)
+        print(f"📦 {date}: {len(rows)}行をエクスポート")
+
+    print(f"✅ エクスポート完了: {total}行 → {base_dir / FEATURES_DIR}")
+    return total
+
+
+# ワーカープロセスごとに1回だけ生成する集計インスタンス
+_worker_aggregator = None
+
+
+def _init_worker():
+    global _worker_aggregator
+    from opensmile_aggregator import OpenSMILEAggregator
+    _worker_aggregator = OpenSMILEAggregator(verbose=False)
+
+
+def _recompute_partition(features_path: str, summaries_path: str, date: str) -> int:
+    """
+    1日分のパーティションを再集計してサマリーParquetに書き出す（ワーカープロセスで実行）
+
+    入力・出力ともにワーカー内でファイルを直接読み書きし、親プロセスとの間で行データを転送しない。
+
+    Returns:
+        int: 出力したデバイス日数
+    """
+    pa, pq = _import_pyarrow()
+    columns = pq.read_table(features_path).to_pydict()
+    # 更新日時の列がない（以前にエクスポートした）パーティションはウォーターマークなしで再集計する
+    updated_at = columns.get("emotion_extractor_updated_at") or [None] * len(columns["device_id"])
+
+    # device_idごとに行をまとめる（time_block順はエクスポート時のorder byで保証済み）
+    rows_by_device: Dict[str, List[Dict]] = {}
+    for device_id, time_block, raw, row_updated_at in zip(
+        columns["device_id"], columns["time_block"], columns["emotion_extractor_result"], updated_at
+    ):
+        rows_by_device.setdefault(device_id, []).append({
+            "time_block": time_block,
+            "emotion_extractor_result": json.loads(raw) if raw else None,
+            "emotion_extractor_updated_at": row_updated_at
+        })
+
+    device_ids = []
+    graphs = []
+    watermarks = []
+    for device_id, rows in rows_by_device.items():
+        result = _worker_aggregator.aggregate_rows(rows, date)
+        if not result["emotion_graph"]:
+            # データなしの日は保存しない（APIの挙動と同じ）
+            continue
+        device_ids.append(device_id)
+        graphs.append(json.dumps(result["emotion_graph"], ensure_ascii=False))
+        watermarks.append(consumed_watermark(rows))
+
+    table = pa.table({
+        "device_id": device_ids,
+        "date": [date] * len(device_ids),
+        "emotion_aggregator_result": graphs,
+        "emotion_aggregator_processed_at": pa.array(watermarks, type=pa.string()),
+    })
+    out = Path(summaries_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, out, compression="zstd")
+    return len(device_ids)
+
+
+def recompute_summaries(
+    base_dir: Path,
+    start_date: str,
+    end_date: str,
+    workers: Optional[int] = None
+) -> int:
+    """
+    featuresパーティションから日次サマリーをマルチプロセスで再計算
+
+    Returns:
+        int: 再計算したデバイス日数
+    """
+    _import_pyarrow()
+    partitions = _list_partitions(base_dir, FEATURES_DIR, start_date, end_date)
+    if not partitions:
+        print("📭 対象期間のfeaturesパーティションがありません")
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    print(f"⚙️ 再集計開始: {len(partitions)}日分, ワーカー数={workers}")
+
+    total = 0
+    # parallel_executor と同じくspawnで起動する（親プロセスのスレッド・クライアントをforkで引き継がない）
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker
+    ) as executor:
+        futures = {
+            executor.submit(
+                _recompute_partition,
+                str(path),
+                str(_partition_path(base_dir, SUMMARIES_DIR, date)),
+                date
+            ): date
+            for date, path in partitions
+        }
+        for future in as_completed(futures):
+            date = futures[future]
+            count = future.result()
+            total += count
+            print(f"✅ {date}: {count}デバイス日を再集計")
+
+    print(f"✅ 再集計完了: {total}デバイス日 → {base_dir / SUMMARIES_DIR}")
+    return total
+
+
+async def load_summaries(
+    base_dir: Path,
+    start_date: str,
+    end_date: str,
+    storage_backend: Optional[str] = None,
+    batch_size: int = 500
+) -> int:
+    """
+    サマリーParquetをaudio_aggregatorへ一括UPSERT
+
+    Returns:
+        int: 保存したデバイス日数
+    """
+    _, pq = _import_pyarrow()
+    storage = create_storage_service(storage_backend)
+
+    total = 0
+    for date, path in _list_partitions(base_dir, SUMMARIES_DIR, start_date, end_date):
+        columns = pq.read_table(path).to_pydict()
+        watermarks = columns.get("emotion_aggregator_processed_at") or [None] * len(columns["device_id"])
+        summaries = [
+            {"device_id": device_id, "date": row_date, "emotion_graph": json.loads(graph), "watermark": watermark}
+            for device_id, row_date, graph, watermark in zip(
+                columns["device_id"], columns["date"], columns["emotion_aggregator_result"], watermarks
+            )
+        ]
+        for start in range(0, len(summaries), batch_size):
+            batch = summaries[start:start + batch_size]
+            if not await storage.bulk_save_emotion_summaries(batch):
+                raise RuntimeError(f"{date} のサマリー保存に失敗しました")
+        total += len(summaries)
+
+    print(f"✅ ロード完了: {total}デバイス日")
+    return total
+
+
+def main():
+    """コマンドライン実行用メイン関数"""
+    parser = argparse.ArgumentParser(description="感情分析データのオフライン再集計（バックフィル）")
+    parser.add_argument("command", choices=["export", "recompute", "load", "all"], help="実行するステップ")
+    parser.add_argument("start_date", help="開始日（YYYY-MM-DD形式）")
+    parser.add_argument("end_date", help="終了日（YYYY-MM-DD形式）")
+    parser.add_argument("--dir", default="backfill", help="Parquetの出力先ディレクトリ")
+    parser.add_argument("--device-id", help="特定デバイスのみエクスポートする場合に指定")
+    parser.add_argument("--workers", type=int, help="再集計のワーカープロセス数（デフォルト: CPUコア数）")
+    parser.add_argument("--storage", choices=STORAGE_BACKENDS, help="ストレージバックエンド（未指定時は環境変数STORAGE_BACKEND）")
+
+    args = parser.parse_args()
+
+    # 日付形式検証
+    try:
+        datetime.strptime(args.start_date, "%Y-%m-%d")
+        datetime.strptime(args.end_date, "%Y-%m-%d")
+    except ValueError:
+        print("エラー: 日付はYYYY-MM-DD形式で指定してください")
+        return
+
+    base_dir = Path(args.dir)
+
+    if args.command in ("export", "all"):
+        asyncio.run(export_features(base_dir, args.start_date, args.end_date, args.device_id, args.storage))
+    if args.command in ("recompute", "all"):
+        recompute_summaries(base_dir, args.start_date, args.end_date, args.workers)
+    if args.command in ("load", "all"):
+        asyncio.run(load_summaries(base_dir, args.start_date, args.end_date, args.storage))
+
+
+if __name__ == "__main__":
+    main()
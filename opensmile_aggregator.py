@@ -15,155 +15,130 @@ from typing import Dict, List, Optional, Any
 from datetime import datetime
 import argparse
 
-from emotion_scoring import EmotionScorer
-from supabase_service import SupabaseService
+from emotion_scoring import DaySlotScores, EmotionScorer, TIME_SLOTS
+from storage_backend import StorageBackend, consumed_watermark, create_storage_service
 
 
 class OpenSMILEAggregator:
     """OpenSMILE データ集計クラス"""
     
-    def __init__(self):
+    def __init__(self, storage_service: Optional[StorageBackend] = None, verbose: bool = True):
         self.time_slots = self._generate_time_slots()
         self.emotion_scorer = EmotionScorer()
-        self.supabase_service = SupabaseService()
+        self._storage_service = storage_service
+        # Falseの場合はスロット単位のログを抑制（バッチ・バックフィル用）
+        self.verbose = verbose
+
+    @property
+    def storage_service(self) -> StorageBackend:
+        """ストレージ（未指定時は初回アクセスで環境変数STORAGE_BACKENDに応じた実装を生成）"""
+        if self._storage_service is None:
+            self._storage_service = create_storage_service()
+        return self._storage_service
     
     def _generate_time_slots(self) -> List[str]:
         """30分スロットのリストを生成（00-00 から 23-30 まで）"""
-        slots = []
-        for hour in range(24):
-            for minute in [0, 30]:
-                slots.append(f"{hour:02d}-{minute:02d}")
-        return slots
+        return list(TIME_SLOTS)
     
-    def _convert_kushinada_v2_to_emotion_format(self, supabase_data: Dict) -> Optional[Dict]:
+    def convert_rows(
+        self,
+        rows: List[Dict],
+        device_id: Optional[str] = None,
+        date: Optional[str] = None
+    ) -> DaySlotScores:
         """
-        Kushinada v2のlogits（生スコア）から各感情の最大値を取得
+        1デバイス日分のaudio_features行をスロットスコアに変換（同じtime_blockは後の行を採用）
 
-        設計思想: 感情のスパイクを見逃さない
-        - 月に1回しか怒らない人の「その1回」を確実に捉える
-        - 各30分ブロック内の全チャンクから正の値（> 0）のみ抽出
-        - 最大値を採用してスパイクを保持
-        - 正の値がない場合は0.0（検出されなかった）
+        Kushinada v2のlogits（生スコア）から各感情の最大値（正の値のみ）を取得する。
+        設計思想: 感情のスパイクを見逃さない（月に1回しか怒らない人の「その1回」を確実に捉える）
 
-        emotion_extractor_resultから感情スコアを抽出（4感情: neutral, joy, anger, sadness）
-        """
-        if not supabase_data or not supabase_data.get('emotion_extractor_result'):
-            return None
-
-        emotion_extractor_result = supabase_data['emotion_extractor_result']
-        if not emotion_extractor_result:
-            return None
-
-        # 各感情のスコアを収集（リスト形式）
-        emotion_scores_list = {
-            'ang': [],  # 怒り (anger)
-            'sad': [],  # 悲しみ (sadness)
-            'neu': [],  # 中立 (neutral)
-            'hap': []   # 喜び (joy)
-        }
+        Args:
+            rows: audio_features行のリスト（time_block, emotion_extractor_resultを使用）
+            device_id: デバイスID（未指定時は先頭行の値）
+            date: 日付（未指定時は先頭行の値）
 
-        # v2のラベル名を旧形式にマッピング
-        label_mapping = {
-            'anger': 'ang',
-            'sadness': 'sad',
-            'neutral': 'neu',
-            'joy': 'hap'
-        }
+        Returns:
+            DaySlotScores: データがあるスロットの4感情スコア
+        """
+        first = rows[0] if rows else {}
+        day = DaySlotScores(device_id or first.get('device_id'), date or first.get('date'))
+        for data in rows:
+            time_block = data.get('time_block')
+            if time_block and day.add_chunks(time_block, data.get('emotion_extractor_result')):
+                if self.verbose:
+                    print(f"取得完了: {time_block}")
+        return day
+
+    def aggregate_rows(self, rows: List[Dict], date: str) -> Dict[str, Any]:
+        """
+        取得済みの1日分の行から感情グラフを生成（DBアクセスなし）
 
-        # 全チャンクから各感情のスコアを収集
-        for chunk_data in emotion_extractor_result:
-            if 'emotions' in chunk_data:
-                for emotion in chunk_data['emotions']:
-                    label = emotion.get('label')
-                    score = emotion.get('score', 0.0)
-                    # v2のラベル名を旧形式に変換
-                    mapped_label = label_mapping.get(label, label)
-                    if mapped_label in emotion_scores_list:
-                        emotion_scores_list[mapped_label].append(score)
-
-        # 各感情の最大値を取得（正の値のみ、なければ0.0）
-        emotion_max_scores = {}
-        for label, scores in emotion_scores_list.items():
-            # 正の値（> 0）のみ抽出
-            positive_scores = [s for s in scores if s > 0]
-            # 最大値を採用（正の値がない場合は0.0）
-            emotion_max_scores[label] = max(positive_scores) if positive_scores else 0.0
+        Args:
+            rows: 同一device_id・dateのaudio_features行のリスト
+            date: 日付 (YYYY-MM-DD形式)
 
-        return {
-            "emotion_scores": emotion_max_scores,
-            "metadata": {
-                "device_id": supabase_data.get('device_id'),
-                "date": supabase_data.get('date'),
-                "time_block": supabase_data.get('time_block'),
-                "duration_seconds": supabase_data.get('duration_seconds', 0),
-                "filename": supabase_data.get('filename', '')
-            }
-        }
+        Returns:
+            Dict: generate_full_day_dataの結果（date, emotion_graph）
+        """
+        return self.emotion_scorer.generate_full_day_data(self.convert_rows(rows, date=date), date)
     
-    async def fetch_all_data(self, device_id: str, date: str) -> Dict[str, Dict]:
-        """指定日の全OpenSMILEデータをSupabaseから取得"""
+    async def fetch_day_rows(self, device_id: str, date: str) -> List[Dict]:
+        """
+        指定日の全audio_features行をSupabaseから一括取得
+
+        取得エラーはStorageErrorとして呼び出し元に伝える。一括取得が成功して空だった場合は
+        スロットごとに取得しても同じ結果になるため、スロット単位の再取得（48クエリ）は行わない
+
+        Raises:
+            StorageError: 取得エラー時
+        """
         print(f"データ取得開始: device_id={device_id}, date={date}")
         
-        results = {}
-        
         # Supabaseから一日分のデータを一括取得
-        all_data = await self.supabase_service.fetch_all_opensmile_data_for_day(device_id, date)
+        all_data = await self.storage_service.fetch_all_opensmile_data_for_day(device_id, date)
         
         if not all_data:
             print("Supabaseにデータが見つかりません")
-            # 個別にスロットごとに取得を試みる
-            for slot in self.time_slots:
-                print(f"🔍 スロット {slot} のデータ取得中...")
-                data = await self.supabase_service.fetch_opensmile_data(device_id, date, slot)
-                if data:
-                    # Kushinada v2形式に変換
-                    emotion_data = self._convert_kushinada_v2_to_emotion_format(data)
-                    if emotion_data:
-                        results[slot] = emotion_data
-                        print(f"取得完了: {slot}")
-        else:
-            # 一括取得したデータを処理
-            for data in all_data:
-                time_block = data.get('time_block')
-                if time_block:
-                    # Kushinada v2形式に変換
-                    emotion_data = self._convert_kushinada_v2_to_emotion_format(data)
-                    if emotion_data:
-                        results[time_block] = emotion_data
-                        print(f"取得完了: {time_block}")
+        return all_data
+
+    async def fetch_all_data(self, device_id: str, date: str) -> DaySlotScores:
+        """
+        指定日の全OpenSMILEデータをSupabaseから取得してスロットスコアに変換
+
+        Raises:
+            StorageError: 取得エラー時
+        """
+        results = self.convert_rows(await self.fetch_day_rows(device_id, date), device_id, date)
         
         print(f"データ取得完了: {len(results)}/{len(self.time_slots)} スロット")
         return results
     
-    def process_emotion_scores(self, slot_data: Dict[str, Dict]) -> Dict[str, Dict[str, float]]:
-        """Kushinada v2の感情分類結果（4感情）をそのまま処理"""
-        print("感情スコア処理開始...")
-
-        slot_scores = {}
-
-        for slot, emotion_data in slot_data.items():
-            try:
-                # Kushinada v2の感情スコア（4感情）をそのまま取得
-                emotion_scores = self.emotion_scorer.process_kushinada_v2_data(emotion_data)
-                slot_scores[slot] = emotion_scores
+    def process_emotion_scores(self, slot_data: DaySlotScores) -> DaySlotScores:
+        """
+        Kushinada v2の感情分類結果（4感情）をそのまま処理
 
+        スコアは変換時に4感情の並びで確定しているため、ここではスロットごとの統計を出力するだけ
+        """
+        if self.verbose:
+            print("感情スコア処理開始...")
+            for slot in slot_data.time_blocks():
+                emotion_scores = slot_data.slot_scores(slot)
                 # 統計情報
                 max_emotion = max(emotion_scores, key=emotion_scores.get)
-                max_score = emotion_scores[max_emotion]
-                print(f"スロット {slot}: 主要感情={max_emotion} ({max_score:.3f})")
-
-            except Exception as e:
-                print(f"❌ スロット {slot} の感情分析エラー: {e}")
-                # エラー時は全て0.0
-                slot_scores[slot] = {emotion: 0.0 for emotion in self.emotion_scorer.emotions}
-
-        print(f"感情スコア処理完了: {len(slot_scores)} スロット処理")
-        return slot_scores
+                print(f"スロット {slot}: 主要感情={max_emotion} ({emotion_scores[max_emotion]:.3f})")
+            print(f"感情スコア処理完了: {len(slot_data)} スロット処理")
+        return slot_data
     
-    async def save_result_to_supabase(self, result: Dict, device_id: str, date: str) -> bool:
-        """結果をaudio_aggregator.emotion_aggregator_resultに保存"""
+    async def save_result_to_supabase(
+        self,
+        result: Dict,
+        device_id: str,
+        date: str,
+        watermark: Optional[str] = None
+    ) -> bool:
+        """結果をaudio_aggregator.emotion_aggregator_resultに保存（watermark: 集計に使った行の consumed_watermark）"""
         emotion_graph = result.get("emotion_graph", [])
-        success = await self.supabase_service.save_emotion_summary(device_id, date, emotion_graph)
+        success = await self.storage_service.save_emotion_summary(device_id, date, emotion_graph, watermark)
 
         if success:
             print(f"結果保存完了: audio_aggregator.emotion_aggregator_result")
@@ -172,12 +147,24 @@ class OpenSMILEAggregator:
 
         return success
     
-    async def run(self, device_id: str, date: str) -> Dict[str, Any]:
-        """メイン処理実行"""
+    async def run(self, device_id: str, date: str, persist: bool = True) -> Dict[str, Any]:
+        """
+        メイン処理実行
+
+        Args:
+            device_id: デバイスID
+            date: 日付 (YYYY-MM-DD形式)
+            persist: Falseの場合は集計のみ行いaudio_aggregatorに保存しない
+
+        Returns:
+            Dict: 処理結果（success, has_data, message, processed_slots, total_emotion_points, emotion_graph）
+        """
         print(f"感情分析集計処理開始 (Kushinada v2): {device_id}, {date}")
         
-        # データ取得
-        slot_data = await self.fetch_all_data(device_id, date)
+        # データ取得（保存時に記録するウォーターマークは、保存時刻ではなく実際に読み込んだ行から求める）
+        rows = await self.fetch_day_rows(device_id, date)
+        slot_data = self.convert_rows(rows, device_id, date)
+        print(f"データ取得完了: {len(slot_data)}/{len(self.time_slots)} スロット")
         
         if not slot_data:
             print(f"指定された日付（{date}）にはデータが存在しません")
@@ -187,7 +174,8 @@ class OpenSMILEAggregator:
                 "has_data": False,
                 "message": f"指定された日付（{date}）にはデータが存在しません。",
                 "processed_slots": 0,
-                "total_emotion_points": 0
+                "total_emotion_points": 0,
+                "emotion_graph": []
             }
         
         # 感情スコア計算
@@ -196,8 +184,11 @@ class OpenSMILEAggregator:
         # 1日分のグラフデータ生成
         result = self.emotion_scorer.generate_full_day_data(slot_scores, date)
         
-        # 結果をSupabaseに保存
-        success = await self.save_result_to_supabase(result, device_id, date)
+        if not persist:
+            success = True
+        else:
+            # 結果をSupabaseに保存
+            success = await self.save_result_to_supabase(result, device_id, date, consumed_watermark(rows))
 
         if success:
             print("感情分析集計処理完了")
@@ -209,7 +200,8 @@ class OpenSMILEAggregator:
             "has_data": True,
             "message": f"感情分析が完了しました（4感情: neutral, joy, anger, sadness）",
             "processed_slots": len(slot_data),
-            "total_emotion_points": len(slot_data)  # 処理したスロット数を返す
+            "total_emotion_points": len(slot_data),  # 処理したスロット数を返す
+            "emotion_graph": result["emotion_graph"]
         }
 
 
@@ -218,6 +210,11 @@ async def main():
     parser = argparse.ArgumentParser(description="感情分析データ集計ツール (Kushinada v2版)")
     parser.add_argument("device_id", help="デバイスID（例: device123）")
     parser.add_argument("date", help="対象日付（YYYY-MM-DD形式）")
+    parser.add_argument(
+        "--storage",
+        choices=["supabase", "sqlite", "memory"],
+        help="ストレージバックエンド（未指定時は環境変数STORAGE_BACKEND）"
+    )
     
     args = parser.parse_args()
     
@@ -229,7 +226,7 @@ async def main():
         return
     
     # 集計実行
-    aggregator = OpenSMILEAggregator()
+    aggregator = OpenSMILEAggregator(create_storage_service(args.storage))
     success = await aggregator.run(args.device_id, args.date)
     
     if success:
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+マルチプロセス集計エグゼキューター
+
+バッチ・バックフィル処理で、audio_featuresの取得・JSONのデコード・Kushinada v2の変換とスコアリングを
+プロセスプールに分散してコア数に応じてスケールさせる。
+
+- 日付単位でシャーディングし、各ワーカーが自分の日付の行を直接ストレージから取得して集計する
+  （offline_backfill._recompute_partition と同じく、親プロセスとの間で行データを転送しない）
+- ワーカーから返すのはデバイス日ごとの感情グラフ（1スロット4値）だけ
+- 結果は親プロセスで日付順に bulk_save_emotion_summaries で一括保存する
+- プロセスプールはspawnで起動する（スレッドを持つAPIプロセスからforkしない）
+- STORAGE_BACKEND=memory はワーカーから親のデータが見えないため、親プロセスのスレッドで集計する
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from offline_backfill import iter_dates
+from storage_backend import STORAGE_BACKENDS, StorageBackend, consumed_watermark, create_storage_service
+
+
+def group_rows_by_day(rows: Iterable[Dict]) -> Dict[Tuple[str, str], List[Dict]]:
+    """audio_features行を(device_id, date)ごとにまとめる"""
+    days: Dict[Tuple[str, str], List[Dict]] = {}
+    for row in rows:
+        days.setdefault((row["device_id"], row["date"]), []).append(row)
+    return days
+
+
+def aggregate_day_rows(aggregator, rows: List[Dict]) -> List[Dict]:
+    """
+    1日分（複数デバイス）のaudio_features行を集計
+
+    Returns:
+        List[Dict]: {"device_id", "date", "emotion_graph", "watermark"} のリスト（データなしのデバイス日は含まない）
+    """
+    summaries = []
+    for (device_id, date), day_rows in group_rows_by_day(rows).items():
+        result = aggregator.aggregate_rows(day_rows, date)
+        if result["emotion_graph"]:
+            summaries.append({
+                "device_id": device_id,
+                "date": date,
+                "emotion_graph": result["emotion_graph"],
+                "watermark": consumed_watermark(day_rows)
+            })
+    return summaries
+
+
+# ワーカープロセスごとに1回だけ生成する集計インスタンスとストレージ
+_worker_aggregator = None
+_worker_storage: Optional[StorageBackend] = None
+
+
+def _init_worker(storage_backend: str):
+    global _worker_aggregator, _worker_storage
+    from opensmile_aggregator import OpenSMILEAggregator
+    _worker_aggregator = OpenSMILEAggregator(verbose=False)
+    _worker_storage = create_storage_service(storage_backend)
+
+
+def _aggregate_date(date: str, device_id: Optional[str]) -> Tuple[int, List[Dict]]:
+    """
+    1日分の行をワーカー内で取得して集計（ワーカープロセスで実行）
+
+    Returns:
+        Tuple[int, List[Dict]]: (取得した行数, 感情グラフのリスト)
+    """
+    rows = asyncio.run(_worker_storage.fetch_opensmile_data_range(date, date, device_id))
+    return len(rows), aggregate_day_rows(_worker_aggregator, rows)
+
+
+class ParallelAggregationExecutor:
+    """日付ごとにワーカープロセスで取得・集計するエグゼキューター"""
+
+    def __init__(self, workers: Optional[int] = None):
+        """
+        Args:
+            workers: ワーカープロセス数（デフォルト: 環境変数AGGREGATION_WORKERS、未設定時はCPUコア数）
+        """
+        self.workers = workers or int(os.getenv("AGGREGATION_WORKERS", "0")) or os.cpu_count() or 1
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_backend: Optional[str] = None
+
+    def _get_pool(self, storage_backend: str) -> ProcessPoolExecutor:
+        """プロセスプール（初回利用時・ストレージバックエンドが変わった場合に起動）"""
+        if self._pool is not None and self._pool_backend != storage_backend:
+            self.shutdown()
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(storage_backend,)
+            )
+            self._pool_backend = storage_backend
+        return self._pool
+
+    def shutdown(self):
+        """プロセスプールを停止"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._pool_backend = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    async def _aggregate_in_process(
+        self,
+        storage: StorageBackend,
+        dates: List[str],
+        device_id: Optional[str]
+    ):
+        """ワーカーから見えないストレージ（memory）用: 親プロセスで取得し、集計はスレッドで行う"""
+        from opensmile_aggregator import OpenSMILEAggregator
+        aggregator = OpenSMILEAggregator(verbose=False)
+        for date in dates:
+            rows = await storage.fetch_opensmile_data_range(date, date, device_id)
+            yield date, len(rows), await asyncio.to_thread(aggregate_day_rows, aggregator, rows)
+
+    async def _aggregate_in_workers(self, storage_backend: str, dates: List[str], device_id: Optional[str]):
+        """日付ごとにワーカーへ投入し、日付順に結果を返す（投入中の日付はワーカー数の2倍まで）"""
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool(storage_backend)
+        pending: Deque[Tuple[str, asyncio.Future]] = deque()
+        remaining = iter(dates)
+        for date in remaining:
+            pending.append((date, asyncio.wrap_future(pool.submit(_aggregate_date, date, device_id), loop=loop)))
+            if len(pending) >= self.workers * 2:
+                break
+        while pending:
+            date, future = pending.popleft()
+            row_count, summaries = await future
+            next_date = next(remaining, None)
+            if next_date is not None:
+                pending.append((next_date, asyncio.wrap_future(pool.submit(_aggregate_date, next_date, device_id), loop=loop)))
+            yield date, row_count, summaries
+
+    async def run_range(
+        self,
+        storage: StorageBackend,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None,
+        persist: bool = True,
+        storage_backend: Optional[str] = None
+    ) -> Dict[str, int]:
+        """
+        期間内の全デバイス日を並列集計して一括保存
+
+        Args:
+            storage: 保存に使うストレージ（memoryの場合は取得にも使う）
+            start_date: 開始日 (YYYY-MM-DD形式、この日を含む)
+            end_date: 終了日 (YYYY-MM-DD形式、この日を含む)
+            device_id: 指定時はそのデバイスのみ
+            persist: Falseの場合は保存しない
+            storage_backend: ワーカーが取得に使うストレージ（未指定時は環境変数STORAGE_BACKEND）
+
+        Returns:
+            Dict: 処理件数（rows, device_days, saved）
+        """
+        storage_backend = (storage_backend or os.getenv("STORAGE_BACKEND", "supabase")).lower()
+        stats = {"rows": 0, "device_days": 0, "saved": 0}
+        dates = list(iter_dates(start_date, end_date))
+
+        if storage_backend == "memory":
+            print(f"⚙️ 一括集計開始: {start_date}〜{end_date}（memoryのため親プロセスで集計）")
+            results = self._aggregate_in_process(storage, dates, device_id)
+        else:
+            print(f"⚙️ 並列集計開始: {start_date}〜{end_date}, ワーカー数={self.workers}")
+            results = self._aggregate_in_workers(storage_backend, dates, device_id)
+
+        # 日付順に保存する（デバイスごとのベースラインは日付順の反映を前提にしている）
+        async for date, row_count, summaries in results:
+            stats["rows"] += row_count
+            stats["device_days"] += len(summaries)
+            if persist and summaries:
+                if not await storage.bulk_save_emotion_summaries(summaries):
+                    raise RuntimeError(f"{date} の集計結果の一括保存に失敗しました")
+                stats["saved"] += len(summaries)
+
+        print(f"✅ 並列集計完了: {stats['device_days']}デバイス日（保存: {stats['saved']}）")
+        return stats
+
+
+async def main():
+    """コマンドライン実行用メイン関数"""
+    parser = argparse.ArgumentParser(description="感情分析データの並列集計（期間指定）")
+    parser.add_argument("start_date", help="開始日（YYYY-MM-DD形式）")
+    parser.add_argument("end_date", help="終了日（YYYY-MM-DD形式）")
+    parser.add_argument("--device-id", help="特定デバイスのみ集計する場合に指定")
+    parser.add_argument("--workers", type=int, help="ワーカープロセス数（デフォルト: CPUコア数）")
+    parser.add_argument("--storage", choices=STORAGE_BACKENDS, help="ストレージバックエンド（未指定時は環境変数STORAGE_BACKEND）")
+    parser.add_argument("--dry-run", action="store_true", help="集計のみ行い保存しない")
+
+    args = parser.parse_args()
+
+    # 日付形式検証
+    try:
+        datetime.strptime(args.start_date, "%Y-%m-%d")
+        datetime.strptime(args.end_date, "%Y-%m-%d")
+    except ValueError:
+        print("エラー: 日付はYYYY-MM-DD形式で指定してください")
+        return
+
+    with ParallelAggregationExecutor(args.workers) as executor:
+        await executor.run_range(
+            create_storage_service(args.storage),
+            args.start_date,
+            args.end_date,
+            args.device_id,
+            persist=not args.dry_run,
+            storage_backend=args.storage
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,358 @@
+"""
+ストレージアクセスの耐障害性レイヤー
+
+Supabaseへの呼び出しを型付きエラー・呼び出しごとのタイムアウト・ジッター付きリトライ（予算付き）・
+サーキットブレーカー・ヘッジ読み取りで包む。
+
+- 取得失敗は空の結果ではなく StorageError で通知し、「データなし」と区別する
+- 一時的な障害（タイムアウト・接続エラー・5xx/429）だけをリトライし、リトライ予算を超えたら諦める
+- 連続して失敗したらブレーカーを開き、reset_timeout の間は呼び出さずに即座に失敗する
+- 小さな読み取りは hedge_delay を過ぎても応答がなければ同じ読み取りをもう1本発行し、先に成功した方を使う
+
+※ SupabaseServiceはスレッドで同期クライアントを呼ぶため、タイムアウト・ヘッジで打ち切った呼び出しも
+  スレッド側では完了まで実行される（結果は破棄する）
+"""
+
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from storage_backend import StorageBackend
+
+
+class StorageError(Exception):
+    """ストレージアクセスの失敗（リトライしても解決しないもの）"""
+
+    retryable = False
+
+    def __init__(self, message: str, operation: Optional[str] = None):
+        super().__init__(message)
+        self.operation = operation
+
+
+class StorageTimeoutError(StorageError):
+    """ストレージアクセスのタイムアウト"""
+
+    retryable = True
+
+
+class StorageUnavailableError(StorageError):
+    """ストレージに接続できない・一時的に利用できない（接続エラー・5xx・429）"""
+
+    retryable = True
+
+
+class CircuitOpenError(StorageUnavailableError):
+    """サーキットブレーカーが開いているため呼び出さずに失敗"""
+
+    retryable = False
+
+
+# 一時的な障害として扱うHTTPステータス
+_TRANSIENT_STATUS_CODES = {"408", "429", "500", "502", "503", "504"}
+
+# Postgresのstatement_timeout
+_TIMEOUT_ERROR_CODES = {"57014"}
+
+# 接続エラーを表すHTTPクライアントの例外名（httpxを直接importしないため名前で判定）
+_NETWORK_ERROR_NAMES = {"ConnectError", "ReadError", "WriteError", "RemoteProtocolError", "NetworkError"}
+
+
+def to_storage_error(error: BaseException, operation: str) -> StorageError:
+    """
+    クライアントの例外を型付きのStorageErrorに変換
+
+    Args:
+        error: 発生した例外
+        operation: 操作名（エラーメッセージ用）
+
+    Returns:
+        StorageError: タイムアウト・一時的な障害・それ以外に分類したエラー
+    """
+    if isinstance(error, StorageError):
+        return error
+
+    message = f"{operation}: {type(error).__name__}: {error}"
+    code = getattr(error, "code", None)
+    response = getattr(error, "response", None)
+    if code is None and response is not None:
+        code = getattr(response, "status_code", None)
+
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)) or "Timeout" in type(error).__name__ \
+            or str(code) in _TIMEOUT_ERROR_CODES:
+        return StorageTimeoutError(message, operation)
+    if isinstance(error, (ConnectionError, OSError)) or type(error).__name__ in _NETWORK_ERROR_NAMES \
+            or str(code) in _TRANSIENT_STATUS_CODES:
+        return StorageUnavailableError(message, operation)
+    return StorageError(message, operation)
+
+
+class RetryBudget:
+    """
+    リトライ予算
+
+    通常の呼び出しごとに ratio 分のトークンを貯め、リトライ・ヘッジで1ずつ消費する。
+    障害時にリトライで負荷が何倍にも膨らむのを防ぐ（定常的な追加負荷は約ratio倍まで）。
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+    def record_call(self):
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+class CircuitBreaker:
+    """
+    サーキットブレーカー（closed → open → half_open → closed）
+
+    一時的な障害が failure_threshold 回連続したら開き、reset_timeout 秒後に1回だけ試行を通す。
+    試行が成功すれば閉じ、失敗すれば再び開く。
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def before_call(self, operation: str):
+        """呼び出し前の確認（開いている場合はCircuitOpenError）"""
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"{operation}: サーキットブレーカーが開いています", operation)
+            self.state = "half_open"
+            self._trial_in_flight = False
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                raise CircuitOpenError(f"{operation}: サーキットブレーカーの試行中です", operation)
+            self._trial_in_flight = True
+
+    def release(self):
+        """結果を記録せずに呼び出しを取り消した（キャンセル）"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        if self.state != "closed":
+            print("✅ サーキットブレーカーを閉じました")
+        self.state = "closed"
+        self._failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self, error: StorageError):
+        if not error.retryable:
+            # 4xxなどは応答があった（ストレージは稼働している）ため障害として数えない
+            self.record_success()
+            return
+        self._failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                print(f"⚡ サーキットブレーカーを開きました（{self.reset_timeout}秒間は即座に失敗）: {error}")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+
+class ResilientStorageBackend:
+    """StorageBackendの各呼び出しにタイムアウト・リトライ・サーキットブレーカー・ヘッジ読み取りを適用するラッパー"""
+
+    def __init__(
+        self,
+        inner: StorageBackend,
+        timeout: Optional[float] = None,
+        bulk_timeout: Optional[float] = None,
+        attempts: Optional[int] = None,
+        hedge_delay: Optional[float] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        budget: Optional[RetryBudget] = None,
+        base_delay: float = 0.1,
+        max_delay: float = 2.0
+    ):
+        """
+        Args:
+            inner: 実際のストレージ実装
+            timeout: 1回の呼び出しのタイムアウト（秒）。未指定時は環境変数STORAGE_TIMEOUT_SECONDS（デフォルト10）
+            bulk_timeout: 期間取得・一括保存のタイムアウト（秒）。未指定時は環境変数STORAGE_BULK_TIMEOUT_SECONDS（デフォルト120）
+            attempts: 最大試行回数。未指定時は環境変数STORAGE_RETRY_ATTEMPTS（デフォルト3）
+            hedge_delay: ヘッジ読み取りを発行するまでの待ち時間（秒）。未指定時は環境変数STORAGE_HEDGE_DELAY_MS（0で無効）
+            breaker: サーキットブレーカー。未指定時は環境変数STORAGE_BREAKER_FAILURES（5）・STORAGE_BREAKER_RESET_SECONDS（30）
+            budget: リトライ予算。未指定時は環境変数STORAGE_RETRY_BUDGET_RATIO（デフォルト0.2）
+            base_delay: リトライ間隔の基準（秒、試行ごとに倍増してフルジッターを適用）
+            max_delay: リトライ間隔の上限（秒）
+        """
+        self._inner = inner
+        self.timeout = timeout or float(os.getenv("STORAGE_TIMEOUT_SECONDS", "10"))
+        self.bulk_timeout = bulk_timeout or float(os.getenv("STORAGE_BULK_TIMEOUT_SECONDS", "120"))
+        self.attempts = attempts or int(os.getenv("STORAGE_RETRY_ATTEMPTS", "3"))
+        self.hedge_delay = hedge_delay if hedge_delay is not None else float(os.getenv("STORAGE_HEDGE_DELAY_MS", "0")) / 1000
+        self.breaker = breaker or CircuitBreaker(
+            int(os.getenv("STORAGE_BREAKER_FAILURES", "5")),
+            float(os.getenv("STORAGE_BREAKER_RESET_SECONDS", "30"))
+        )
+        self.budget = budget or RetryBudget(float(os.getenv("STORAGE_RETRY_BUDGET_RATIO", "0.2")))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "failures": 0}
+
+    def __getattr__(self, name: str) -> Any:
+        # 実装固有のメソッド・属性（upsert_opensmile_dataなど）はそのまま委譲
+        if name == "_inner":
+            raise AttributeError(name)
+        return getattr(self._inner, name)
+
+    def status(self) -> Dict[str, Any]:
+        """ブレーカーの状態と呼び出し統計"""
+        return {"breaker": self.breaker.state, "retry_tokens": round(self.budget.tokens, 2), **self.stats}
+
+    async def _attempt(self, operation: str, call: Callable[[], Awaitable[Any]], timeout: float) -> Any:
+        self.breaker.before_call(operation)
+        try:
+            result = await asyncio.wait_for(call(), timeout)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            error = to_storage_error(e, operation)
+            self.breaker.record_failure(error)
+            raise error from e
+        self.breaker.record_success()
+        return result
+
+    async def _hedged(self, operation: str, call: Callable[[], Awaitable[Any]], timeout: float) -> Any:
+        first = asyncio.ensure_future(self._attempt(operation, call, timeout))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay)
+        if done or not self.budget.try_spend():
+            return await first
+
+        self.stats["hedges"] += 1
+        pending = {first, asyncio.ensure_future(self._attempt(operation, call, timeout))}
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call(
+        self,
+        operation: str,
+        call: Callable[[], Awaitable[Any]],
+        timeout: float,
+        hedge: bool = False
+    ) -> Any:
+        """1回の呼び出しを予算の範囲でリトライしながら実行"""
+        self.stats["calls"] += 1
+        self.budget.record_call()
+        attempt = 0
+        while True:
+            try:
+                if hedge and self.hedge_delay > 0:
+                    return await self._hedged(operation, call, timeout)
+                return await self._attempt(operation, call, timeout)
+            except StorageError as e:
+                attempt += 1
+                if not e.retryable or attempt >= self.attempts or not self.budget.try_spend():
+                    self.stats["failures"] += 1
+                    raise
+                self.stats["retries"] += 1
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                print(f"🔁 ストレージ再試行 ({attempt}/{self.attempts - 1}, {delay:.2f}秒後): {e}")
+                await asyncio.sleep(delay)
+
+    async def fetch_all_opensmile_data_for_day(self, device_id: str, date: str) -> List[Dict]:
+        return await self._call(
+            "fetch_all_opensmile_data_for_day",
+            lambda: self._inner.fetch_all_opensmile_data_for_day(device_id, date),
+            self.timeout,
+            hedge=True
+        )
+
+    async def fetch_opensmile_data_range(
+        self,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        return await self._call(
+            "fetch_opensmile_data_range",
+            lambda: self._inner.fetch_opensmile_data_range(start_date, end_date, device_id),
+            self.bulk_timeout
+        )
+
+    async def fetch_emotion_summary(self, device_id: str, date: str) -> Optional[List[Dict]]:
+        return await self._call(
+            "fetch_emotion_summary",
+            lambda: self._inner.fetch_emotion_summary(device_id, date),
+            self.timeout,
+            hedge=True
+        )
+
+    async def fetch_emotion_summaries_range(
+        self,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        return await self._call(
+            "fetch_emotion_summaries_range",
+            lambda: self._inner.fetch_emotion_summaries_range(start_date, end_date, device_id),
+            self.bulk_timeout
+        )
+
+    async def fetch_stale_device_days(self, since_date: str, limit: int = 1000) -> List[Dict]:
+        return await self._call(
+            "fetch_stale_device_days",
+            lambda: self._inner.fetch_stale_device_days(since_date, limit),
+            self.bulk_timeout
+        )
+
+    async def save_emotion_summary(
+        self,
+        device_id: str,
+        date: str,
+        emotion_graph: List[Dict],
+        watermark: Optional[str] = None
+    ) -> bool:
+        # UPSERTのため、タイムアウト後に先の呼び出しが反映されていても再試行で結果は変わらない
+        return await self._call(
+            "save_emotion_summary",
+            lambda: self._inner.save_emotion_summary(device_id, date, emotion_graph, watermark),
+            self.timeout
+        )
+
+    async def bulk_save_emotion_summaries(self, summaries: List[Dict]) -> bool:
+        return await self._call(
+            "bulk_save_emotion_summaries",
+            lambda: self._inner.bulk_save_emotion_summaries(summaries),
+            self.bulk_timeout
+        )
+
+    async def merge_emotion_summary(self, device_id: str, date: str, emotion_graph: List[Dict]) -> List[Dict]:
+        # 同じスロットを同じ値で上書きするだけのため、再試行しても結果は変わらない
+        return await self._call(
+            "merge_emotion_summary",
+            lambda: self._inner.merge_emotion_summary(device_id, date, emotion_graph),
+            self.timeout
+        )
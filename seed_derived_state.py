@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+派生状態の初期構築（保存済みの audio_aggregator からの取り込み）
+
+フリート・グループのロールアップ（FLEET_ROLLUPS_ENABLED）やデバイスごとのベースライン（DEVICE_BASELINES_ENABLED）は
+保存のたびに更新されるため、有効化する前に保存された感情グラフは含まれない。
+このスクリプトで保存済みの感情グラフを日付順に1日ずつ読み込み、有効な派生状態に反映する。
+
+- ロールアップは同じデバイス日の寄与を置き換えるため、同じ期間を何度実行しても二重に数えない
+- ベースラインは再計算期間（BASELINE_REPLAY_DAYS）より前の日付を反映できないため、古い日から順に（期間をまとめて）実行する
+- --reseed-baselines は再構築待ちのデバイス（再計算期間より前の日付が保存された）のベースラインを空にして、
+  期間内の保存済み感情グラフから作り直す（EWMAのため、開始日はデバイスの記録の始めか 1/α 日より十分前を指定する）
+- 派生状態ストアは API と同じ STATE_STORE（sqlite / redis）を指定する
+
+使い方:
+    STATE_STORE=sqlite FLEET_ROLLUPS_ENABLED=true python seed_derived_state.py 2026-09-01 2026-10-18
+    STATE_STORE=sqlite DEVICE_BASELINES_ENABLED=true python seed_derived_state.py 2026-06-01 2026-10-18 --reseed-baselines
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+from typing import Dict, Optional
+
+from device_baseline import DeviceBaselineMaintainer
+from offline_backfill import iter_dates
+from state_store import DerivedStateStorage
+from storage_backend import STORAGE_BACKENDS, StorageBackend, create_storage_service
+
+
+async def seed_derived_state(
+    storage: StorageBackend,
+    start_date: str,
+    end_date: str,
+    device_id: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    期間内の保存済み感情グラフを有効な派生状態に反映
+
+    Args:
+        storage: create_storage_service で生成したストレージ（派生状態が有効な場合は DerivedStateStorage）
+        start_date: 開始日 (YYYY-MM-DD形式、この日を含む)
+        end_date: 終了日 (YYYY-MM-DD形式、この日を含む)
+        device_id: 指定時はそのデバイスのみ
+
+    Returns:
+        Dict: 処理件数（days, device_days）
+
+    Raises:
+        RuntimeError: 有効な派生状態がない場合
+    """
+    if not isinstance(storage, DerivedStateStorage):
+        raise RuntimeError(
+            "有効な派生状態がありません（FLEET_ROLLUPS_ENABLED / DEVICE_BASELINES_ENABLED と共有の STATE_STORE を指定してください）"
+        )
+
+    stats = {"days": 0, "device_days": 0}
+    for date in iter_dates(start_date, end_date):
+        summaries = await storage.fetch_emotion_summaries_range(date, date, device_id)
+        stats["days"] += 1
+        if not summaries:
+            continue
+        # 保存時と違い、失敗した場合は警告で続行せずに中断する（途中の日から再実行できる）
+        for maintainer in storage.maintainers:
+            await maintainer.record_many(summaries)
+        stats["device_days"] += len(summaries)
+        print(f"📥 {date}: {len(summaries)}デバイス日を反映")
+
+    names = ", ".join(type(maintainer).__name__ for maintainer in storage.maintainers)
+    print(f"✅ 派生状態の初期構築完了（{names}）: {stats['device_days']}デバイス日 / {stats['days']}日")
+    return stats
+
+
+async def reseed_device_baselines(
+    storage: StorageBackend,
+    start_date: str,
+    end_date: str,
+    device_id: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    再構築待ちのデバイス（device_id指定時はそのデバイス）のベースラインを期間内の保存済み感情グラフから作り直す
+
+    Args:
+        storage: create_storage_service で生成したストレージ（DEVICE_BASELINES_ENABLED が有効な DerivedStateStorage）
+        start_date: 開始日 (YYYY-MM-DD形式、この日を含む)
+        end_date: 終了日 (YYYY-MM-DD形式、この日を含む)
+        device_id: 指定時は再構築待ちでなくてもそのデバイスを作り直す
+
+    Returns:
+        Dict: 処理件数（devices, device_days）
+
+    Raises:
+        RuntimeError: ベースラインが有効でない場合
+    """
+    baselines = next(
+        (maintainer for maintainer in getattr(storage, "maintainers", []) if isinstance(maintainer, DeviceBaselineMaintainer)),
+        None
+    )
+    if baselines is None:
+        raise RuntimeError("ベースラインが有効ではありません（DEVICE_BASELINES_ENABLED と共有の STATE_STORE を指定してください）")
+
+    device_ids = [device_id] if device_id is not None else sorted(await baselines.pending_reseeds())
+    stats = {"devices": len(device_ids), "device_days": 0}
+    if not device_ids:
+        print("📭 再構築待ちのデバイスはありません")
+        return stats
+
+    await baselines.reset(device_ids)
+    targets = set(device_ids)
+    for date in iter_dates(start_date, end_date):
+        summaries = [
+            summary for summary in await storage.fetch_emotion_summaries_range(date, date, device_id)
+            if summary["device_id"] in targets
+        ]
+        if summaries:
+            await baselines.record_many(summaries)
+            stats["device_days"] += len(summaries)
+
+    print(f"✅ ベースラインの再構築完了: {stats['devices']}デバイス / {stats['device_days']}デバイス日")
+    return stats
+
+
+async def main():
+    """コマンドライン実行用メイン関数"""
+    parser = argparse.ArgumentParser(description="保存済みの感情グラフから派生状態（ロールアップ・ベースライン）を構築")
+    parser.add_argument("start_date", help="開始日（YYYY-MM-DD形式）")
+    parser.add_argument("end_date", help="終了日（YYYY-MM-DD形式）")
+    parser.add_argument("--device-id", help="特定デバイスのみ反映する場合に指定")
+    parser.add_argument("--storage", choices=STORAGE_BACKENDS, help="ストレージバックエンド（未指定時は環境変数STORAGE_BACKEND）")
+    parser.add_argument(
+        "--reseed-baselines",
+        action="store_true",
+        help="再構築待ちのデバイス（--device-id指定時はそのデバイス）のベースラインだけを作り直す"
+    )
+
+    args = parser.parse_args()
+
+    # 日付形式検証
+    try:
+        datetime.strptime(args.start_date, "%Y-%m-%d")
+        datetime.strptime(args.end_date, "%Y-%m-%d")
+    except ValueError:
+        print("エラー: 日付はYYYY-MM-DD形式で指定してください")
+        return
+
+    seed = reseed_device_baselines if args.reseed_baselines else seed_derived_state
+    try:
+        await seed(create_storage_service(args.storage), args.start_date, args.end_date, args.device_id)
+    except RuntimeError as e:
+        print(f"エラー: {e}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+-- 未集計・集計後に更新されたデバイス日の検出（stale_scheduler.py のスイープで使用）
+--
+-- audio_features.emotion_extractor_updated_at（emotion_extractor_result を書き込んだ時刻）の最大値と
+-- audio_aggregator.emotion_aggregator_processed_at を比較し、集計が古いデバイス日だけを1回のクエリで返す。
+-- SupabaseService.fetch_stale_device_days から RPC で呼び出す。
+--
+-- created_at は行の作成時にしか変わらないため、既存の行に感情データを書き込んだ場合を検出できない。
+-- そのため感情データの書き込み時刻を専用の列に記録する（トリガーで更新するため書き込み側の変更は不要）。
+--
+-- emotion_aggregator_processed_at には保存時刻ではなく、集計で読み込んだ行の emotion_extractor_updated_at の
+-- 最大値（ウォーターマーク）を保存する。比較はどちらもこのトリガーの now() で記録した値どうしになり、
+-- 取得から保存までの間に書き込まれた行はウォーターマークより新しいため、次のスイープで検出される。
+
+-- 感情データの書き込み時刻
+alter table public.audio_features
+  add column if not exists emotion_extractor_updated_at timestamptz;
+
+-- 既存の行は created_at で埋める（初回のみ。大きなテーブルでは日付範囲ごとに分けて実行してください）
+update public.audio_features
+  set emotion_extractor_updated_at = created_at
+  where emotion_extractor_result is not null
+    and emotion_extractor_updated_at is null;
+
+create or replace function public.touch_emotion_extractor_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op = 'INSERT' or new.emotion_extractor_result is distinct from old.emotion_extractor_result then
+    new.emotion_extractor_updated_at := case when new.emotion_extractor_result is null then null else now() end;
+  end if;
+  return new;
+end;
+$$;
+
+drop trigger if exists trg_audio_features_emotion_updated_at on public.audio_features;
+create trigger trg_audio_features_emotion_updated_at
+  before insert or update of emotion_extractor_result on public.audio_features
+  for each row execute function public.touch_emotion_extractor_updated_at();
+
+-- スイープ用インデックス（感情データがある行のみ）
+drop index if exists public.idx_audio_features_emotion_watermark;
+create index if not exists idx_audio_features_emotion_updated_at
+  on public.audio_features (date, device_id, emotion_extractor_updated_at)
+  where emotion_extractor_result is not null;
+
+create or replace function public.find_stale_emotion_days(since_date date, max_rows integer default 1000)
+returns table (
+  device_id text,
+  date date,
+  latest_feature_at timestamptz,
+  processed_at timestamptz
+)
+language sql
+stable
+as $$
+  select
+    f.device_id,
+    f.date,
+    max(f.emotion_extractor_updated_at) as latest_feature_at,
+    a.emotion_aggregator_processed_at as processed_at
+  from public.audio_features f
+  left join public.audio_aggregator a
+    on a.device_id = f.device_id and a.date = f.date
+  where f.date >= since_date
+    and f.emotion_extractor_result is not null
+  group by f.device_id, f.date, a.emotion_aggregator_processed_at
+  having a.emotion_aggregator_processed_at is null
+      or max(f.emotion_extractor_updated_at) > a.emotion_aggregator_processed_at
+  order by f.date desc
+  limit max_rows;
+$$;
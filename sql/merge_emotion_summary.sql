@@ -0,0 +1,38 @@
+-- 感情グラフのスロット単位のアトミックなマージ（ingest_accumulator.py の書き出しで使用）
+--
+-- 保存済みの emotion_aggregator_result に p_slots のスロット（"time" が同じものは置き換え）を上書きマージし、
+-- マージ後のグラフを返す。INSERT ... ON CONFLICT DO UPDATE の1文で行うため、同じデバイス日を
+-- 複数ワーカー・複数レプリカから同時に書き出しても、互いのスロットを消さない。
+-- SupabaseService.merge_emotion_summary から RPC で呼び出す。
+--
+-- emotion_aggregator_processed_at（集計に反映した audio_features のウォーターマーク）は変更しない。
+-- マージは audio_features を読まないため、ここで更新すると未反映の audio_features の行が
+-- find_stale_emotion_days のスイープから隠れてしまう。新規の行は NULL（未集計）として作成する。
+
+create or replace function public.merge_emotion_aggregator_result(p_device_id text, p_date date, p_slots jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+  merged jsonb;
+begin
+  insert into public.audio_aggregator as a (device_id, date, emotion_aggregator_result)
+  values (p_device_id, p_date, p_slots)
+  on conflict (device_id, date) do update set
+    emotion_aggregator_result = (
+      select coalesce(jsonb_agg(m.slot order by m.slot->>'time'), '[]'::jsonb)
+      from (
+        -- 同じ時刻のスロットは p_slots（priority 0）を優先する
+        select distinct on (s.slot->>'time') s.slot
+        from (
+          select value as slot, 0 as priority from jsonb_array_elements(excluded.emotion_aggregator_result)
+          union all
+          select value as slot, 1 as priority from jsonb_array_elements(coalesce(a.emotion_aggregator_result, '[]'::jsonb))
+        ) s
+        order by s.slot->>'time', s.priority
+      ) m
+    )
+  returning a.emotion_aggregator_result into merged;
+  return merged;
+end;
+$$;
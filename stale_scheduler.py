@@ -0,0 +1,194 @@
+"""
+未集計デバイス日のスケジューラー
+
+POSTによる集計トリガーが漏れたデバイス日を、ウォーターマーク（audio_featuresの最新行の時刻と
+audio_aggregator.emotion_aggregator_processed_at）の比較で検出し、古いものだけを再集計する。
+全デバイスの総当たり再実行の代わりに、1スイープ1クエリで対象を絞り込む。
+
+- 当日のデータを優先し、それ以外は新しい日付から順に処理
+- 1分あたりの実行数（トークンバケット）と同時実行数で負荷を制限
+- キュー済み・実行中のデバイス日は重複して積まない
+- 同じウォーターマークで一度実行したデバイス日は、新しいデータが来るまで再実行しない
+"""
+
+import asyncio
+import heapq
+import os
+import time
+from datetime import date as date_type, datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from storage_backend import StorageBackend
+
+
+# (priority, -日付の序数, device_id, date)
+_QueueItem = Tuple[int, int, str, str]
+
+
+class StaleDayScheduler:
+    """ウォーターマークで検出した未集計デバイス日を優先度付きで再集計するスケジューラー"""
+
+    def __init__(
+        self,
+        storage_factory: Callable[[], StorageBackend],
+        run_day: Callable[[str, str], Awaitable[None]],
+        sweep_interval: Optional[float] = None,
+        lookback_days: Optional[int] = None,
+        rate_per_minute: Optional[float] = None,
+        concurrency: Optional[int] = None,
+        sweep_limit: int = 1000
+    ):
+        """
+        Args:
+            storage_factory: スイープに使うストレージを生成する関数
+            run_day: 1デバイス日を集計するコルーチン関数 (device_id, date)
+            sweep_interval: スイープ間隔（秒）。未指定時は環境変数STALE_SWEEP_INTERVAL_SECONDS（0で無効）
+            lookback_days: 何日前までを対象にするか。未指定時は環境変数STALE_SWEEP_LOOKBACK_DAYS（デフォルト7）
+            rate_per_minute: 1分あたりの最大実行数。未指定時は環境変数STALE_SWEEP_RATE_PER_MINUTE（デフォルト30）
+            concurrency: 同時実行数。未指定時は環境変数STALE_SWEEP_CONCURRENCY（デフォルト2）
+            sweep_limit: 1スイープで取得する最大デバイス日数
+        """
+        self._storage_factory = storage_factory
+        self._storage: Optional[StorageBackend] = None
+        self._run_day = run_day
+        self.sweep_interval = sweep_interval if sweep_interval is not None else float(os.getenv("STALE_SWEEP_INTERVAL_SECONDS", "0"))
+        self.lookback_days = lookback_days if lookback_days is not None else int(os.getenv("STALE_SWEEP_LOOKBACK_DAYS", "7"))
+        self.rate_per_minute = rate_per_minute or float(os.getenv("STALE_SWEEP_RATE_PER_MINUTE", "30"))
+        self.concurrency = concurrency or int(os.getenv("STALE_SWEEP_CONCURRENCY", "2"))
+        self.sweep_limit = sweep_limit
+
+        self._queue: List[_QueueItem] = []
+        self._queued: Dict[Tuple[str, str], str] = {}  # (device_id, date) → ウォーターマーク
+        self._in_flight: Dict[Tuple[str, str], str] = {}
+        self._attempted: Dict[Tuple[str, str], str] = {}
+        self._has_work = asyncio.Event()
+        self._tokens = float(self.concurrency)
+        self._tokens_updated_at = time.monotonic()
+        self.last_sweep_at: Optional[str] = None
+        self.processed = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sweep_interval > 0
+
+    @property
+    def storage(self) -> StorageBackend:
+        if self._storage is None:
+            self._storage = self._storage_factory()
+        return self._storage
+
+    def status(self) -> Dict:
+        """スケジューラーの状況"""
+        return {
+            "enabled": self.enabled,
+            "sweep_interval_seconds": self.sweep_interval,
+            "lookback_days": self.lookback_days,
+            "rate_per_minute": self.rate_per_minute,
+            "concurrency": self.concurrency,
+            "queued": len(self._queue),
+            "in_flight": len(self._in_flight),
+            "processed": self.processed,
+            "failed": self.failed,
+            "last_error": self.last_error,
+            "last_sweep_at": self.last_sweep_at
+        }
+
+    async def sweep(self) -> int:
+        """
+        未集計デバイス日を1回のクエリで検出してキューに積む
+
+        Returns:
+            int: 新たにキューに積んだデバイス日数
+        """
+        today = date_type.today()
+        since = (today - timedelta(days=self.lookback_days)).isoformat()
+        stale_days = await self.storage.fetch_stale_device_days(since, self.sweep_limit)
+        self.last_sweep_at = datetime.now().isoformat()
+
+        enqueued = 0
+        for row in stale_days:
+            key = (row["device_id"], str(row["date"]))
+            watermark = str(row.get("latest_feature_at"))
+            if key in self._queued or key in self._in_flight:
+                continue
+            if self._attempted.get(key) == watermark:
+                # 前回の実行後に新しいデータが来ていない（データなしで保存されなかった日など）
+                continue
+
+            day = datetime.strptime(key[1], "%Y-%m-%d").date()
+            priority = 0 if day == today else 1
+            heapq.heappush(self._queue, (priority, -day.toordinal(), key[0], key[1]))
+            self._queued[key] = watermark
+            enqueued += 1
+
+        # 対象期間外になった実行履歴を破棄
+        for key in [k for k in self._attempted if k[1] < since]:
+            del self._attempted[key]
+
+        if enqueued:
+            print(f"🧹 未集計デバイス日を検出: {enqueued}件をキューに追加（検出 {len(stale_days)}件）")
+            self._has_work.set()
+        return enqueued
+
+    async def _acquire_token(self):
+        """トークンバケットで1分あたりの実行数を制限"""
+        rate_per_second = self.rate_per_minute / 60.0
+        while True:
+            now = time.monotonic()
+            self._tokens = min(
+                float(self.concurrency),
+                self._tokens + (now - self._tokens_updated_at) * rate_per_second
+            )
+            self._tokens_updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / rate_per_second)
+
+    async def _worker(self):
+        while True:
+            if not self._queue:
+                self._has_work.clear()
+                await self._has_work.wait()
+                continue
+
+            await self._acquire_token()
+            if not self._queue:
+                continue
+            _, _, device_id, date = heapq.heappop(self._queue)
+            key = (device_id, date)
+            watermark = self._queued.pop(key)
+            self._in_flight[key] = watermark
+            try:
+                await self._run_day(device_id, date)
+                self._attempted[key] = watermark
+            except Exception as e:
+                # 失敗した日は実行履歴に残さず、次回のスイープで再検出させる
+                self.failed += 1
+                self.last_error = f"{device_id}/{date}: {e}"
+                print(f"❌ スケジューラーの再集計エラー: {device_id}/{date}: {e}")
+            finally:
+                del self._in_flight[key]
+                self.processed += 1
+
+    async def run(self):
+        """
+        ワーカーを起動し、sweep_intervalごとにスイープする
+
+        sweep_interval が0の場合は定期スイープを行わず、sweep() の手動実行で積まれた分だけ処理する
+        """
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        try:
+            if not self.enabled:
+                await asyncio.gather(*workers)
+            while True:
+                try:
+                    await self.sweep()
+                except Exception as e:
+                    print(f"❌ 未集計デバイス日のスイープエラー: {e}")
+                await asyncio.sleep(self.sweep_interval)
+        finally:
+            for worker in workers:
+                worker.cancel()
@@ -0,0 +1,278 @@
+"""
+集計の派生状態ストア
+保存のたびにインクリメンタルに更新する派生データ（フリートロールアップなど）を、
+キーごとのJSONとして保持し、複数キーをまとめてアトミックに読み書きする
+
+- memory: プロセス内の辞書（単一ワーカー用）
+- sqlite: WALモードのSQLiteファイル（同一ホストの複数ワーカー用）
+- redis:  Redisプロトコルのストア（複数ノード用）
+
+更新は transact(apply) で行う。apply(load) は load(key) で現在の値を読み、
+(書き戻す {key: 値}, 戻り値) を返す純粋な関数とする（Redisでは競合時に再実行されるため）。
+
+感情グラフの保存後の派生状態の更新は DerivedStateStorage がストレージをラップして行う。
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Protocol, Set, Tuple, runtime_checkable
+
+
+STATE_STORES = ("memory", "sqlite", "redis")
+
+_state_store: Optional["StateStore"] = None
+_state_store_lock = threading.Lock()
+
+# STATE_STORE=memory のため有効にしなかった派生状態（警告を1回だけ出す）
+_refused_derived_state: Set[str] = set()
+
+# apply(load) -> (書き戻す {key: 値}, 戻り値)
+Loader = Callable[[str], Optional[Dict[str, Any]]]
+ApplyFunc = Callable[[Loader], Tuple[Dict[str, Dict[str, Any]], Any]]
+
+
+@runtime_checkable
+class StateStore(Protocol):
+    """派生状態ストアの共通インターフェース"""
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """複数キーの値を取得（存在しないキーはNone）"""
+        ...
+
+    async def transact(self, apply: ApplyFunc) -> Any:
+        """apply(load) が読んだキーと書き戻すキーをアトミックに更新し、applyの戻り値を返す"""
+        ...
+
+
+class InMemoryStateStore:
+    """プロセス内の辞書による派生状態ストア（単一ワーカー用）"""
+
+    def __init__(self):
+        self._values: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self._values.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        with self._lock:
+            return [self._load(key) for key in keys]
+
+    async def transact(self, apply: ApplyFunc) -> Any:
+        with self._lock:
+            updates, result = apply(self._load)
+            for key, value in updates.items():
+                self._values[key] = json.dumps(value, ensure_ascii=False)
+            return result
+
+
+class SQLiteStateStore:
+    """WALモードのSQLiteによる派生状態ストア（同一ホストの複数ワーカー用）"""
+
+    def __init__(self, path: str = "state_store.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute("SELECT data FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _get_many_sync(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        with self._lock:
+            return [self._load(key) for key in keys]
+
+    def _transact_sync(self, apply: ApplyFunc) -> Any:
+        # BEGIN IMMEDIATEで書き込みロックを取ってから読み書きする（プロセス間でアトミック）
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                updates, result = apply(self._load)
+                self._conn.executemany(
+                    "INSERT INTO state (key, data) VALUES (?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET data = excluded.data",
+                    [(key, json.dumps(value, ensure_ascii=False)) for key, value in updates.items()]
+                )
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # ロック待ち・ディスクI/Oでイベントループを止めないようにスレッドで実行する
+    async def get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        return await asyncio.to_thread(self._get_many_sync, keys)
+
+    async def transact(self, apply: ApplyFunc) -> Any:
+        return await asyncio.to_thread(self._transact_sync, apply)
+
+
+class _MissingKey(Exception):
+    """applyがまだ読み込んでいないキーを参照した（WATCHして読み込んでから再実行する）"""
+
+    def __init__(self, key: str):
+        super().__init__(key)
+        self.key = key
+
+
+class RedisStateStore:
+    """
+    Redisプロトコルのストアによる派生状態ストア（複数ノード用）
+
+    applyが参照したキーを順にWATCHして読み込み、全キーが揃った時点でMULTI/EXECで書き戻す。
+    他のクライアントが途中で書き換えた場合は最初からやり直す。
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "emotion-aggregator:state:"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("STATE_STORE=redis には redis パッケージが必要です: pip install redis") from e
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+        self._prefix = prefix
+
+    async def get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        if not keys:
+            return []
+        raws = await self._redis.mget([self._prefix + key for key in keys])
+        return [json.loads(raw) if raw is not None else None for raw in raws]
+
+    async def transact(self, apply: ApplyFunc) -> Any:
+        from redis.exceptions import WatchError
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            while True:
+                loaded: Dict[str, Optional[Dict[str, Any]]] = {}
+
+                def load(key: str) -> Optional[Dict[str, Any]]:
+                    if key not in loaded:
+                        raise _MissingKey(key)
+                    value = loaded[key]
+                    return json.loads(json.dumps(value)) if value is not None else None
+
+                try:
+                    while True:
+                        try:
+                            updates, result = apply(load)
+                            break
+                        except _MissingKey as missing:
+                            await pipe.watch(self._prefix + missing.key)
+                            raw = await pipe.get(self._prefix + missing.key)
+                            loaded[missing.key] = json.loads(raw) if raw is not None else None
+
+                    pipe.multi()
+                    for key, value in updates.items():
+                        pipe.set(self._prefix + key, json.dumps(value, ensure_ascii=False))
+                    await pipe.execute()
+                    return result
+                except WatchError:
+                    continue
+
+
+def create_state_store(backend: Optional[str] = None) -> StateStore:
+    """
+    設定に応じた派生状態ストアを生成
+
+    Args:
+        backend: "memory" / "sqlite" / "redis"。未指定時は環境変数STATE_STORE（デフォルト: memory）
+    """
+    backend = (backend or os.getenv("STATE_STORE", "memory")).lower()
+
+    if backend == "memory":
+        return InMemoryStateStore()
+    if backend == "sqlite":
+        return SQLiteStateStore(os.getenv("STATE_STORE_PATH", "state_store.db"))
+    if backend == "redis":
+        return RedisStateStore(os.getenv("STATE_STORE_URL", "redis://localhost:6379/0"))
+
+    raise ValueError(
+        f"未対応のSTATE_STOREです: {backend}（{', '.join(STATE_STORES)} のいずれかを指定してください）"
+    )
+
+
+def derived_state_enabled(env_name: str, storage_backend: Optional[str] = None) -> bool:
+    """
+    派生状態の更新が有効か（環境変数 env_name、デフォルト: false）
+
+    STATE_STORE=memory はプロセスごとの辞書で、再起動で消え、ワーカー・レプリカ・バッチのCLIとも共有されないため、
+    ストレージも同じプロセス内にある場合（STORAGE_BACKEND=memory）を除いて有効にしない
+
+    Args:
+        env_name: 有効化の環境変数名（FLEET_ROLLUPS_ENABLED など）
+        storage_backend: 派生状態を更新するストレージ（未指定時は環境変数STORAGE_BACKEND）
+    """
+    if os.getenv(env_name, "false").lower() not in ("1", "true", "yes"):
+        return False
+    storage_backend = (storage_backend or os.getenv("STORAGE_BACKEND", "supabase")).lower()
+    if os.getenv("STATE_STORE", "memory").lower() == "memory" and storage_backend != "memory":
+        if env_name not in _refused_derived_state:
+            _refused_derived_state.add(env_name)
+            print(f"⚠️ {env_name} には共有の派生状態ストアが必要です（STATE_STORE=sqlite / redis）。無効のまま起動します")
+        return False
+    return True
+
+
+def get_state_store() -> StateStore:
+    """プロセス内で共有する派生状態ストア（初回呼び出し時に環境変数STATE_STOREに応じて生成）"""
+    global _state_store
+    with _state_store_lock:
+        if _state_store is None:
+            _state_store = create_state_store()
+        return _state_store
+
+
+class DerivedStateStorage:
+    """
+    感情グラフの保存が成功した後に派生状態を更新するストレージラッパー
+
+    maintainers はそれぞれ record_many(summaries) を持つ（fleet_rollup.FleetRollupMaintainer など）。
+    派生状態の更新に失敗しても保存自体は成功として返し、警告だけを出す。
+    保存以外の呼び出しはそのまま下位のストレージに委譲する。
+    """
+
+    def __init__(self, inner, maintainers: List[Any]):
+        self._inner = inner
+        self.maintainers = list(maintainers)
+
+    def __getattr__(self, name: str):
+        # copy・pickleは__init__を呼ばずに属性を探すため、_innerがない状態で自分を再帰的に呼ばない
+        if name == "_inner":
+            raise AttributeError(name)
+        return getattr(self._inner, name)
+
+    async def _record(self, summaries: List[Dict[str, Any]]):
+        for maintainer in self.maintainers:
+            try:
+                await maintainer.record_many(summaries)
+            except Exception as e:
+                print(f"⚠️ 派生状態の更新に失敗しました（{type(maintainer).__name__}）: {e}")
+
+    async def save_emotion_summary(
+        self,
+        device_id: str,
+        date: str,
+        emotion_graph: List[Dict],
+        watermark: Optional[str] = None
+    ) -> bool:
+        success = await self._inner.save_emotion_summary(device_id, date, emotion_graph, watermark)
+        if success:
+            await self._record([{"device_id": device_id, "date": date, "emotion_graph": emotion_graph, "watermark": watermark}])
+        return success
+
+    async def bulk_save_emotion_summaries(self, summaries: List[Dict]) -> bool:
+        success = await self._inner.bulk_save_emotion_summaries(summaries)
+        if success:
+            await self._record(summaries)
+        return success
+
+    async def merge_emotion_summary(self, device_id: str, date: str, emotion_graph: List[Dict]) -> List[Dict]:
+        merged_graph = await self._inner.merge_emotion_summary(device_id, date, emotion_graph)
+        await self._record([{"device_id": device_id, "date": date, "emotion_graph": merged_graph}])
+        return merged_graph
@@ -0,0 +1,223 @@
+"""
+ストレージバックエンド定義
+集計処理が利用するデータ取得・保存のインターフェースと、設定による実装選択を提供
+
+- supabase: 本番用（audio_features / audio_aggregator テーブル）
+- sqlite:   ローカルディスク上のSQLiteファイル（オフライン再計算・ベンチマーク用）
+- memory:   プロセス内のインメモリSQLite（テスト用）
+"""
+
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Protocol, runtime_checkable
+
+
+STORAGE_BACKENDS = ("supabase", "sqlite", "memory")
+
+_environment_loaded = False
+
+
+def load_environment():
+    """
+    .envファイルを環境変数に読み込む（プロセスごとに1回だけ）
+
+    import時ではなく設定を読む直前に呼ぶことで、起動時のモジュール読み込みを軽くする
+    """
+    global _environment_loaded
+    if _environment_loaded:
+        return
+    _environment_loaded = True
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+def _watermark_key(value: Any) -> Any:
+    # Supabaseは小数秒の桁数が行ごとに異なるため、日時として比較する
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+def consumed_watermark(rows: Iterable[Dict]) -> Optional[str]:
+    """
+    集計に使ったaudio_features行のウォーターマーク（emotion_extractor_updated_at の最大値）
+
+    保存時にこの値を emotion_aggregator_processed_at に記録し、未集計の検出でDBの同じ列と比較する。
+    保存時刻ではなく読み込んだ行の値を使うため、取得から保存までの間に書き込まれた行も検出でき、
+    比較は常にDB側の時計で記録した値どうしになる。
+
+    Returns:
+        Optional[str]: ウォーターマーク（更新日時を持つ行がない場合はNone）
+    """
+    watermarks = [row["emotion_extractor_updated_at"] for row in rows if row.get("emotion_extractor_updated_at")]
+    if not watermarks:
+        return None
+    try:
+        return max(watermarks, key=_watermark_key)
+    except (TypeError, ValueError):
+        return max(watermarks)
+
+
+def is_older_watermark(watermark: Optional[str], recorded: Optional[str]) -> bool:
+    """
+    watermark が記録済みのウォーターマークより古ければTrue（どちらかがNoneの場合は比較できないためFalse）
+
+    派生状態の更新で、後から届いた古い集計結果が新しい結果を上書きしないように使う
+    """
+    if watermark is None or recorded is None:
+        return False
+    try:
+        return _watermark_key(watermark) < _watermark_key(recorded)
+    except (TypeError, ValueError):
+        return str(watermark) < str(recorded)
+
+
+@runtime_checkable
+class StorageBackend(Protocol):
+    """
+    感情データの取得・保存を行うストレージの共通インターフェース
+
+    取得・保存に失敗した場合は空の結果やFalseではなく例外（resilience.StorageError）を送出し、
+    「データなし」と区別できるようにする
+    """
+
+    async def fetch_all_opensmile_data_for_day(
+        self,
+        device_id: str,
+        date: str
+    ) -> List[Dict]:
+        """1日分の感情分析データ（emotion_extractor_updated_at を含む）をtime_block順に取得"""
+        ...
+
+    async def fetch_opensmile_data_range(
+        self,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        """期間内（両端を含む）の感情分析データを(device_id, date, time_block)順に取得"""
+        ...
+
+    async def fetch_emotion_summary(
+        self,
+        device_id: str,
+        date: str
+    ) -> Optional[List[Dict]]:
+        """保存済みの感情グラフ（emotion_aggregator_result）を取得。未保存の場合はNone"""
+        ...
+
+    async def fetch_emotion_summaries_range(
+        self,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        期間内（両端を含む）の保存済み感情グラフを(date, device_id)順に取得
+
+        Returns:
+            List[Dict]: {"device_id", "date", "emotion_graph", "watermark"} のリスト
+                （watermark は emotion_aggregator_processed_at）
+        """
+        ...
+
+    async def fetch_stale_device_days(
+        self,
+        since_date: str,
+        limit: int = 1000
+    ) -> List[Dict]:
+        """
+        集計が古いデバイス日を取得（audio_featuresの最新行が集計に反映したウォーターマークより新しい、または未集計）
+
+        Returns:
+            List[Dict]: {"device_id", "date", "latest_feature_at", "processed_at"} のリスト（新しい日付順）
+        """
+        ...
+
+    async def save_emotion_summary(
+        self,
+        device_id: str,
+        date: str,
+        emotion_graph: List[Dict],
+        watermark: Optional[str] = None
+    ) -> bool:
+        """
+        1日分の感情グラフをUPSERT
+
+        Args:
+            watermark: 集計に使った行の consumed_watermark（emotion_aggregator_processed_at に記録。
+                Noneの場合は未集計として記録し、次のスイープで再集計する）
+        """
+        ...
+
+    async def bulk_save_emotion_summaries(self, summaries: List[Dict]) -> bool:
+        """
+        複数日の感情グラフをまとめてUPSERT
+
+        Args:
+            summaries: {"device_id", "date", "emotion_graph", "watermark"} を持つ辞書のリスト
+                （watermark は save_emotion_summary と同じ。省略時はNone）
+        """
+        ...
+
+    async def merge_emotion_summary(
+        self,
+        device_id: str,
+        date: str,
+        emotion_graph: List[Dict]
+    ) -> List[Dict]:
+        """
+        保存済みの感情グラフに指定スロットだけをアトミックに上書きマージ（他のスロットは残す）
+
+        Returns:
+            List[Dict]: マージ後の感情グラフ
+        """
+        ...
+
+
+def _with_derived_state(storage: StorageBackend, backend: str) -> StorageBackend:
+    """
+    感情グラフの保存時に派生状態を更新するラッパーを適用
+    （フリート・グループのロールアップ: FLEET_ROLLUPS_ENABLED、デバイスごとのベースライン: DEVICE_BASELINES_ENABLED）
+    """
+    from state_store import DerivedStateStorage, derived_state_enabled
+
+    maintainers = []
+    if derived_state_enabled("FLEET_ROLLUPS_ENABLED", backend):
+        from fleet_rollup import get_fleet_rollups
+        maintainers.append(get_fleet_rollups())
+    if derived_state_enabled("DEVICE_BASELINES_ENABLED", backend):
+        from device_baseline import get_device_baselines
+        maintainers.append(get_device_baselines())
+    return DerivedStateStorage(storage, maintainers) if maintainers else storage
+
+
+def create_storage_service(backend: Optional[str] = None) -> StorageBackend:
+    """
+    設定に応じたストレージ実装を生成
+
+    Args:
+        backend: "supabase" / "sqlite" / "memory"。未指定時は環境変数STORAGE_BACKEND（デフォルト: supabase）
+
+    Returns:
+        StorageBackend: ストレージ実装
+    """
+    load_environment()
+    backend = (backend or os.getenv("STORAGE_BACKEND", "supabase")).lower()
+
+    if backend == "supabase":
+        # supabaseクライアントはSupabase利用時のみ読み込む
+        # タイムアウト・リトライ・サーキットブレーカー・ヘッジ読み取りを適用する
+        from resilience import ResilientStorageBackend
+        from supabase_service import SupabaseService
+        return _with_derived_state(ResilientStorageBackend(SupabaseService()), backend)
+
+    if backend == "sqlite":
+        from local_storage import LocalStorageService
+        return _with_derived_state(LocalStorageService(os.getenv("LOCAL_STORAGE_PATH", "local_storage.db")), backend)
+
+    if backend == "memory":
+        from local_storage import LocalStorageService
+        return _with_derived_state(LocalStorageService(":memory:"), backend)
+
+    raise ValueError(
+        f"未対応のSTORAGE_BACKENDです: {backend}（{', '.join(STORAGE_BACKENDS)} のいずれかを指定してください）"
+    )
@@ -4,20 +4,20 @@ audio_features.emotion_extractor_resultからデータを取得
 audio_aggregator.emotion_aggregator_resultへデータを保存
 """
 
+import asyncio
 import os
-from typing import Dict, List, Optional
-from datetime import datetime
+from typing import Any, Dict, List, Optional
 from supabase import create_client, Client
-from dotenv import load_dotenv
 
-# 環境変数の読み込み
-load_dotenv()
+from resilience import to_storage_error
+from storage_backend import load_environment
 
 
 class SupabaseService:
     """Supabaseとの連携を管理するサービスクラス"""
     
     def __init__(self):
+        load_environment()
         supabase_url = os.getenv("SUPABASE_URL")
         supabase_key = os.getenv("SUPABASE_KEY")
         
@@ -27,88 +27,243 @@ class SupabaseService:
         self.supabase: Client = create_client(supabase_url, supabase_key)
         self.table_name = "audio_features"
         self.summary_table_name = "audio_aggregator"
+        # PostgRESTの1リクエストあたりの最大取得行数
+        self.page_size = 1000
+
+    async def _execute(self, query: Any, operation: str) -> Any:
+        """
+        クエリをスレッドで実行（同期クライアントでイベントループを止めない）
+
+        Raises:
+            StorageError: 失敗時（タイムアウト・一時的な障害・それ以外に分類した型付きエラー）
+        """
+        try:
+            return await asyncio.to_thread(query.execute)
+        except Exception as e:
+            raise to_storage_error(e, operation) from e
     
-    async def fetch_opensmile_data(
+    async def fetch_all_opensmile_data_for_day(
         self,
         device_id: str,
-        date: str,
-        time_slot: str
-    ) -> Optional[Dict]:
+        date: str
+    ) -> List[Dict]:
         """
-        指定されたdevice_id、date、time_slotの感情分析データを取得
+        指定されたdevice_idとdateの全感情分析データを取得
 
         Args:
             device_id: デバイスID
             date: 日付 (YYYY-MM-DD形式)
-            time_slot: 時間スロット (HH-MM形式)
 
         Returns:
-            Dict: 感情分析データ（emotion_extractor_resultを含む）
+            List[Dict]: その日の全感情分析データのリスト（データなしの場合は空リスト）
+
+        Raises:
+            StorageError: 取得エラー時（「データなし」と区別するため空リストは返さない）
         """
-        try:
-            response = self.supabase.table(self.table_name).select(
-                "device_id,date,time_block,emotion_extractor_result"
+        response = await self._execute(
+            self.supabase.table(self.table_name).select(
+                "device_id,date,time_block,emotion_extractor_result,emotion_extractor_updated_at"
             ).eq(
                 "device_id", device_id
             ).eq(
                 "date", date
-            ).eq(
-                "time_block", time_slot
-            ).execute()
-
-            if response.data and len(response.data) > 0:
-                print(f"✅ Supabaseからデータ取得成功: {device_id}/{date}/{time_slot}")
-                return response.data[0]
-            else:
-                print(f"📭 データなし: {device_id}/{date}/{time_slot}")
-                return None
+            ).order(
+                "time_block"
+            ),
+            "fetch_all_opensmile_data_for_day"
+        )
 
-        except Exception as e:
-            print(f"❌ Supabase取得エラー: {str(e)}")
-            return None
+        if response.data:
+            print(f"✅ Supabaseから{len(response.data)}件のデータ取得成功: {device_id}/{date}")
+            return response.data
+        else:
+            print(f"📭 データなし: {device_id}/{date}")
+            return []
     
-    async def fetch_all_opensmile_data_for_day(
+    async def fetch_opensmile_data_range(
+        self,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        期間内の感情分析データをページングしながら一括取得
+
+        Args:
+            start_date: 開始日 (YYYY-MM-DD形式、この日を含む)
+            end_date: 終了日 (YYYY-MM-DD形式、この日を含む)
+            device_id: 指定時はそのデバイスのみ
+
+        Returns:
+            List[Dict]: (device_id, date, time_block)順の感情分析データのリスト
+
+        Raises:
+            StorageError: 取得エラー時（途中のページで失敗した場合も部分的な結果は返さない）
+        """
+        rows: List[Dict] = []
+        offset = 0
+        while True:
+            query = self.supabase.table(self.table_name).select(
+                "device_id,date,time_block,emotion_extractor_result,emotion_extractor_updated_at"
+            ).gte(
+                "date", start_date
+            ).lte(
+                "date", end_date
+            )
+            if device_id is not None:
+                query = query.eq("device_id", device_id)
+
+            response = await self._execute(
+                query.order(
+                    "device_id"
+                ).order(
+                    "date"
+                ).order(
+                    "time_block"
+                ).range(
+                    offset, offset + self.page_size - 1
+                ),
+                "fetch_opensmile_data_range"
+            )
+
+            page = response.data or []
+            rows.extend(page)
+            if len(page) < self.page_size:
+                break
+            offset += self.page_size
+
+        print(f"✅ Supabaseから{len(rows)}件のデータ取得成功: {start_date}〜{end_date}")
+        return rows
+
+    async def fetch_emotion_summary(
         self,
         device_id: str,
         date: str
-    ) -> List[Dict]:
+    ) -> Optional[List[Dict]]:
         """
-        指定されたdevice_idとdateの全感情分析データを取得
+        保存済みの感情グラフ（audio_aggregator.emotion_aggregator_result）を取得
 
         Args:
             device_id: デバイスID
             date: 日付 (YYYY-MM-DD形式)
 
         Returns:
-            List[Dict]: その日の全感情分析データのリスト
+            List[Dict]: 保存済みのtime_blocks（未保存の場合はNone）
+
+        Raises:
+            StorageError: 取得エラー時（「未保存」と区別し、既存サマリーを部分データで上書きしないため）
         """
-        try:
-            response = self.supabase.table(self.table_name).select(
-                "device_id,date,time_block,emotion_extractor_result"
+        response = await self._execute(
+            self.supabase.table(self.summary_table_name).select(
+                "emotion_aggregator_result"
             ).eq(
                 "device_id", device_id
             ).eq(
                 "date", date
-            ).order(
-                "time_block"
-            ).execute()
+            ),
+            "fetch_emotion_summary"
+        )
 
-            if response.data:
-                print(f"✅ Supabaseから{len(response.data)}件のデータ取得成功: {device_id}/{date}")
-                return response.data
-            else:
-                print(f"📭 データなし: {device_id}/{date}")
-                return []
+        if response.data:
+            return response.data[0].get("emotion_aggregator_result")
+        return None
+
+    async def fetch_emotion_summaries_range(
+        self,
+        start_date: str,
+        end_date: str,
+        device_id: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        期間内の保存済み感情グラフをページングしながら一括取得（派生状態の初期構築用）
+
+        Args:
+            start_date: 開始日 (YYYY-MM-DD形式、この日を含む)
+            end_date: 終了日 (YYYY-MM-DD形式、この日を含む)
+            device_id: 指定時はそのデバイスのみ
+
+        Returns:
+            List[Dict]: (date, device_id)順の {"device_id", "date", "emotion_graph", "watermark"} のリスト
+                （watermark は emotion_aggregator_processed_at）
+
+        Raises:
+            StorageError: 取得エラー時（途中のページで失敗した場合も部分的な結果は返さない）
+        """
+        summaries: List[Dict] = []
+        offset = 0
+        while True:
+            query = self.supabase.table(self.summary_table_name).select(
+                "device_id,date,emotion_aggregator_result,emotion_aggregator_processed_at"
+            ).gte(
+                "date", start_date
+            ).lte(
+                "date", end_date
+            ).not_.is_(
+                "emotion_aggregator_result", "null"
+            )
+            if device_id is not None:
+                query = query.eq("device_id", device_id)
+
+            response = await self._execute(
+                query.order(
+                    "date"
+                ).order(
+                    "device_id"
+                ).range(
+                    offset, offset + self.page_size - 1
+                ),
+                "fetch_emotion_summaries_range"
+            )
+
+            page = response.data or []
+            summaries.extend(
+                {
+                    "device_id": row["device_id"],
+                    "date": row["date"],
+                    "emotion_graph": row["emotion_aggregator_result"],
+                    "watermark": row.get("emotion_aggregator_processed_at")
+                }
+                for row in page
+            )
+            if len(page) < self.page_size:
+                break
+            offset += self.page_size
+
+        return summaries
+
+    async def fetch_stale_device_days(
+        self,
+        since_date: str,
+        limit: int = 1000
+    ) -> List[Dict]:
+        """
+        集計が古いデバイス日を取得（sql/find_stale_emotion_days.sql のRPCを1回呼び出す）
+
+        Args:
+            since_date: この日以降を対象 (YYYY-MM-DD形式)
+            limit: 最大件数
+
+        Returns:
+            List[Dict]: {"device_id", "date", "latest_feature_at", "processed_at"} のリスト（新しい日付順）
+
+        Raises:
+            StorageError: 取得エラー時
+        """
+        response = await self._execute(
+            self.supabase.rpc(
+                "find_stale_emotion_days",
+                {"since_date": since_date, "max_rows": limit}
+            ),
+            "fetch_stale_device_days"
+        )
+        return response.data or []
 
-        except Exception as e:
-            print(f"❌ Supabase取得エラー: {str(e)}")
-            return []
-    
     async def save_emotion_summary(
         self,
         device_id: str,
         date: str,
-        emotion_graph: List[Dict]
+        emotion_graph: List[Dict],
+        watermark: Optional[str] = None
     ) -> bool:
         """
         感情グラフデータをaudio_aggregator.emotion_aggregator_resultに保存
@@ -117,30 +272,105 @@ class SupabaseService:
             device_id: デバイスID
             date: 日付 (YYYY-MM-DD形式)
             emotion_graph: 時間スロットごとの感情スコアのリスト（48スロット、time_blocks相当）
+            watermark: 集計に使った行の emotion_extractor_updated_at の最大値
+                （emotion_aggregator_processed_at に記録し、find_stale_emotion_days でDBの値どうしを比較する）
 
         Returns:
             bool: 保存成功時True
+
+        Raises:
+            StorageError: 保存エラー時
         """
-        try:
-            # レコードデータを作成（1日1レコード）
-            record = {
-                "device_id": device_id,
-                "date": date,
-                "emotion_aggregator_result": emotion_graph,  # time_blocksを保存
-                "emotion_aggregator_processed_at": datetime.utcnow().isoformat()
-            }
+        # レコードデータを作成（1日1レコード）
+        record = {
+            "device_id": device_id,
+            "date": date,
+            "emotion_aggregator_result": emotion_graph,  # time_blocksを保存
+            "emotion_aggregator_processed_at": watermark
+        }
 
-            # UPSERT実行（既存データがあれば更新、なければ挿入）
-            response = self.supabase.table(self.summary_table_name).upsert(
+        # UPSERT実行（既存データがあれば更新、なければ挿入）
+        await self._execute(
+            self.supabase.table(self.summary_table_name).upsert(
                 record,
                 on_conflict="device_id,date"
-            ).execute()
+            ),
+            "save_emotion_summary"
+        )
+
+        print(f"✅ Supabase audio_aggregatorにデータを保存: {device_id}/{date}")
+        print(f"   emotion_aggregator_result に time_blocks を保存")
+        print(f"   保存スロット数: {len(emotion_graph)}")
+        return True
+
+    async def bulk_save_emotion_summaries(self, summaries: List[Dict]) -> bool:
+        """
+        複数日の感情グラフをまとめてaudio_aggregatorにUPSERT
+
+        Args:
+            summaries: {"device_id", "date", "emotion_graph", "watermark"} を持つ辞書のリスト
+                （watermark は save_emotion_summary と同じ）
 
-            print(f"✅ Supabase audio_aggregatorにデータを保存: {device_id}/{date}")
-            print(f"   emotion_aggregator_result に time_blocks を保存")
-            print(f"   保存スロット数: {len(emotion_graph)}")
+        Returns:
+            bool: 保存成功時True
+
+        Raises:
+            StorageError: 保存エラー時
+        """
+        if not summaries:
             return True
 
-        except Exception as e:
-            print(f"❌ Supabase保存エラー: {str(e)}")
-            return False
\ No newline at end of file
+        records = [
+            {
+                "device_id": summary["device_id"],
+                "date": summary["date"],
+                "emotion_aggregator_result": summary["emotion_graph"],
+                "emotion_aggregator_processed_at": summary.get("watermark")
+            }
+            for summary in summaries
+        ]
+
+        for start in range(0, len(records), self.page_size):
+            await self._execute(
+                self.supabase.table(self.summary_table_name).upsert(
+                    records[start:start + self.page_size],
+                    on_conflict="device_id,date"
+                ),
+                "bulk_save_emotion_summaries"
+            )
+
+        print(f"✅ Supabase audio_aggregatorに{len(records)}日分を一括保存")
+        return True
+
+    async def merge_emotion_summary(
+        self,
+        device_id: str,
+        date: str,
+        emotion_graph: List[Dict]
+    ) -> List[Dict]:
+        """
+        保存済みの感情グラフに指定スロットだけを上書きマージ（RPC merge_emotion_aggregator_result）
+
+        読み込み・マージ・書き込みをDB内の1文で行うため、複数ワーカー・複数レプリカから同じデバイス日を
+        同時に書き出しても互いのスロットを消さない（sql/merge_emotion_summary.sql を事前に実行しておく）
+
+        Args:
+            device_id: デバイスID
+            date: 日付 (YYYY-MM-DD形式)
+            emotion_graph: 上書きするスロットの感情グラフ
+
+        Returns:
+            List[Dict]: マージ後の感情グラフ
+
+        Raises:
+            StorageError: 保存エラー時
+        """
+        response = await self._execute(
+            self.supabase.rpc(
+                "merge_emotion_aggregator_result",
+                {"p_device_id": device_id, "p_date": date, "p_slots": emotion_graph}
+            ),
+            "merge_emotion_summary"
+        )
+        print(f"✅ Supabase audio_aggregatorにスロットをマージ: {device_id}/{date} ({len(emotion_graph)}スロット)")
+        return response.data or []
@@ -0,0 +1,484 @@
+"""
+タスク状況ストア
+APIのタスク状況をプロセス外に置き、複数ワーカー・複数レプリカで共有するための実装
+
+- memory: プロセス内の辞書（単一ワーカー用、従来の挙動）
+- sqlite: WALモードのSQLiteファイル（同一ホストの複数ワーカー用）
+- redis:  Redisプロトコルのストア（複数ノード用。Redis互換のローカル代替サーバーに差し替え可能）
+
+状態遷移はすべてストア側でアトミックに行う（期待するステータス・ワーカーと一致した場合のみ更新）。
+実行権はリース付きで取得（claim）し、リースが切れたタスクは別のワーカーが引き継げる。
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Protocol, runtime_checkable
+
+
+TASK_STORES = ("memory", "sqlite", "redis")
+
+# 実行前・実行中のステータス（リース切れで引き継ぎ対象になる）
+ACTIVE_STATUSES = ("started", "running")
+
+# 完了したステータス（削除可能。redisでは TASK_TTL_SECONDS 後に期限切れにする）
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+def default_worker_id() -> str:
+    """このプロセスを識別するワーカーID（ホスト名:PID）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _is_claimable(task: Dict[str, Any], now: float) -> bool:
+    """未着手、またはリースが切れた実行中タスクならTrue"""
+    if task.get("status") == "started":
+        return True
+    return task.get("status") == "running" and task.get("lease_expires_at", 0) < now
+
+
+def _is_orphaned(task: Dict[str, Any], now: float) -> bool:
+    """実行前・実行中のままリースが切れたタスクならTrue"""
+    return task.get("status") in ACTIVE_STATUSES and task.get("lease_expires_at", 0) < now
+
+
+def _matches(
+    task: Dict[str, Any],
+    expected_statuses: Optional[Iterable[str]],
+    expected_worker_id: Optional[str]
+) -> bool:
+    """期待するステータス・ワーカーIDと一致すればTrue（Noneの条件は確認しない）"""
+    if expected_statuses is not None and task.get("status") not in expected_statuses:
+        return False
+    return expected_worker_id is None or task.get("worker_id") == expected_worker_id
+
+
+def _claim_fields(worker_id: str, lease_seconds: float, now: float) -> Dict[str, Any]:
+    return {"status": "running", "worker_id": worker_id, "lease_expires_at": now + lease_seconds}
+
+
+@runtime_checkable
+class TaskStore(Protocol):
+    """タスク状況ストアの共通インターフェース"""
+
+    # 他プロセスと共有されるストアならTrue（変化の検知にストアの再読み込みが必要）
+    shared: bool
+
+    async def create(self, task: Dict[str, Any]) -> None:
+        """タスクを登録（task_idを含む辞書）"""
+        ...
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """タスクを取得（存在しない場合はNone）"""
+        ...
+
+    async def list(self) -> List[Dict[str, Any]]:
+        """全タスクを取得"""
+        ...
+
+    async def update(
+        self,
+        task_id: str,
+        fields: Dict[str, Any],
+        expected_statuses: Optional[Iterable[str]] = None,
+        expected_worker_id: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        タスクをアトミックに更新
+
+        Args:
+            fields: 上書きするフィールド
+            expected_statuses: 指定時は現在のステータスがいずれかに一致する場合のみ更新
+            expected_worker_id: 指定時は実行権を持つワーカー（worker_id）が一致する場合のみ更新
+                （リース延長・結果の記録で、引き継がれた後のタスクを上書きしないため）
+
+        Returns:
+            Dict: 更新後のタスク（存在しない、またはステータス・ワーカーが一致しない場合はNone）
+        """
+        ...
+
+    async def delete(self, task_id: str, allowed_statuses: Iterable[str]) -> Optional[bool]:
+        """
+        ステータスが allowed_statuses のいずれかの場合のみアトミックに削除
+
+        Returns:
+            bool: 削除した場合True、ステータスが一致しない場合False、存在しない場合None
+        """
+        ...
+
+    async def claim(self, task_id: str, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        タスクの実行権を取得（未着手、またはリース切れの実行中タスクのみ）
+
+        Returns:
+            Dict: 取得後のタスク（他のワーカーが実行中の場合はNone）
+        """
+        ...
+
+    async def claim_orphaned(self, worker_id: str, lease_seconds: float, limit: int = 10) -> List[Dict[str, Any]]:
+        """リースが切れたタスクをまとめて引き継ぐ（実行していたワーカーが停止した場合など）"""
+        ...
+
+
+class InMemoryTaskStore:
+    """プロセス内の辞書によるタスク状況ストア（単一ワーカー用）"""
+
+    shared = False
+
+    def __init__(self):
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+
+    async def create(self, task: Dict[str, Any]) -> None:
+        self._tasks[task["task_id"]] = dict(task)
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        task = self._tasks.get(task_id)
+        return dict(task) if task is not None else None
+
+    async def list(self) -> List[Dict[str, Any]]:
+        return [dict(task) for task in self._tasks.values()]
+
+    async def update(
+        self,
+        task_id: str,
+        fields: Dict[str, Any],
+        expected_statuses: Optional[Iterable[str]] = None,
+        expected_worker_id: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        # イベントループ上でawaitを挟まないため、このブロックはアトミック
+        task = self._tasks.get(task_id)
+        if task is None:
+            return None
+        expected = tuple(expected_statuses) if expected_statuses is not None else None
+        if not _matches(task, expected, expected_worker_id):
+            return None
+        task.update(fields)
+        return dict(task)
+
+    async def delete(self, task_id: str, allowed_statuses: Iterable[str]) -> Optional[bool]:
+        task = self._tasks.get(task_id)
+        if task is None:
+            return None
+        if task.get("status") not in tuple(allowed_statuses):
+            return False
+        del self._tasks[task_id]
+        return True
+
+    async def claim(self, task_id: str, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        task = self._tasks.get(task_id)
+        if task is None or not _is_claimable(task, now):
+            return None
+        task.update(_claim_fields(worker_id, lease_seconds, now))
+        return dict(task)
+
+    async def claim_orphaned(self, worker_id: str, lease_seconds: float, limit: int = 10) -> List[Dict[str, Any]]:
+        now = time.time()
+        claimed = []
+        for task in self._tasks.values():
+            if len(claimed) >= limit:
+                break
+            if _is_orphaned(task, now):
+                task.update(_claim_fields(worker_id, lease_seconds, now))
+                claimed.append(dict(task))
+        return claimed
+
+
+class SQLiteTaskStore:
+    """WALモードのSQLiteによるタスク状況ストア（同一ホストの複数ワーカー用）"""
+
+    shared = True
+
+    def __init__(self, path: str = "task_store.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, "
+            "status TEXT NOT NULL, "
+            "lease_expires_at REAL NOT NULL DEFAULT 0, "
+            "data TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_tasks_status_lease ON tasks (status, lease_expires_at)"
+        )
+
+    def _transaction_sync(self, func):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def _transaction(self, func):
+        """
+        BEGIN IMMEDIATEで書き込みロックを取ってから読み書きする（プロセス間でアトミック）
+
+        ロック待ち・ディスクI/Oでイベントループを止めないようにスレッドで実行する
+        """
+        return await asyncio.to_thread(self._transaction_sync, func)
+
+    def _read(self, func):
+        with self._lock:
+            return func(self._conn)
+
+    @staticmethod
+    def _load(conn: sqlite3.Connection, task_id: str) -> Optional[Dict[str, Any]]:
+        row = conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @staticmethod
+    def _store(conn: sqlite3.Connection, task: Dict[str, Any]) -> None:
+        conn.execute(
+            "INSERT INTO tasks (task_id, status, lease_expires_at, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (task_id) DO UPDATE SET "
+            "status = excluded.status, lease_expires_at = excluded.lease_expires_at, data = excluded.data",
+            (task["task_id"], task["status"], task.get("lease_expires_at", 0), json.dumps(task, ensure_ascii=False))
+        )
+
+    async def create(self, task: Dict[str, Any]) -> None:
+        await self._transaction(lambda conn: self._store(conn, task))
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._read, lambda conn: self._load(conn, task_id))
+
+    async def list(self) -> List[Dict[str, Any]]:
+        rows = await asyncio.to_thread(self._read, lambda conn: conn.execute("SELECT data FROM tasks").fetchall())
+        return [json.loads(row[0]) for row in rows]
+
+    async def update(
+        self,
+        task_id: str,
+        fields: Dict[str, Any],
+        expected_statuses: Optional[Iterable[str]] = None,
+        expected_worker_id: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        expected = tuple(expected_statuses) if expected_statuses is not None else None
+
+        def apply(conn):
+            task = self._load(conn, task_id)
+            if task is None or not _matches(task, expected, expected_worker_id):
+                return None
+            task.update(fields)
+            self._store(conn, task)
+            return task
+
+        return await self._transaction(apply)
+
+    async def delete(self, task_id: str, allowed_statuses: Iterable[str]) -> Optional[bool]:
+        allowed = tuple(allowed_statuses)
+
+        def apply(conn):
+            task = self._load(conn, task_id)
+            if task is None:
+                return None
+            if task.get("status") not in allowed:
+                return False
+            conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+            return True
+
+        return await self._transaction(apply)
+
+    async def claim(self, task_id: str, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        def apply(conn):
+            now = time.time()
+            task = self._load(conn, task_id)
+            if task is None or not _is_claimable(task, now):
+                return None
+            task.update(_claim_fields(worker_id, lease_seconds, now))
+            self._store(conn, task)
+            return task
+
+        return await self._transaction(apply)
+
+    async def claim_orphaned(self, worker_id: str, lease_seconds: float, limit: int = 10) -> List[Dict[str, Any]]:
+        def apply(conn):
+            now = time.time()
+            placeholders = ",".join("?" for _ in ACTIVE_STATUSES)
+            rows = conn.execute(
+                f"SELECT data FROM tasks WHERE status IN ({placeholders}) AND lease_expires_at < ? LIMIT ?",
+                (*ACTIVE_STATUSES, now, limit)
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                task = json.loads(row[0])
+                task.update(_claim_fields(worker_id, lease_seconds, now))
+                self._store(conn, task)
+                claimed.append(task)
+            return claimed
+
+        return await self._transaction(apply)
+
+
+class RedisTaskStore:
+    """
+    Redisプロトコルのストアによるタスク状況ストア（複数ノード用）
+
+    状態遷移はWATCH/MULTI/EXECによる楽観的トランザクションで行うため、
+    WATCHに対応したRedis互換サーバー（ローカルの代替実装を含む）であれば差し替え可能。
+
+    - 実行前・実行中のタスクはリース期限をスコアにしたZSETで管理し、引き継ぎ対象を全件読まずに取得する
+    - 完了したタスクは ttl_seconds 後に期限切れにする（0の場合は残す）
+    """
+
+    shared = True
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "emotion-aggregator:task:",
+        ttl_seconds: int = 7 * 24 * 3600
+    ):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("TASK_STORE=redis には redis パッケージが必要です: pip install redis") from e
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self._index_key = f"{prefix}ids"
+        self._active_key = f"{prefix}active"
+        self.ttl_seconds = ttl_seconds
+
+    def _key(self, task_id: str) -> str:
+        return f"{self._prefix}{task_id}"
+
+    def _queue_store(self, pipe, task: Dict[str, Any]):
+        """タスクの書き込みと、実行前・実行中タスクのZSET（スコア: リース期限）の更新をパイプラインに追加"""
+        task_id = task["task_id"]
+        ttl = self.ttl_seconds if task.get("status") in TERMINAL_STATUSES and self.ttl_seconds > 0 else None
+        pipe.set(self._key(task_id), json.dumps(task, ensure_ascii=False), ex=ttl)
+        if task.get("status") in ACTIVE_STATUSES:
+            pipe.zadd(self._active_key, {task_id: task.get("lease_expires_at", 0)})
+        else:
+            pipe.zrem(self._active_key, task_id)
+
+    async def _transition(self, task_id: str, apply) -> Any:
+        """
+        WATCHしたタスクに apply を適用して書き戻す（競合時は再試行）
+
+        apply(task) は (書き戻すタスク or None, 戻り値) を返す。書き戻すタスクがNoneなら削除（task=Noneの場合は何もしない）
+        """
+        from redis.exceptions import WatchError
+
+        key = self._key(task_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    raw = await pipe.get(key)
+                    task = json.loads(raw) if raw is not None else None
+                    new_task, result = apply(task)
+                    pipe.multi()
+                    if new_task is not None:
+                        self._queue_store(pipe, new_task)
+                    elif task is None or result is True:
+                        # 削除したタスク・期限切れで消えたタスクを索引からも外す
+                        pipe.delete(key)
+                        pipe.srem(self._index_key, task_id)
+                        pipe.zrem(self._active_key, task_id)
+                    await pipe.execute()
+                    return result
+                except WatchError:
+                    continue
+
+    async def create(self, task: Dict[str, Any]) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            self._queue_store(pipe, task)
+            pipe.sadd(self._index_key, task["task_id"])
+            await pipe.execute()
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self._redis.get(self._key(task_id))
+        return json.loads(raw) if raw is not None else None
+
+    async def list(self) -> List[Dict[str, Any]]:
+        task_ids = list(await self._redis.smembers(self._index_key))
+        if not task_ids:
+            return []
+        raws = await self._redis.mget([self._key(task_id) for task_id in task_ids])
+        expired = [task_id for task_id, raw in zip(task_ids, raws) if raw is None]
+        if expired:
+            await self._redis.srem(self._index_key, *expired)
+        return [json.loads(raw) for raw in raws if raw is not None]
+
+    async def update(
+        self,
+        task_id: str,
+        fields: Dict[str, Any],
+        expected_statuses: Optional[Iterable[str]] = None,
+        expected_worker_id: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        expected = tuple(expected_statuses) if expected_statuses is not None else None
+
+        def apply(task):
+            if task is None or not _matches(task, expected, expected_worker_id):
+                return None, None
+            task.update(fields)
+            return task, task
+
+        return await self._transition(task_id, apply)
+
+    async def delete(self, task_id: str, allowed_statuses: Iterable[str]) -> Optional[bool]:
+        allowed = tuple(allowed_statuses)
+
+        def apply(task):
+            if task is None:
+                return None, None
+            return None, task.get("status") in allowed
+
+        return await self._transition(task_id, apply)
+
+    async def claim(self, task_id: str, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        def apply(task):
+            now = time.time()
+            if task is None or not _is_claimable(task, now):
+                return None, None
+            task.update(_claim_fields(worker_id, lease_seconds, now))
+            return task, task
+
+        return await self._transition(task_id, apply)
+
+    async def claim_orphaned(self, worker_id: str, lease_seconds: float, limit: int = 10) -> List[Dict[str, Any]]:
+        # リース期限が過ぎた実行前・実行中タスクだけをZSETから取得し、1件ずつアトミックに実行権を取得
+        task_ids = await self._redis.zrangebyscore(self._active_key, "-inf", f"({time.time()}", start=0, num=limit)
+        claimed = []
+        for task_id in task_ids:
+            task = await self.claim(task_id, worker_id, lease_seconds)
+            if task is not None:
+                claimed.append(task)
+        return claimed
+
+
+def create_task_store(backend: Optional[str] = None) -> TaskStore:
+    """
+    設定に応じたタスク状況ストアを生成
+
+    Args:
+        backend: "memory" / "sqlite" / "redis"。未指定時は環境変数TASK_STORE（デフォルト: memory）
+    """
+    backend = (backend or os.getenv("TASK_STORE", "memory")).lower()
+
+    if backend == "memory":
+        return InMemoryTaskStore()
+    if backend == "sqlite":
+        return SQLiteTaskStore(os.getenv("TASK_STORE_PATH", "task_store.db"))
+    if backend == "redis":
+        return RedisTaskStore(
+            os.getenv("TASK_STORE_URL", "redis://localhost:6379/0"),
+            ttl_seconds=int(os.getenv("TASK_TTL_SECONDS", str(7 * 24 * 3600)))
+        )
+
+    raise ValueError(
+        f"未対応のTASK_STOREです: {backend}（{', '.join(TASK_STORES)} のいずれかを指定してください）"
+    )